@@ -1,7 +1,13 @@
 from django.contrib import admin
-from .models import Trip, Expense, Debt
+from .models import Trip, Expense, Debt, ArchivedBalance, ArchivedExpense, FxRate, Job, Payment, Reminder
 
 # Register your models here so they appear in the admin site
 admin.site.register(Trip)
 admin.site.register(Expense)
-admin.site.register(Debt)
\ No newline at end of file
+admin.site.register(Debt)
+admin.site.register(FxRate)
+admin.site.register(Payment)
+admin.site.register(Reminder)
+admin.site.register(Job)
+admin.site.register(ArchivedExpense)
+admin.site.register(ArchivedBalance)
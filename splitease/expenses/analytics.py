@@ -0,0 +1,167 @@
+"""
+Spending analytics read from incrementally maintained rollups.
+
+SpendingRollup keeps one row per (trip, category, day, payer) with the total
+and count of the expenses behind it, in the trip's currency. The ledger bumps
+the matching row in the same transaction as it posts or reverses an expense,
+so the breakdowns never read the Expense table: however long a trip's
+history, it has at most days x categories x payers rollup rows.
+
+rebuild() recomputes the rollups from the expenses, for one trip or all of
+them, for when rows were changed behind the ledger's back (the admin, raw SQL).
+
+When trips are sharded a user's breakdown reads the rollups of every database
+at once and merges the rows.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Sum, Value
+
+from . import fx, sharding
+from .models import Expense, SpendingRollup, Trip
+from .money import Money, MoneyField
+
+BATCH_SIZE = 2000
+
+# Rollup fields each breakdown groups by
+DIMENSIONS = {
+    'by_category': ['category'],
+    'by_day': ['date'],
+    'by_member': ['paid_by_id', 'paid_by__username', 'paid_by__first_name'],
+}
+
+
+def record(expense, sign=1):
+    """Add a posted expense to its rollup row, or take it back out with sign=-1"""
+    key = {'trip_id': expense.trip_id, 'category': expense.category,
+           'date': expense.date, 'paid_by_id': expense.paid_by_id}
+    rollups = SpendingRollup.objects.filter(**key)
+    if sign > 0:
+        SpendingRollup.objects.bulk_create(
+            [SpendingRollup(currency=expense.trip.base_currency, **key)], ignore_conflicts=True,
+        )
+    amount = Money(sign * Money.coerce(expense.base_amount))
+    rollups.update(total=F('total') + Value(amount, output_field=MoneyField()), count=F('count') + sign)
+    if sign < 0:
+        rollups.filter(count__lte=0).delete()
+
+
+def rollup_rows(expenses):
+    """Aggregate expenses (each with .trip) into unsaved SpendingRollup rows"""
+    rows = {}
+    for expense in expenses:
+        key = (expense.trip_id, expense.category, expense.date, expense.paid_by_id)
+        row = rows.get(key)
+        if row is None:
+            row = rows[key] = SpendingRollup(
+                trip_id=expense.trip_id, category=expense.category, date=expense.date,
+                paid_by_id=expense.paid_by_id, currency=expense.trip.base_currency, total=0, count=0,
+            )
+        row.total += expense.base_amount
+        row.count += 1
+    return list(rows.values())
+
+
+def rebuild(trip=None):
+    """
+    Recompute the rollups of one trip, or of every trip, from the expenses.
+    Returns the number of rollup rows written.
+    """
+    if trip is not None:
+        with sharding.on_trip(trip.pk):
+            return _rebuild(trip.expense_history(), SpendingRollup.objects.filter(trip=trip))
+    written = 0
+    for alias in sharding.databases():
+        with sharding.using(alias):
+            # Archived trips' expenses have left the Expense table; their rollups stay as they are
+            written += _rebuild(Expense.objects.all(), SpendingRollup.objects.filter(trip__archived_at__isnull=True))
+    return written
+
+
+def _rebuild(expenses, rollups):
+    # auto_now_add dates every expense; only rows made by hand can lack one
+    groups = (expenses.filter(date__isnull=False)
+              .values('trip_id', 'category', 'date', 'paid_by_id', trip_currency=F('trip__base_currency'))
+              .annotate(total=Sum('base_amount'), count=Count('id'))
+              .order_by())
+
+    written = 0
+    with transaction.atomic(using=sharding.current()):
+        rollups.delete()
+        batch = []
+        for row in groups.iterator(chunk_size=BATCH_SIZE):
+            batch.append(SpendingRollup(currency=row.pop('trip_currency'), **row))
+            if len(batch) >= BATCH_SIZE:
+                written += len(SpendingRollup.objects.bulk_create(batch))
+                batch = []
+        written += len(SpendingRollup.objects.bulk_create(batch))
+    return written
+
+
+def _label(dimension, row):
+    if dimension == 'by_member':
+        return {'member_id': row['paid_by_id'], 'name': row['paid_by__first_name'] or row['paid_by__username']}
+    if dimension == 'by_day':
+        return {'date': row['date'].isoformat()}
+    return {'category': row['category']}
+
+
+def _breakdown_rows(rollups):
+    """The rollups summed per breakdown row and currency: one GROUP BY query for each breakdown"""
+    return {
+        name: list(rollups.values(*fields, 'currency')
+                   .annotate(total=Sum('total'), count=Sum('count'))
+                   .order_by(*fields, 'currency'))
+        for name, fields in DIMENSIONS.items()
+    }
+
+
+def _breakdowns(rows, currency):
+    """
+    Spending per category, per day and per payer in currency, from
+    _breakdown_rows(), plus at most one exchange rate lookup.
+    """
+    currencies = {row['currency'] for group in rows.values() for row in group}
+    known = fx.rates(currencies | {currency}) if currencies - {currency} else {}
+
+    result = {'currency': currency}
+    left_out = set()
+    for name, fields in DIMENSIONS.items():
+        grouped = {}
+        for row in rows[name]:
+            grouped.setdefault(tuple(row[field] for field in fields), []).append(row)
+        entries = []
+        for group in grouped.values():
+            total, missing = fx.total_in([(row['total'], row['currency']) for row in group], currency, known)
+            left_out.update(missing)
+            entries.append({**_label(name, group[0]), 'total': total, 'count': sum(row['count'] for row in group)})
+        result[name] = entries
+
+    result['total'] = str(Money(sum(entry['total'] for entry in result['by_category'])))
+    result['count'] = sum(entry['count'] for entry in result['by_category'])
+    for name in DIMENSIONS:
+        for entry in result[name]:
+            entry['total'] = str(entry['total'])
+    # Trips in currencies without an exchange rate yet aren't in the totals
+    result['unconverted_currencies'] = sorted(left_out)
+    return result
+
+
+def trip_breakdown(trip):
+    """Breakdowns of one trip's spending, in the trip's currency"""
+    rows = _breakdown_rows(SpendingRollup.objects.filter(trip=trip))
+    return {'trip_id': trip.id, **_breakdowns(rows, trip.base_currency)}
+
+
+def user_breakdown(user, currency=None):
+    """Breakdowns across every trip user is a member of, in currency (default HOME_CURRENCY)"""
+    rollups = SpendingRollup.objects.filter(trip__in=Trip.objects.filter(members=user).values('id'))
+    if not sharding.enabled():
+        return _breakdowns(_breakdown_rows(rollups), currency or settings.HOME_CURRENCY)
+    # Every database sums the trips it holds; rows for the same key add up in _breakdowns()
+    found = sharding.fan_out(lambda alias: _breakdown_rows(rollups.all()))
+    rows = {}
+    for name, fields in DIMENSIONS.items():
+        rows[name] = sorted((row for shard_rows in found for row in shard_rows[name]),
+                            key=lambda row: tuple(row[field] for field in (*fields, 'currency')))
+    return _breakdowns(rows, currency or settings.HOME_CURRENCY)
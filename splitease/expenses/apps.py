@@ -1,5 +1,11 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class ExpensesConfig(AppConfig):
     name = 'expenses'
+
+    def ready(self):
+        # Connect the cache invalidation receivers
+        from . import sharding, signals  # noqa: F401
+        post_migrate.connect(sharding.reserve_ids, sender=self)
@@ -0,0 +1,142 @@
+"""
+Archiving finished trips, so the tables every page reads stay small.
+
+Archiving a trip moves its expenses out of Expense, and their splits out of
+ExpenseSplit, into ArchivedExpense. The archived rows keep the same ids and
+fields, so the dashboard, the expense history and the exports read them
+through Trip.expense_history() as before, and search still finds them. The
+trip's ledger is folded into one 'archive' entry per member and its zeroed
+Debt rows are deleted. What each member had paid, owed and was left with is
+kept in ArchivedBalance.
+
+Balances, open debts and payments stay where they are, so members can still
+settle up an archived trip. No expense can be added to it or deleted from it.
+
+compact() deletes the zeroed Debt rows of live trips too. store_plan() zeroes
+a pair it no longer needs rather than deleting it, so the row can be reused
+by the next upsert. In a quiet trip nothing reuses it.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db.models import Exists, OuterRef, Sum
+from django.utils import timezone
+
+from . import sharding
+from .caching import trip_changed
+from .ledger import lock_trip
+from .models import (
+    ArchivedBalance, ArchivedExpense, Debt, Expense, ExpenseSplit, LedgerEntry, MemberBalance, Payment, Trip,
+)
+from .money import Money
+
+CHUNK_SIZE = 2000
+
+# Moved to ArchivedExpense as they are; shares are added from the splits
+FIELDS = ['id', 'trip_id', 'amount', 'currency', 'base_amount', 'paid_by_id', 'category', 'description', 'date',
+          'split_method']
+
+
+def _raw_delete(queryset):
+    # A plain DELETE: no rows loaded and no signal sent per row
+    return queryset._raw_delete(queryset.db)
+
+
+def _snapshot(trip):
+    """Store what every member had paid, owed and was left with"""
+    totals = defaultdict(lambda: {'paid': 0, 'share': 0, 'balance': 0})
+    for user_id, paid in (trip.expenses.values('paid_by_id').annotate(Sum('base_amount'))
+                          .values_list('paid_by_id', 'base_amount__sum').order_by()):
+        totals[user_id]['paid'] = paid
+    for user_id, share in (ExpenseSplit.objects.filter(expense__trip=trip).values('user_id').annotate(Sum('share'))
+                           .values_list('user_id', 'share__sum').order_by()):
+        totals[user_id]['share'] = share
+    for user_id, balance in MemberBalance.objects.filter(trip=trip).values_list('user_id', 'balance'):
+        totals[user_id]['balance'] = balance
+    ArchivedBalance.objects.bulk_create([
+        ArchivedBalance(trip=trip, user_id=user_id, **{field: Money(value) for field, value in row.items()})
+        for user_id, row in totals.items()
+    ])
+
+
+def _move_expenses(trip):
+    """Copy the trip's expenses with their splits into ArchivedExpense. Returns how many."""
+    ids = list(trip.expenses.order_by('id').values_list('id', flat=True))
+    for start in range(0, len(ids), CHUNK_SIZE):
+        chunk = ids[start:start + CHUNK_SIZE]
+        shares = defaultdict(dict)
+        for expense_id, user_id, share in (ExpenseSplit.objects.filter(expense_id__in=chunk)
+                                           .values_list('expense_id', 'user_id', 'share')):
+            shares[expense_id][str(user_id)] = int(share)
+        ArchivedExpense.objects.bulk_create([
+            ArchivedExpense(shares=shares[row['id']], **row)
+            for row in Expense.objects.filter(id__in=chunk).values(*FIELDS)
+        ])
+    return len(ids)
+
+
+def _fold_ledger(trip):
+    """Replace the trip's ledger entries with one per member holding their sum"""
+    sums = dict(LedgerEntry.objects.filter(trip=trip).values('user_id').annotate(Sum('amount'))
+                .values_list('user_id', 'amount__sum').order_by())
+    LedgerEntry.objects.filter(trip=trip).delete()
+    LedgerEntry.objects.bulk_create([
+        LedgerEntry(trip=trip, user_id=user_id, amount=Money(amount), kind='archive')
+        for user_id, amount in sums.items() if amount
+    ])
+
+
+def archive_trip(trip):
+    """
+    Archive trip: snapshot its balances, move its expenses to the archive and
+    drop what nothing will read again. Returns the number of expenses moved.
+    Raises ledger.TripArchived if the trip already is archived.
+    """
+    with sharding.atomic(trip):
+        lock_trip(trip, live=True)
+        _snapshot(trip)
+        moved = _move_expenses(trip)
+        _fold_ledger(trip)
+        ExpenseSplit.objects.filter(expense__trip=trip).delete()
+        # Nothing points at the expenses any more. Their archived copies keep their search index rows.
+        _raw_delete(Expense.objects.filter(trip=trip))
+        _raw_delete(Debt.objects.filter(trip=trip, amount=0))
+        trip.archived_at = timezone.now()
+        # Saved as a model, so the change log tells clients
+        trip.save(update_fields=['archived_at'])
+        trip_changed(trip.id)
+    return moved
+
+
+def idle_trips(days):
+    """Live trips with nothing owed and no expense or payment in the last days days"""
+    cutoff = timezone.now() - timedelta(days=days)
+    idle = (Trip.objects.filter(archived_at__isnull=True)
+            .exclude(Exists(Debt.objects.filter(trip=OuterRef('pk'), amount__gt=0)))
+            .exclude(Exists(Expense.objects.filter(trip=OuterRef('pk'), date__gte=cutoff.date())))
+            .exclude(Exists(Payment.objects.filter(trip=OuterRef('pk'), created_at__gte=cutoff)))
+            .exclude(created_at__gte=cutoff)
+            .order_by('id'))
+    if not sharding.enabled():
+        return idle
+    # Each database answers for the trips whose rows it holds
+    ids = sharding.fan_out(lambda alias: list(sharding.local_trips(idle, alias).values_list('id', flat=True)))
+    return Trip.objects.filter(id__in=[trip_id for found in ids for trip_id in found]).order_by('id')
+
+
+def compact(trip_ids=None):
+    """
+    Delete the zeroed Debt rows of trip_ids (default every trip), each trip
+    under its lock so a post can't be bumping a row as it goes. Returns the
+    number of rows deleted.
+    """
+    zeroed = Debt.objects.filter(amount=0)
+    if trip_ids is not None:
+        zeroed = zeroed.filter(trip_id__in=trip_ids)
+    deleted = 0
+    for found in sharding.fan_out(lambda alias: list(zeroed.values_list('trip_id', flat=True).order_by().distinct())):
+        for trip in list(Trip.objects.filter(id__in=found).only('id')):
+            with sharding.atomic(trip):
+                lock_trip(trip)
+                deleted += _raw_delete(Debt.objects.filter(trip=trip, amount=0))
+    return deleted
@@ -0,0 +1,389 @@
+"""
+View benchmarks driven through the Django test client.
+
+Each scale seeds synthetic data, then times the hot views and records, per
+view, p50/p95 latency, the number of SQL queries and peak Python memory.
+run_benchmarks wraps this in throwaway databases, default's and every shard's,
+so it never touches real data.
+
+compare_handlers() measures throughput instead: many concurrent clients poll
+the read-heavy pages, once through the WSGI handler (a thread per client) and
+once through the ASGI handler (one event loop for all of them).
+
+compare_money() puts the old Decimal money path against integer paise for the
+hot money work: summing amounts in Python and in SQL, reading amount columns
+back, and splitting expenses.
+"""
+import asyncio
+import copy
+import random
+import sqlite3
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from decimal import Context, Decimal
+
+from asgiref.sync import ThreadSensitiveContext
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.models import Count
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from . import sharding, synthetic
+from .ledger import create_expense
+from .models import Expense, Trip
+from .money import Money
+from .settlement import settlement_plan
+from .splits import Split, allocate_paise, to_paise
+
+# users, trips, members per trip, expenses per trip
+SCALES = {
+    'small': (20, 5, 4, 50),
+    'medium': (200, 40, 8, 500),
+    'large': (1000, 100, 15, 2000),
+}
+
+
+def parse_scale(spec):
+    """'small' or an explicit 'users:trips:members:expenses'"""
+    if spec in SCALES:
+        return spec, SCALES[spec]
+    users, trips, members, expenses = (int(part) for part in spec.split(':'))
+    return spec, (users, trips, members, expenses)
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+@contextmanager
+def throwaway_database():
+    """
+    Run against freshly migrated test databases, destroyed afterwards. With
+    sharding on every shard gets one too: the synthetic trips are placed on
+    shards, and their copies of users and trips must not land on the real ones.
+    """
+    created = []
+    try:
+        for alias in sharding.databases():
+            connection = connections[alias]
+            old_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            created.append((connection, old_name))
+        yield
+    finally:
+        for connection, old_name in reversed(created):
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def flush():
+    """Empty every database, default and the shards"""
+    for alias in sharding.databases():
+        call_command('flush', database=alias, interactive=False, verbosity=0)
+
+
+@contextmanager
+def capture_queries():
+    """
+    The queries run inside the block on every database, as {'sql', 'alias'}
+    dicts: with sharding on, a trip's go to its shard, and fan_out() reads
+    every database from threads of its own, on connections opened there.
+    """
+    queries = []
+    wrapped = []
+
+    def record(execute, sql, params, many, context):
+        queries.append({'sql': sql, 'alias': context['connection'].alias})
+        return execute(sql, params, many, context)
+
+    def wrap(sender, connection, **kwargs):
+        if record not in connection.execute_wrappers:
+            connection.execute_wrappers.append(record)
+            wrapped.append(connection)
+
+    for alias in sharding.databases():
+        wrap(None, connections[alias])
+    connection_created.connect(wrap, weak=False)
+    try:
+        yield queries
+    finally:
+        connection_created.disconnect(wrap)
+        for connection in wrapped:
+            connection.execute_wrappers.remove(record)
+
+
+def measure(request, iterations, cached=False, prepare=None):
+    """
+    Call request() repeatedly and summarise latency, queries and peak memory.
+    prepare(), if given, runs untimed before each call and its result is passed in.
+    """
+    timings = []
+    queries = []
+    peaks = []
+    for _ in range(iterations):
+        if not cached:
+            cache.clear()
+        args = prepare() if prepare else ()
+        tracemalloc.start()
+        with capture_queries() as captured:
+            started = time.perf_counter()
+            response = request(*args)
+            timings.append((time.perf_counter() - started) * 1000)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        queries.append(len(captured))
+        if response.status_code >= 400:
+            raise RuntimeError(f"Benchmark request failed with {response.status_code}")
+    return {
+        'iterations': iterations,
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'queries': max(queries),
+        'peak_kb': round(max(peaks) / 1024, 1),
+    }
+
+
+def biggest_trip():
+    """The trip with the most expenses, whichever database holds them; the lowest id on a tie"""
+    sizes = sharding.gather(Expense.objects.values('trip_id').annotate(size=Count('id'))
+                            .values_list('trip_id', 'size').order_by())
+    return Trip.objects.get(id=min(sizes, key=lambda row: (-row[1], row[0]))[0])
+
+
+def run_scale(name, params, iterations=20, cached=False, seed=0):
+    """Seed one scale into the current database and benchmark the views on it"""
+    users, trips, members, expenses = params
+    started = time.perf_counter()
+    seeded = synthetic.seed(users=users, trips=trips, members_per_trip=members,
+                            expenses_per_trip=expenses, seed=seed, prefix=f'bench{name}'.replace(':', '_'))
+    seed_seconds = time.perf_counter() - started
+
+    # Benchmark the biggest trip, seen by the member who belongs to the most trips
+    trip = biggest_trip()
+    user = trip.members.annotate(trip_count=Count('trips')).order_by('-trip_count', 'id').first()
+    member_ids = list(trip.members.values_list('id', flat=True))
+
+    client = Client()
+    client.force_login(user)
+
+    def next_settlement():
+        # Settle whatever the plan currently says, logged in as that payment's creditor
+        with sharding.on_trip(trip.id):
+            plan = settlement_plan(trip)
+            if not plan:
+                create_expense(trip, user, Decimal('1000'), 'Benchmark top-up', 'Other')
+                plan = settlement_plan(trip)
+        creditor = Client()
+        creditor.force_login(trip.members.get(id=plan[0].creditor_id))
+        return creditor, reverse('settle_debt_simplified',
+                                 args=[trip.id, plan[0].debtor_id, plan[0].creditor_id])
+
+    payers = iter(range(10 ** 9))
+    views = {
+        'home': (lambda: client.get(reverse('home')), None),
+        'trip_dashboard': (lambda: client.get(reverse('trip_dashboard', args=[trip.id])), None),
+        'add_expense': (lambda: client.post(reverse('add_expense', args=[trip.id]), {
+            'description': 'Benchmark dinner', 'amount': '1234.50',
+            'payer': member_ids[next(payers) % len(member_ids)], 'category': 'Food',
+        }), None),
+        'create_trip': (lambda: client.post(reverse('create_trip'), {
+            'name': 'Benchmark trip',
+            'member_names[]': [f'Guest {i}' for i in range(10)],
+            'member_whatsapp[]': [f'+9170000{i:05}' for i in range(10)],
+        }), None),
+        'settle_debt_simplified': (lambda creditor, url: creditor.post(url), next_settlement),
+    }
+    return {
+        'scale': name,
+        'params': dict(zip(['users', 'trips', 'members_per_trip', 'expenses_per_trip'], params)),
+        'seeded': seeded,
+        'seed_seconds': round(seed_seconds, 3),
+        'views': {view: measure(request, iterations, cached, prepare)
+                  for view, (request, prepare) in views.items()},
+    }
+
+
+def run(scales, iterations=20, cached=False, seed=0):
+    """Benchmark every scale in its own throwaway database"""
+    results = []
+    with throwaway_database():
+        for spec in scales:
+            name, params = parse_scale(spec)
+            flush()
+            results.append(run_scale(name, params, iterations, cached, seed))
+    return {'iterations': iterations, 'cached': cached, 'results': results}
+
+
+NO_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+
+def polling_urls(trip):
+    return [
+        reverse('home'),
+        reverse('trip_dashboard', args=[trip.id]),
+        reverse('trip_summary_json', args=[trip.id]),
+    ]
+
+
+def _throughput(timings, elapsed):
+    return {
+        'requests': len(timings),
+        'requests_per_second': round(len(timings) / elapsed, 1),
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+    }
+
+
+def _checked(response):
+    if response.status_code >= 400:
+        raise RuntimeError(f"Benchmark request failed with {response.status_code}")
+
+
+def wsgi_throughput(urls, cookies, clients, requests_per_client):
+    """Every client on its own thread, as a threaded WSGI server would run them"""
+    def poll(number):
+        client = Client()
+        client.cookies = copy.deepcopy(cookies)
+        timings = []
+        for i in range(requests_per_client):
+            started = time.perf_counter()
+            _checked(client.get(urls[(number + i) % len(urls)]))
+            timings.append((time.perf_counter() - started) * 1000)
+        return timings
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        timings = [ms for result in pool.map(poll, range(clients)) for ms in result]
+    return _throughput(timings, time.perf_counter() - started)
+
+
+def asgi_throughput(urls, cookies, clients, requests_per_client):
+    """Every client as a task on one event loop, as a single ASGI worker would run them"""
+    async def poll(number):
+        client = AsyncClient()
+        client.cookies = copy.deepcopy(cookies)
+        timings = []
+        for i in range(requests_per_client):
+            started = time.perf_counter()
+            # The ASGI handler gives each request its own thread for sync work; do the same
+            async with ThreadSensitiveContext():
+                _checked(await client.get(urls[(number + i) % len(urls)]))
+            timings.append((time.perf_counter() - started) * 1000)
+        return timings
+
+    async def run_all():
+        started = time.perf_counter()
+        results = await asyncio.gather(*(poll(number) for number in range(clients)))
+        return [ms for result in results for ms in result], time.perf_counter() - started
+
+    timings, elapsed = asyncio.run(run_all())
+    return _throughput(timings, elapsed)
+
+
+def compare_handlers_on(trip, user, concurrency=(1, 8, 32), requests_per_client=20, cached=False):
+    """WSGI against ASGI throughput for the polling pages of one trip, as one of its members"""
+    login = Client()
+    login.force_login(user)
+    urls = polling_urls(trip)
+    results = []
+    with override_settings(**({} if cached else {'CACHES': NO_CACHE})):
+        for clients in concurrency:
+            results.append({
+                'clients': clients,
+                'wsgi': wsgi_throughput(urls, login.cookies, clients, requests_per_client),
+                'asgi': asgi_throughput(urls, login.cookies, clients, requests_per_client),
+            })
+    return results
+
+
+def compare_handlers(scale='small', concurrency=(1, 8, 32), requests_per_client=20, cached=False, seed=0):
+    """Seed one scale into a throwaway database and compare the handlers on it"""
+    name, (users, trips, members, expenses) = parse_scale(scale)
+    with throwaway_database():
+        synthetic.seed(users=users, trips=trips, members_per_trip=members,
+                       expenses_per_trip=expenses, seed=seed, prefix='handlers')
+        trip = biggest_trip()
+        user = trip.members.order_by('id').first()
+        results = compare_handlers_on(trip, user, concurrency, requests_per_client, cached)
+    return {'scale': name, 'requests_per_client': requests_per_client, 'cached': cached,
+            'urls': ['home', 'trip_dashboard', 'trip_summary_json'], 'results': results}
+
+
+def _best_rate(operations, function, repeats):
+    """Operations per second of function's fastest run"""
+    best = min(_timed(function) for _ in range(repeats))
+    return round(operations / best, 1)
+
+
+def _timed(function):
+    started = time.perf_counter()
+    function()
+    return time.perf_counter() - started
+
+
+def _decimal_shares(amount, split):
+    # The split engine as it was when amounts were Decimal rupees at both ends
+    return {user_id: Decimal(paise).scaleb(-2)
+            for user_id, paise in allocate_paise(to_paise(amount), split).items()}
+
+
+def compare_money(rows=200_000, expenses=20_000, members=6, repeats=5, seed=0):
+    """
+    Decimal rupees against integer paise, each measured best of repeats.
+    The SQL side uses an in-memory SQLite table holding both a decimal column, as
+    Django stored DecimalFields, and an integer one, as MoneyField stores them.
+    """
+    rng = random.Random(seed)
+    paise = [rng.randint(100, 1_500_000) for _ in range(rows)]
+    as_decimal = [Decimal(p).scaleb(-2) for p in paise]
+    as_money = [Money(p) for p in paise]
+
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE amounts (rupees decimal NOT NULL, paise integer NOT NULL)')
+    db.executemany('INSERT INTO amounts VALUES (?, ?)', [(str(d), p) for d, p in zip(as_decimal, paise)])
+    # What Django's SQLite backend does to every decimal it reads back
+    cent, context = Decimal('0.01'), Context(prec=12)
+
+    def read_decimal(sql):
+        return [context.create_decimal_from_float(value).quantize(cent) for (value,) in db.execute(sql)]
+
+    def read_money(sql):
+        return [Money(value) for (value,) in db.execute(sql)]
+
+    splits = [(p, Split('equal', list(range(1, rng.randint(2, members) + 1)))) for p in paise[:expenses]]
+    decimal_splits = [(Decimal(p).scaleb(-2), split) for p, split in splits]
+    money_splits = [(Money(p), split) for p, split in splits]
+
+    work = {
+        'python_sum': (rows, lambda: sum(as_decimal), lambda: sum(as_money)),
+        'sql_sum': (1, lambda: read_decimal('SELECT SUM(rupees) FROM amounts'),
+                    lambda: read_money('SELECT SUM(paise) FROM amounts')),
+        'sql_read': (rows, lambda: read_decimal('SELECT rupees FROM amounts'),
+                     lambda: read_money('SELECT paise FROM amounts')),
+        'equal_split': (expenses, lambda: [_decimal_shares(a, s) for a, s in decimal_splits],
+                        lambda: [{u: Money(p) for u, p in allocate_paise(int(a), s).items()}
+                                 for a, s in money_splits]),
+    }
+    results = []
+    for operation, (operations, decimal_path, paise_path) in work.items():
+        before = _best_rate(operations, decimal_path, repeats)
+        after = _best_rate(operations, paise_path, repeats)
+        results.append({'operation': operation, 'decimal_per_second': before, 'paise_per_second': after,
+                        'speedup': round(after / before, 2)})
+
+    # Decimal columns are floats to SQLite, so big sums pick up binary rounding error
+    (float_sum,), = db.execute('SELECT SUM(rupees) FROM amounts')
+    (paise_sum,), = db.execute('SELECT SUM(paise) FROM amounts')
+    db.close()
+    return {
+        'rows': rows, 'expenses': expenses, 'repeats': repeats, 'results': results,
+        'sql_sum_error_paise': abs(round(Decimal(float_sum) * 100 - paise_sum, 4)),
+    }
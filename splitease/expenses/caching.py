@@ -0,0 +1,118 @@
+"""
+Page caches and their invalidation.
+
+Writes to a trip call trip_changed(). Once the surrounding transaction commits
+that bumps the trip's version counter, which retires every cached dashboard
+and summary of the trip (their keys include the version), and forgets the
+cached home page of every member. Readers never see a cached page that is
+older than the data underneath it.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.dispatch import Signal
+
+from . import sharding
+from .models import Trip
+
+HOME_TIMEOUT = 60 * 15
+
+# Sent with trip_id once a change to the trip has committed and its caches are retired
+trip_committed = Signal()
+TRIP_PAGE_TIMEOUT = 60 * 60
+
+
+def home_key(user_id):
+    return f'splitease:home:{user_id}'
+
+
+def _version_key(trip_id):
+    return f'splitease:trip-version:{trip_id}'
+
+
+def trip_version(trip_id):
+    """
+    Current version of a trip's data.
+    Versions start from the clock, so a counter lost to cache eviction comes
+    back with a value no earlier page could have been cached under.
+    """
+    key = _version_key(trip_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+async def atrip_version(trip_id):
+    """Async version of trip_version()"""
+    key = _version_key(trip_id)
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, time.time_ns(), None)
+        version = await cache.aget(key)
+    return version
+
+
+def bump_trip_version(trip_id):
+    try:
+        cache.incr(_version_key(trip_id))
+    except ValueError:
+        cache.set(_version_key(trip_id), time.time_ns(), None)
+
+
+def viewer_token(request):
+    """
+    Who a rendered page was made for: the user plus their CSRF cookie, since
+    cached forms carry a token that only works with that cookie.
+    Returns None when the page can't be reused (no CSRF cookie yet).
+    """
+    csrf_cookie = request.COOKIES.get(settings.CSRF_COOKIE_NAME)
+    if not csrf_cookie:
+        return None
+    digest = hashlib.sha256(csrf_cookie.encode()).hexdigest()[:16]
+    return f"{request.user.pk or 'anon'}-{digest}"
+
+
+def dashboard_key(trip_id, version, viewer):
+    return f'splitease:dashboard:{trip_id}:{version}:{viewer}'
+
+
+def trip_summary_key(trip_id, version):
+    return f'splitease:trip-summary:{trip_id}:{version}'
+
+
+def invalidate_users(user_ids):
+    cache.delete_many([home_key(user_id) for user_id in user_ids])
+
+
+class _InvalidateTrip:
+    """on_commit callback; remembers its trip so repeated writes queue it only once"""
+
+    def __init__(self, trip_id, user_ids=()):
+        self.trip_id = trip_id
+        self.user_ids = set(user_ids)
+
+    def __call__(self):
+        bump_trip_version(self.trip_id)
+        members = Trip.members.through.objects.filter(trip_id=self.trip_id)
+        invalidate_users(set(members.values_list('user_id', flat=True)) | self.user_ids)
+        trip_committed.send(sender=Trip, trip_id=self.trip_id)
+
+
+def trip_changed(trip_id, user_ids=()):
+    """
+    Retire the trip's cached pages and its members' home pages once the
+    current transaction commits.
+    Pass user_ids for people who are leaving the trip in this same transaction.
+    """
+    # The transaction to wait for is on the trip's database when trips are sharded
+    using = sharding.current()
+    if not user_ids:
+        for _, callback, _ in connections[using].run_on_commit:
+            if isinstance(callback, _InvalidateTrip) and callback.trip_id == trip_id:
+                return
+    transaction.on_commit(_InvalidateTrip(trip_id, user_ids), using=using)
@@ -0,0 +1,200 @@
+"""
+Change log and delta sync for mobile clients.
+
+Every insert, update and delete of a trip, its memberships, its TripMember rows
+and its expenses adds a Change row in the same transaction (the receivers are
+in signals.py). Debts change in bulk with every expense and settlement, so the
+ledger logs a single 'debts' change for the trip and a sync sends that trip's
+open debts whole; there are never more than a few per member.
+
+A client keeps the id of the last change it has seen as its cursor and asks
+sync(user, since=cursor) for what happened after it. The changes are folded
+(the last action on each row wins), the current rows are read in a fixed
+number of queries, and only what changed goes back. With no cursor, or when
+the user has joined a trip since, the trip comes as a full snapshot (read
+from the archive for an archived trip; archiving itself shows up as an update
+to the trip, not as its expenses being deleted).
+
+With sharded trips the log stays in default and the rows are read from every
+database at once (ids are unique across them). A change to rows on a shard
+is logged once the shard's transaction commits, so one rolled back leaves no
+change behind; changes to rows in default go in with them, as before.
+
+Writers commit in id order on SQLite, which takes one writer at a time, so a
+cursor never skips a change. On databases with concurrent writers a change
+can commit after a later one; clients there should ask again from a cursor a
+little behind the newest.
+"""
+from django.db import transaction
+from django.db.models import Max, Q
+
+from . import sharding
+from .models import ArchivedExpense, Change, Debt, Expense, Trip, TripMember
+
+SYNC_LIMIT = 500
+MAX_SYNC_LIMIT = 2000
+
+
+def _log(changes, using):
+    """
+    Insert changes to rows in database using (default the one trip rows go to
+    here): now if that is default, else once its transaction commits.
+    """
+    using = using or sharding.current()
+    if using == sharding.DEFAULT:
+        Change.objects.bulk_create(changes)
+    else:
+        transaction.on_commit(lambda: Change.objects.bulk_create(changes), using=using)
+
+
+def record(trip_id, model, object_id, action, using=None):
+    """Log one change to a trip, TripMember or expense. One INSERT."""
+    _log([Change(trip_id=trip_id, model=model, object_id=object_id, action=action)], using)
+
+
+def members_changed(trip_id, user_ids, action):
+    """
+    Log users joining or leaving a trip. One INSERT. The rows carry the user
+    too, so someone who has left still hears about it.
+    """
+    _log([
+        Change(trip_id=trip_id, model='membership', object_id=user_id, action=action, user_id=user_id)
+        for user_id in user_ids
+    ], sharding.DEFAULT)
+
+
+def debts_changed(trip_ids, using=None):
+    """Log that the debts of trip_ids were rewritten. One INSERT."""
+    _log([Change(trip_id=trip_id, model='debts', action='update') for trip_id in trip_ids], using)
+
+
+def _fold(changes, user_id):
+    """Last action per row, and the trips that user joined or left"""
+    latest = {}
+    for change in changes:
+        latest[(change.model, change.trip_id, change.object_id)] = change.action
+    upserts = {model: set() for model, _ in Change.MODELS}
+    deletes = {model: set() for model, _ in Change.MODELS}
+    joined = set()
+    left = set()
+    for (model, trip_id, object_id), action in latest.items():
+        if model == 'membership' and object_id == user_id:
+            (left if action == 'delete' else joined).add(trip_id)
+        elif model == 'trip' and action == 'delete':
+            left.add(trip_id)
+        elif model == 'membership':
+            (deletes if action == 'delete' else upserts)[model].add((trip_id, object_id))
+        elif model == 'debts':
+            upserts[model].add(trip_id)
+        else:
+            (deletes if action == 'delete' else upserts)[model].add(object_id)
+    return upserts, deletes, joined - left, left
+
+
+def _by_id(rows):
+    """The rows of a values() queryset from every database, by id"""
+    return sorted(sharding.gather(rows), key=lambda row: row['id'])
+
+
+def _trips(trip_ids):
+    if not trip_ids:
+        return []
+    return list(Trip.objects.filter(id__in=trip_ids).order_by('id')
+                .values('id', 'name', 'description', 'base_currency', 'created_by_id', 'archived_at'))
+
+
+def _members(pairs=(), trip_ids=()):
+    """Memberships as {'trip', 'user', 'name'}, for (trip_id, user_id) pairs and for whole trips"""
+    if not pairs and not trip_ids:
+        return []
+    query = Q(trip_id__in=trip_ids)
+    if pairs:
+        query |= Q(trip_id__in={t for t, _ in pairs}, user_id__in={u for _, u in pairs})
+    rows = (Trip.members.through.objects.filter(query)
+            .values_list('trip_id', 'user_id', 'user__first_name', 'user__username'))
+    return [{'trip': trip_id, 'user': user_id, 'name': first_name or username}
+            for trip_id, user_id, first_name, username in rows
+            if trip_id in trip_ids or (trip_id, user_id) in pairs]
+
+
+def _trip_members(ids=(), trip_ids=()):
+    if not ids and not trip_ids:
+        return []
+    rows = TripMember.objects.filter(Q(id__in=ids) | Q(trip_id__in=trip_ids)).order_by('id')
+    return [{'id': row['id'], 'trip': row['trip_id'], 'user': row['user_id'], 'name': row['name']}
+            for row in _by_id(rows.values('id', 'trip_id', 'user_id', 'name'))]
+
+
+def _expenses(ids=(), trip_ids=(), archived=()):
+    """Expenses by id and of whole trips; those of archived trips come from the archive"""
+    fields = ('id', 'trip_id', 'description', 'category', 'amount', 'currency', 'base_amount',
+              'date', 'paid_by_id', 'split_method')
+    rows = []
+    if ids or set(trip_ids) - set(archived):
+        rows += _by_id(Expense.objects.filter(Q(id__in=ids) | Q(trip_id__in=set(trip_ids) - set(archived)))
+                       .order_by('id').values(*fields))
+    if archived:
+        rows += _by_id(ArchivedExpense.objects.filter(trip_id__in=archived).order_by('id').values(*fields))
+    return [{
+        'id': row['id'], 'trip': row['trip_id'], 'description': row['description'], 'category': row['category'],
+        'amount': str(row['amount']), 'currency': row['currency'], 'base_amount': str(row['base_amount']),
+        'date': row['date'].isoformat() if row['date'] else None, 'paid_by': row['paid_by_id'],
+        'split_method': row['split_method'],
+    } for row in rows]
+
+
+def _debts(trip_ids):
+    if not trip_ids:
+        return []
+    debts = {trip_id: [] for trip_id in sorted(trip_ids)}
+    rows = (Debt.objects.filter(trip_id__in=trip_ids, amount__gt=0).order_by('id')
+            .values_list('id', 'trip_id', 'from_user_id', 'to_user_id', 'amount'))
+    for _, trip_id, from_id, to_id, amount in sorted(sharding.gather(rows)):
+        debts[trip_id].append({'from': from_id, 'to': to_id, 'amount': str(amount)})
+    return [{'trip': trip_id, 'items': items} for trip_id, items in debts.items()]
+
+
+def sync(user, since=None, limit=SYNC_LIMIT):
+    """
+    Changes to user's trips after cursor since, at most limit of them, as a
+    compact JSON-ready dict. Keys with nothing in them are left out; 'more'
+    says to ask again straight away from the returned cursor.
+    """
+    trip_ids = set(Trip.objects.filter(members=user).values_list('id', flat=True))
+    latest = Change.objects.aggregate(Max('id'))['id__max'] or 0
+    if since is None:
+        snapshot = trip_ids
+        upserts = {model: set() for model, _ in Change.MODELS}
+        deletes = {model: set() for model, _ in Change.MODELS}
+        left = set()
+        cursor, more = latest, False
+    else:
+        changes = list(Change.objects.filter(id__gt=since, id__lte=latest)
+                       .filter(Q(trip_id__in=trip_ids) | Q(user_id=user.id))
+                       .order_by('id')[:limit + 1])
+        more = len(changes) > limit
+        changes = changes[:limit]
+        cursor = changes[-1].id if more else latest
+        upserts, deletes, snapshot, left = _fold(changes, user.id)
+        # Trips joined since come whole; changes to trips since left don't matter
+        snapshot &= trip_ids
+        for model in ('trip', 'debts'):
+            upserts[model] -= snapshot | left
+        upserts['membership'] = {(t, u) for t, u in upserts['membership'] if t not in snapshot | left}
+
+    trips = _trips(upserts['trip'] | snapshot)
+    archived = {trip['id'] for trip in trips if trip['archived_at']} & snapshot
+    result = {
+        'cursor': str(cursor),
+        'more': more,
+        'trips': trips,
+        'deleted_trips': sorted(left),
+        'members': _members(upserts['membership'], snapshot),
+        'removed_members': [{'trip': t, 'user': u} for t, u in sorted(deletes['membership'])],
+        'trip_members': _trip_members(upserts['tripmember'], snapshot),
+        'deleted_trip_members': sorted(deletes['tripmember']),
+        'expenses': _expenses(upserts['expense'], snapshot, archived),
+        'deleted_expenses': sorted(deletes['expense']),
+        'debts': _debts(upserts['debts'] | snapshot),
+    }
+    return {key: value for key, value in result.items() if value or key in ('cursor', 'more')}
@@ -0,0 +1,118 @@
+"""
+Streaming exports of a trip: expenses, member balances, the settlement plan,
+the payments members have made and, for archived trips, the final balances.
+
+Rows are read with .iterator() in chunks and turned into text as they go, so
+memory stays flat whatever the trip size and the first bytes leave before the
+last row has been read. Both the download views and the export_trip command
+consume these generators. Every query hangs off the trip, so with sharded
+trips it goes to the trip's shard.
+"""
+import csv
+import json
+
+from .money import Money
+from .settlement import simplify
+
+CHUNK_SIZE = 2000
+
+SECTIONS = {
+    'expenses': ['id', 'date', 'description', 'category', 'amount', 'currency', 'base_amount', 'paid_by'],
+    'balances': ['user_id', 'username', 'balance'],
+    'settlements': ['from_user_id', 'to_user_id', 'amount'],
+    'payments': ['id', 'created_at', 'from_user_id', 'to_user_id', 'amount'],
+    # Only archived trips have these: what each member stood at when the trip was archived
+    'final_balances': ['user_id', 'username', 'paid', 'share', 'balance'],
+}
+
+
+def expense_rows(trip):
+    expenses = (trip.expense_history().order_by('date', 'id')
+                .values_list('id', 'date', 'description', 'category', 'amount', 'currency', 'base_amount',
+                             'paid_by__username'))
+    for row in expenses.iterator(chunk_size=CHUNK_SIZE):
+        yield dict(zip(SECTIONS['expenses'], row))
+
+
+def balance_rows(trip):
+    balances = (trip.balances.order_by('user_id')
+                .values_list('user_id', 'user__username', 'balance'))
+    for row in balances.iterator(chunk_size=CHUNK_SIZE):
+        yield dict(zip(SECTIONS['balances'], row))
+
+
+def settlement_rows(trip):
+    balances = trip.balances.values_list('user_id', 'balance')
+    for transfer in simplify(dict(balances.iterator(chunk_size=CHUNK_SIZE))):
+        yield dict(zip(SECTIONS['settlements'], transfer))
+
+
+def payment_rows(trip):
+    payments = (trip.payments.order_by('created_at', 'id')
+                .values_list('id', 'created_at', 'from_user_id', 'to_user_id', 'amount'))
+    for row in payments.iterator(chunk_size=CHUNK_SIZE):
+        yield dict(zip(SECTIONS['payments'], row))
+
+
+def final_balance_rows(trip):
+    balances = (trip.archived_balances.order_by('user_id')
+                .values_list('user_id', 'user__username', 'paid', 'share', 'balance'))
+    for row in balances.iterator(chunk_size=CHUNK_SIZE):
+        yield dict(zip(SECTIONS['final_balances'], row))
+
+
+ROWS = {
+    'expenses': expense_rows,
+    'balances': balance_rows,
+    'settlements': settlement_rows,
+    'payments': payment_rows,
+    'final_balances': final_balance_rows,
+}
+
+
+class Echo:
+    """File-like object whose write() hands the line back instead of storing it"""
+
+    def write(self, value):
+        return value
+
+
+def _batched(lines):
+    # One write to the socket per chunk of rows, not per row
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= CHUNK_SIZE:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
+
+
+def stream_csv(trip, section):
+    """CSV text for one section, header first"""
+    writer = csv.writer(Echo())
+    fields = SECTIONS[section]
+
+    def lines():
+        yield writer.writerow(fields)
+        for row in ROWS[section](trip):
+            yield writer.writerow([row[field] for field in fields])
+
+    return _batched(lines())
+
+
+def _json_value(value):
+    # Money is an int underneath, which json would write out as bare paise
+    return str(value) if isinstance(value, Money) else value
+
+
+def stream_ndjson(trip, sections=tuple(SECTIONS)):
+    """One JSON object per line, tagged with the section it came from"""
+    def lines():
+        for section in sections:
+            for row in ROWS[section](trip):
+                row = {field: _json_value(value) for field, value in row.items()}
+                yield json.dumps({'type': section[:-1], **row}, default=str) + '\n'
+
+    return _batched(lines())
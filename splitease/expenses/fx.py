@@ -0,0 +1,167 @@
+"""
+Exchange rates for trips that cross borders.
+
+Rates live in the FxRate table, loaded from a local CSV by the load_fx_rates
+command. A row says what one unit of a currency was worth in rupees (the
+pivot) on a date, so any pair converts through the pivot, and a day uses the
+latest rate on or before it.
+
+Lookups go through an in-process LRU cache keyed by (currency, day). Rates are
+asked for a set of currencies at a time and whichever aren't cached yet come
+from one query, so a page converting thousands of rows pays for one lookup at
+most. Totals are added up per currency before converting (see total_in), so
+the conversion is one multiplication per currency, never one per row.
+"""
+import csv
+import threading
+from collections import OrderedDict
+from datetime import date
+from decimal import ROUND_HALF_EVEN, Decimal
+
+from django.conf import settings
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from .models import FxRate
+from .money import CURRENCIES, DEFAULT_CURRENCY, Money
+
+PIVOT = DEFAULT_CURRENCY
+KNOWN_CURRENCIES = {code for code, _ in CURRENCIES}
+
+
+class MissingRate(LookupError):
+    """No exchange rate for a currency on or before the day asked for"""
+
+
+class RateCache:
+    """Thread-safe LRU mapping of (currency, day) to rate"""
+
+    def __init__(self, size):
+        self.size = size
+        self._rates = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            rate = self._rates.get(key)
+            if rate is not None:
+                self._rates.move_to_end(key)
+            return rate
+
+    def put(self, key, rate):
+        with self._lock:
+            self._rates[key] = rate
+            self._rates.move_to_end(key)
+            while len(self._rates) > self.size:
+                self._rates.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._rates.clear()
+
+    def __len__(self):
+        return len(self._rates)
+
+
+rate_cache = RateCache(getattr(settings, 'FX_CACHE_SIZE', 4096))
+
+
+def _latest_rates(currencies, day):
+    """(currency, rate) for each currency's latest rate on or before day"""
+    latest = (FxRate.objects.filter(currency=OuterRef('currency'), date__lte=day)
+              .order_by('-date').values('date')[:1])
+    return (FxRate.objects.filter(currency__in=currencies, date=Subquery(latest))
+            .values_list('currency', 'rate'))
+
+
+def _cached(currencies, day):
+    found = {}
+    missing = []
+    for currency in set(currencies):
+        rate = Decimal(1) if currency == PIVOT else rate_cache.get((currency, day))
+        if rate is None:
+            missing.append(currency)
+        else:
+            found[currency] = rate
+    return found, missing
+
+
+def _remember(found, rows, day):
+    for currency, rate in rows:
+        rate_cache.put((currency, day), rate)
+        found[currency] = rate
+    return found
+
+
+def rates(currencies, day=None):
+    """
+    {currency: rate} on day (default today) for those of currencies that have one.
+    Runs at most one query, for the currencies that aren't cached yet.
+    """
+    day = day or timezone.localdate()
+    found, missing = _cached(currencies, day)
+    if missing:
+        _remember(found, _latest_rates(missing, day), day)
+    return found
+
+
+async def arates(currencies, day=None):
+    """Async version of rates()"""
+    day = day or timezone.localdate()
+    found, missing = _cached(currencies, day)
+    if missing:
+        _remember(found, [row async for row in _latest_rates(missing, day)], day)
+    return found
+
+
+def convert(amount, currency, to, known):
+    """amount in currency as Money in to, with {currency: rate} from rates()"""
+    amount = Money.coerce(amount)
+    if currency == to:
+        return amount
+    for code in (currency, to):
+        if code not in known:
+            raise MissingRate(f"No {code} exchange rate yet; load one with manage.py load_fx_rates")
+    converted = Decimal(int(amount)) * known[currency] / known[to]
+    return Money(converted.to_integral_value(ROUND_HALF_EVEN))
+
+
+def total_in(amounts, to, known):
+    """
+    Sum [(amount, currency), ...] in currency to, converting each currency's
+    subtotal once. Returns (total, currencies left out for want of a rate).
+    """
+    subtotals = {}
+    for amount, currency in amounts:
+        subtotals[currency] = subtotals.get(currency, 0) + amount
+    total = 0
+    left_out = []
+    for currency, subtotal in sorted(subtotals.items()):
+        if currency == to or (currency in known and to in known):
+            total += convert(subtotal, currency, to, known)
+        else:
+            left_out.append(currency)
+    return Money(total), left_out
+
+
+def load_rates(path):
+    """
+    Upsert date,currency,rate rows from a CSV file into FxRate and drop this
+    process's cached rates. Returns the number of rows read.
+    """
+    with open(path, newline='') as f:
+        rows = [
+            FxRate(currency=row['currency'].strip().upper(),
+                   date=date.fromisoformat(row['date'].strip()),
+                   rate=Decimal(row['rate'].strip()))
+            for row in csv.DictReader(f)
+        ]
+    unknown = sorted({row.currency for row in rows} - KNOWN_CURRENCIES)
+    if unknown:
+        raise ValueError(f"Unknown currencies in {path}: {', '.join(unknown)}")
+    if any(row.rate <= 0 for row in rows):
+        raise ValueError(f"Rates in {path} must be positive")
+    FxRate.objects.bulk_create(rows, batch_size=2000, update_conflicts=True,
+                               unique_fields=['currency', 'date'], update_fields=['rate'])
+    rate_cache.clear()
+    return len(rows)
@@ -0,0 +1,122 @@
+"""
+A small job queue kept in the database, for work that shouldn't hold up a
+request: refreshing reminder text after a trip changes, sending reminders.
+
+enqueue() adds a Job row; `manage.py run_jobs` claims ready jobs a batch at a
+time and runs them on a thread pool. No broker: the table is the queue.
+
+A claim is one UPDATE that marks a batch running under a token unique to that
+claim, so workers in several processes never run the same job twice. Jobs that
+finish are deleted. Jobs that raise are retried with growing delays and, after
+MAX_ATTEMPTS, kept as failed with the error for someone to look at.
+
+Jobs given a key are merged while they wait: enqueueing 'reminders:12' ten
+times before a worker gets to it still runs it once.
+"""
+import os
+import socket
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+# What each kind of job runs; called with the job's payload as keyword arguments
+HANDLERS = {
+    'refresh_reminders': 'expenses.reminders.refresh',
+    'send_reminders': 'expenses.reminders.send',
+}
+
+MAX_ATTEMPTS = 5
+RETRY_DELAY = timedelta(seconds=30)
+
+
+def enqueue(kind, key=None, delay=None, **payload):
+    """Queue a job of kind to run with payload (after delay, if given). One INSERT."""
+    enqueue_many(kind, [(key, payload)], delay)
+
+
+def enqueue_many(kind, jobs, delay=None):
+    """Queue [(key, payload), ...] jobs of one kind in a single INSERT"""
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind {kind!r}")
+    run_after = timezone.now() + delay if delay else timezone.now()
+    Job.objects.bulk_create([Job(kind=kind, key=key, payload=payload, run_after=run_after) for key, payload in jobs],
+                            ignore_conflicts=True, batch_size=2000)
+
+
+def claim(limit):
+    """Mark up to limit ready jobs as running for this caller and return them"""
+    now = timezone.now()
+    token = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:12]}"
+    ready = Job.objects.filter(status='pending', run_after__lte=now).order_by('run_after', 'id').values('id')[:limit]
+    claimed = Job.objects.filter(id__in=ready, status='pending').update(
+        status='running', claimed_by=token, started_at=now, attempts=F('attempts') + 1,
+    )
+    if not claimed:
+        return []
+    return list(Job.objects.filter(status='running', claimed_by=token).order_by('id'))
+
+
+def run(job):
+    """Run one claimed job. Returns True if it succeeded."""
+    try:
+        import_string(HANDLERS[job.kind])(**job.payload)
+    except Exception:
+        retry = job.attempts < MAX_ATTEMPTS
+        try:
+            with transaction.atomic():
+                Job.objects.filter(pk=job.pk).update(
+                    status='pending' if retry else 'failed',
+                    run_after=timezone.now() + RETRY_DELAY * 2 ** (job.attempts - 1),
+                    last_error=traceback.format_exc(limit=5),
+                )
+        except IntegrityError:
+            # The same job was queued again while this one ran; that one will do
+            Job.objects.filter(pk=job.pk).delete()
+        return False
+    else:
+        Job.objects.filter(pk=job.pk).delete()
+        return True
+    finally:
+        # Worker threads each hold a connection; don't let them go stale
+        close_old_connections()
+
+
+def reclaim(older_than):
+    """Put jobs left running longer than older_than (a timedelta) by a dead worker back in the queue"""
+    stale = Job.objects.filter(status='running', started_at__lt=timezone.now() - older_than)
+    # Those queued again since are covered by the newer copy
+    stale.filter(key__in=Job.objects.filter(status='pending', key__isnull=False).values('key')).delete()
+    return stale.update(status='pending', claimed_by='')
+
+
+def work(threads=4, batch=None, poll=1.0, once=False):
+    """
+    Claim and run jobs on a pool of threads until interrupted or, with once,
+    until none are ready. Returns (jobs run, jobs that failed).
+    """
+    batch = batch or threads * 4
+    ran = failed = 0
+    with ThreadPoolExecutor(threads, thread_name_prefix='splitease-job') as pool:
+        try:
+            while True:
+                jobs = claim(batch)
+                if not jobs:
+                    if once:
+                        break
+                    time.sleep(poll)
+                    continue
+                results = list(pool.map(run, jobs))
+                ran += len(results)
+                failed += results.count(False)
+        except KeyboardInterrupt:
+            pass
+    return ran, failed
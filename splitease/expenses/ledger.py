@@ -0,0 +1,273 @@
+"""
+Balance ledger for trips.
+
+Every change to what members owe is written twice: as append-only LedgerEntry
+rows (the history) and as a bulk update of the MemberBalance table (the
+current state). Both writes are a fixed number of statements no matter how many
+members the trip has, and deleting an expense replays its own entries in
+reverse so balances come back exactly to where they were. Money members pay
+each other is kept as Payment rows, each with its pair of ledger entries.
+
+A trip's Debt rows always hold its settlement plan: every change to its
+balances re-plans them from the new balances, under the trip lock.
+"""
+from django.db import connections
+from django.db.models import Case, F, Value, When
+
+from . import analytics, fx, sharding
+from .caching import trip_changed
+from .models import Expense, ExpenseSplit, LedgerEntry, MemberBalance, Payment, Trip
+from .money import Money, MoneyField, display
+from .settlement import Transfer, replan, settlement_plan, store_plan
+from .splits import Split, SplitError, compute_shares, to_paise
+
+MONEY = MoneyField()
+
+
+class PaymentError(ValueError):
+    """A payment that doesn't fit what is owed"""
+
+
+class TripArchived(ValueError):
+    """An expense for a trip whose expenses have been archived"""
+
+
+def _per_user(deltas, field):
+    """CASE expression that picks each user's delta inside a single UPDATE"""
+    return Case(
+        *[When(**{field: user_id}, then=Value(amount, output_field=MONEY))
+          for user_id, amount in deltas.items()],
+        default=Value(0, output_field=MONEY),
+        output_field=MONEY,
+    )
+
+
+def apply_deltas(trip, deltas, kind, expense=None):
+    """
+    Add {user_id: amount} to the members' balances and log it in the ledger.
+    Runs three statements: ledger insert, balance row insert, balance update.
+    """
+    deltas = {user_id: amount for user_id, amount in deltas.items() if amount}
+    if not deltas:
+        return
+    LedgerEntry.objects.bulk_create([
+        LedgerEntry(trip=trip, user_id=user_id, expense=expense, amount=amount, kind=kind)
+        for user_id, amount in deltas.items()
+    ])
+    bump_balances(trip, deltas)
+
+
+def bump_balances(trip, deltas):
+    """Add {user_id: amount} to the members' balances in two statements"""
+    # Make sure every member has a balance row, then bump them all at once
+    MemberBalance.objects.bulk_create(
+        [MemberBalance(trip=trip, user_id=user_id) for user_id in deltas],
+        ignore_conflicts=True,
+    )
+    MemberBalance.objects.filter(trip=trip, user_id__in=list(deltas)).update(
+        balance=F('balance') + _per_user(deltas, 'user_id')
+    )
+    trip_changed(trip.id)
+
+
+def expense_deltas(expense, shares):
+    """
+    Balance changes for an expense split as {user_id: share}.
+    Everyone is debited their share and the payer is credited the whole amount,
+    so the changes always sum to zero.
+    """
+    deltas = {user_id: -share for user_id, share in shares.items()}
+    deltas[expense.paid_by_id] = deltas.get(expense.paid_by_id, Money(0)) + Money.coerce(expense.base_amount)
+    return deltas
+
+
+def lock_trip(trip, live=False):
+    """
+    Take a row lock on the trip for the rest of the transaction.
+    Writers to the same trip queue up here; other trips are unaffected.
+    With live, raise TripArchived if the trip has been archived meanwhile;
+    the same query checks it.
+
+    SQLite has no row locks, so there we make a no-op write instead. That grabs
+    the database write lock before anything is read, which means a waiting
+    writer blocks on the busy timeout rather than failing to upgrade a read lock.
+
+    The lock is taken in the trip's database, on its copy of the trip when the
+    trip is on a shard. Raises sharding.TripMoved if a rebalance moved the trip
+    while this waited.
+    """
+    using = sharding.db_for_trip(trip.pk)
+    if connections[using].features.has_select_for_update:
+        archived = (Trip.objects.using(using).select_for_update().only('id', 'archived_at')
+                    .get(pk=trip.pk).archived_at)
+    else:
+        trips = Trip.objects.using(using).filter(pk=trip.pk)
+        if live:
+            # An archived trip matches no row, so nothing is written for it
+            trips = trips.filter(archived_at__isnull=True)
+        archived = not trips.update(id=F('id'))
+    sharding.check_placement(trip.pk, using)
+    if live and archived:
+        raise TripArchived(f"{trip.name} is archived; its expenses can't change")
+
+
+def create_expense(trip, payer, amount, description, category, split=None, currency=None):
+    """
+    Save an expense and post its split as one atomic unit.
+    split is a splits.Split; by default the expense is shared equally by every member.
+    currency defaults to the trip's; other currencies are converted to it at
+    today's rate, and the converted amount is what gets split.
+    Raises SplitError, fx.MissingRate or TripArchived, before anything is
+    written, if the expense can't be posted.
+    Balances only move through database-side increments, and the debts are
+    re-planned from them under the trip lock, so concurrent posts to the same
+    trip can never overwrite each other.
+    """
+    split = split or Split()
+    currency = currency or trip.base_currency
+    amount = Money(to_paise(amount))
+    base_amount = fx.convert(amount, currency, trip.base_currency,
+                             fx.rates({currency, trip.base_currency}))
+    with sharding.atomic(trip) as using:
+        lock_trip(trip, live=True)
+        member_ids = list(trip.members.values_list('id', flat=True))
+        if payer.id not in member_ids and using != sharding.DEFAULT:
+            # The shard has copies of the members only
+            sharding.copy_users(using, [payer.id])
+        if not split.member_ids:
+            split = split._replace(member_ids=member_ids)
+        elif not set(split.member_ids) <= set(member_ids):
+            raise SplitError("Expenses can only be split between members of the trip")
+        method = split.method
+        if method == 'exact' and currency != trip.base_currency:
+            # Exact amounts are in the currency paid: check them against that, then
+            # divide the converted amount in the same proportions
+            compute_shares(amount, split)
+            split = split._replace(method='shares')
+        shares = compute_shares(base_amount, split)
+
+        expense = Expense.objects.create(
+            trip=trip,
+            description=description,
+            amount=amount,
+            currency=currency,
+            base_amount=base_amount,
+            paid_by=payer,
+            category=category,
+            split_method=method,
+        )
+        weights = split.values if method in ('shares', 'percentage') else None
+        post_expense(expense, shares, weights)
+    return expense
+
+
+def post_expense(expense, shares, weights=None):
+    """
+    Record a freshly created expense in its splits, the ledger, balances and
+    spending rollups, and re-plan the trip's Debt rows from the new balances.
+    shares is {user_id: share}; weights, if the split had them, is {user_id: weight}.
+    Call it holding the trip lock.
+    """
+    deltas = expense_deltas(expense, shares)
+    with sharding.atomic(expense.trip):
+        ExpenseSplit.objects.bulk_create([
+            ExpenseSplit(expense=expense, user_id=user_id, share=share,
+                         weight=weights.get(user_id) if weights else None)
+            for user_id, share in shares.items() if share
+        ])
+        apply_deltas(expense.trip, deltas, 'expense', expense=expense)
+        analytics.record(expense)
+        replan(expense.trip)
+    return deltas
+
+
+def reverse_expense(expense):
+    """Undo an expense's ledger entries, delete it and re-plan the trip's debts"""
+    trip = expense.trip
+    with sharding.atomic(trip):
+        lock_trip(trip)
+        posted = dict(expense.ledger_entries.filter(kind='expense').values_list('user_id', 'amount'))
+        if not posted:
+            # Posted before the ledger existed: rebuild the equal split it was made with
+            member_ids = list(trip.members.order_by('id').values_list('id', flat=True))
+            posted = (expense_deltas(expense, compute_shares(expense.base_amount, Split('equal', member_ids)))
+                      if member_ids else {})
+        apply_deltas(trip, {user_id: -amount for user_id, amount in posted.items()},
+                     'reversal', expense=expense)
+        analytics.record(expense, -1)
+        expense.delete()
+        replan(trip)
+
+
+def record_payments(trip, transfers, plan=None):
+    """
+    Record payments, as Transfers, that members made to each other outside the app:
+    a Payment row and two ledger entries each, the balance changes and the Debt rows.
+    The Debt rows become plan, the transfers still to make afterwards; by default
+    that is worked out again from the new balances.
+    A fixed number of statements however many payments there are. Call it inside
+    a transaction holding the trip lock. Returns the Payments.
+    """
+    payments = [Payment(trip=trip, from_user_id=t.debtor_id, to_user_id=t.creditor_id, amount=Money.coerce(t.amount))
+                for t in transfers]
+    if any(payment.amount <= 0 for payment in payments):
+        raise PaymentError("Payments must be more than zero.")
+    if not payments:
+        return []
+    Payment.objects.bulk_create(payments)
+    deltas = {}
+    entries = []
+    for payment in payments:
+        # Paying back what you owe raises your balance and lowers the receiver's
+        for user_id, amount in ((payment.from_user_id, payment.amount), (payment.to_user_id, -payment.amount)):
+            deltas[user_id] = deltas.get(user_id, 0) + amount
+            entries.append(LedgerEntry(trip=trip, user_id=user_id, payment=payment,
+                                       amount=amount, kind='settlement'))
+    LedgerEntry.objects.bulk_create(entries)
+    bump_balances(trip, {user_id: Money(amount) for user_id, amount in deltas.items() if amount})
+    store_plan(trip, settlement_plan(trip) if plan is None else plan)
+    return payments
+
+
+def record_payment(trip, debtor_id, creditor_id, amount):
+    """Money moved from debtor to creditor outside the app; returns the Payment"""
+    with sharding.atomic(trip):
+        lock_trip(trip)
+        return record_payments(trip, [Transfer(debtor_id, creditor_id, amount)])[0]
+
+
+def settle_transfer(trip, debtor_id, creditor_id, amount=None):
+    """
+    Pay the planned transfer from debtor to creditor: all of it, or just amount
+    of it, which leaves the rest in the plan.
+    Returns the amount paid, or None if the plan has no such payment.
+    Raises PaymentError if amount is not more than zero or more than planned.
+    """
+    with sharding.atomic(trip):
+        lock_trip(trip)
+        transfers = settlement_plan(trip)
+        match = [t for t in transfers if (t.debtor_id, t.creditor_id) == (debtor_id, creditor_id)]
+        if not match:
+            return None
+        planned = match[0]
+        amount = planned.amount if amount is None else Money.coerce(amount)
+        if amount > planned.amount:
+            raise PaymentError(f"Only {display(planned.amount, trip.base_currency)} is owed.")
+        rest = [t for t in transfers if t is not planned]
+        if amount < planned.amount:
+            rest.append(planned._replace(amount=Money(planned.amount - amount)))
+        record_payments(trip, [planned._replace(amount=amount)], plan=rest)
+    return amount
+
+
+def settle_all(trip):
+    """
+    Pay every transfer in the trip's settlement plan at once, in a fixed number
+    of statements. Returns the transfers paid.
+    """
+    with sharding.atomic(trip):
+        lock_trip(trip)
+        transfers = settlement_plan(trip)
+        record_payments(trip, transfers, plan=[])
+    return transfers
+
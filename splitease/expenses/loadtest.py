@@ -0,0 +1,131 @@
+"""
+Concurrency load test for the database profile.
+
+Worker processes hammer one seeded database for a fixed time. Each operation
+is either a read (a member's home summary, a trip summary and the first page
+of its expenses) or a write (posting an expense, or settling the first
+payment of a settlement plan), chosen at the configured write ratio. The
+report gives read and write throughput, p95 latency and "database is locked"
+errors for every worker count, so the default and production SQLite profiles
+can be compared side by side.
+"""
+import multiprocessing
+import random
+import sqlite3
+import time
+
+from django.conf import settings
+from django.db import OperationalError, connection, connections
+
+from . import synthetic
+from .benchmarks import percentile, throwaway_database
+from .ledger import create_expense, settle_transfer
+from .models import Trip
+from .money import Money
+from .pagination import expense_page
+from .settlement import settlement_plan
+from .summaries import home_summary, trip_summary
+
+PROFILES = {
+    'default': {},
+    'production': settings.SQLITE_PRODUCTION_OPTIONS,
+}
+
+
+def read(trip, user):
+    home_summary(user)
+    trip_summary(trip)
+    expense_page(trip)
+
+
+def write(trip, user, rng):
+    if rng.random() < 0.75:
+        create_expense(trip, user, Money(rng.randint(100, 500000)), 'Load test', 'Food')
+        return
+    plan = settlement_plan(trip)
+    if plan:
+        settle_transfer(trip, plan[0].debtor_id, plan[0].creditor_id)
+
+
+def worker(number, options, duration, write_ratio, start, results):
+    """Body of one worker process: run operations until the deadline, then report"""
+    connection.close()
+    connection.settings_dict['OPTIONS'] = dict(options)
+    rng = random.Random(number)
+    trips = list(Trip.objects.prefetch_related('members'))
+    stats = {'reads': [], 'writes': [], 'errors': 0}
+
+    start.wait()
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        trip = rng.choice(trips)
+        user = rng.choice(list(trip.members.all()))
+        kind = 'writes' if rng.random() < write_ratio else 'reads'
+        started = time.perf_counter()
+        try:
+            if kind == 'writes':
+                write(trip, user, rng)
+            else:
+                read(trip, user)
+        except OperationalError:
+            # "database is locked": the busy timeout ran out
+            stats['errors'] += 1
+            continue
+        stats[kind].append((time.perf_counter() - started) * 1000)
+    connection.close()
+    results.put(stats)
+
+
+def set_journal_mode(options):
+    """WAL is a property of the database file, so switch the file itself between runs"""
+    mode = 'WAL' if 'journal_mode=WAL' in options.get('init_command', '') else 'DELETE'
+    connections.close_all()
+    with sqlite3.connect(connection.settings_dict['NAME']) as db:
+        db.execute(f'PRAGMA journal_mode={mode}')
+    db.close()
+
+
+def run_workers(workers, options, duration=5.0, write_ratio=0.2):
+    """Run workers processes against the current database and summarise them"""
+    set_journal_mode(options)
+    context = multiprocessing.get_context('fork')
+    start = context.Event()
+    results = context.Queue()
+    processes = [
+        context.Process(target=worker, args=(n, options, duration, write_ratio, start, results))
+        for n in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    start.set()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    reads = [ms for stats in collected for ms in stats['reads']]
+    writes = [ms for stats in collected for ms in stats['writes']]
+    return {
+        'workers': workers,
+        'reads_per_second': round(len(reads) / duration, 1),
+        'writes_per_second': round(len(writes) / duration, 1),
+        'read_p95_ms': round(percentile(reads, 95), 3) if reads else None,
+        'write_p95_ms': round(percentile(writes, 95), 3) if writes else None,
+        'errors': sum(stats['errors'] for stats in collected),
+    }
+
+
+def run(worker_counts, profiles=('default', 'production'), duration=5.0, write_ratio=0.2,
+        scale=(100, 10, 6, 200), seed=0):
+    """Seed a throwaway database once, then load it with every profile and worker count"""
+    if connection.vendor != 'sqlite':
+        raise RuntimeError("The load test compares SQLite profiles; the default database isn't SQLite")
+    users, trips, members, expenses = scale
+    results = []
+    with throwaway_database():
+        synthetic.seed(users=users, trips=trips, members_per_trip=members,
+                       expenses_per_trip=expenses, seed=seed, prefix='load')
+        for profile in profiles:
+            for workers in worker_counts:
+                results.append({'profile': profile,
+                                **run_workers(workers, PROFILES[profile], duration, write_ratio)})
+    return {'duration': duration, 'write_ratio': write_ratio, 'results': results}
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses import archive
+from expenses.ledger import TripArchived
+from expenses.models import Trip
+
+
+class Command(BaseCommand):
+    help = "Archive finished trips and delete settled debt rows, to keep the live tables small"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trip', type=int, action='append', dest='trips',
+                            help="Archive this trip (can be given more than once)")
+        parser.add_argument('--idle-days', type=int,
+                            help="Archive every trip with nothing owed and no activity for this many days")
+        parser.add_argument('--compact', action='store_true',
+                            help="Also delete the zeroed debt rows of trips that stay live")
+
+    def handle(self, *args, **options):
+        if not (options['trips'] or options['idle_days'] is not None or options['compact']):
+            raise CommandError("Give --trip, --idle-days or --compact")
+        trips = []
+        if options['trips']:
+            trips = list(Trip.objects.filter(id__in=options['trips']).order_by('id'))
+            missing = set(options['trips']) - {trip.id for trip in trips}
+            if missing:
+                raise CommandError(f"Trip {min(missing)} does not exist")
+        if options['idle_days'] is not None:
+            trips += archive.idle_trips(options['idle_days']).exclude(id__in=[trip.id for trip in trips])
+
+        archived = moved = 0
+        for trip in trips:
+            try:
+                moved += archive.archive_trip(trip)
+            except TripArchived:
+                self.stdout.write(f"Trip {trip.id} is already archived")
+                continue
+            archived += 1
+        deleted = archive.compact() if options['compact'] else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {archived} trips ({moved} expenses) and deleted {deleted} zeroed debts"
+        ))
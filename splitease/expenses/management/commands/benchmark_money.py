@@ -0,0 +1,32 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from expenses import benchmarks
+
+
+class Command(BaseCommand):
+    help = ("Compare Decimal rupees with integer paise for summing, reading back and splitting "
+            "amounts. Prints JSON.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=200_000, help="Amounts to sum and read back")
+        parser.add_argument('--expenses', type=int, default=20_000, help="Expenses to split")
+        parser.add_argument('--members', type=int, default=6, help="Most members sharing one expense")
+        parser.add_argument('--repeats', type=int, default=5, help="Runs per measurement; the best one counts")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', '-o', help="Write the JSON report to this file")
+
+    def handle(self, *args, **options):
+        report = benchmarks.compare_money(
+            rows=options['rows'],
+            expenses=options['expenses'],
+            members=options['members'],
+            repeats=options['repeats'],
+            seed=options['seed'],
+        )
+        text = json.dumps(report, indent=2, default=str)
+        if options['output']:
+            with open(options['output'], 'w') as out:
+                out.write(text + '\n')
+        self.stdout.write(text)
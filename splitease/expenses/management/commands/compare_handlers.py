@@ -0,0 +1,34 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from expenses import benchmarks
+
+
+class Command(BaseCommand):
+    help = ("Compare WSGI and ASGI throughput for home, trip_dashboard and the trip summary "
+            "with many concurrent polling clients, in throwaway databases. Prints JSON.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', default='small',
+                            help="small, medium, large or users:trips:members:expenses")
+        parser.add_argument('--clients', default='1,8,32', help="Comma-separated concurrent client counts")
+        parser.add_argument('--requests', type=int, default=20, help="Requests per client")
+        parser.add_argument('--cached', action='store_true',
+                            help="Serve from the page caches instead of disabling them")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', '-o', help="Write the JSON report to this file")
+
+    def handle(self, *args, **options):
+        report = benchmarks.compare_handlers(
+            options['scale'],
+            concurrency=[int(n) for n in options['clients'].split(',') if n.strip()],
+            requests_per_client=options['requests'],
+            cached=options['cached'],
+            seed=options['seed'],
+        )
+        text = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as out:
+                out.write(text + '\n')
+        self.stdout.write(text)
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.exports import SECTIONS, stream_csv, stream_ndjson
+from expenses.models import Trip
+
+
+class Command(BaseCommand):
+    help = "Stream a trip's expenses, balances and settlement plan as CSV or NDJSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('trip_id', type=int)
+        parser.add_argument('--format', choices=['csv', 'ndjson'], default='ndjson')
+        parser.add_argument('--section', choices=list(SECTIONS), default='expenses',
+                            help="Which table to write in CSV mode (NDJSON always has all of them)")
+        parser.add_argument('--output', '-o', help="File to write to (default: stdout)")
+
+    def handle(self, *args, **options):
+        try:
+            trip = Trip.objects.get(id=options['trip_id'])
+        except Trip.DoesNotExist:
+            raise CommandError(f"Trip {options['trip_id']} does not exist")
+
+        if options['format'] == 'csv':
+            chunks = stream_csv(trip, options['section'])
+        else:
+            chunks = stream_ndjson(trip)
+
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as out:
+                out.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
@@ -0,0 +1,24 @@
+from decimal import InvalidOperation
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses import fx
+
+
+class Command(BaseCommand):
+    help = ("Load exchange rates from a CSV file with date,currency,rate columns, the rate being "
+            "what one unit of the currency is worth in rupees. Existing rates for the same day are replaced.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help="CSV file to load (default: settings.FX_RATES_FILE)")
+
+    def handle(self, *args, **options):
+        path = options['path'] or settings.FX_RATES_FILE
+        try:
+            count = fx.load_rates(path)
+        except FileNotFoundError:
+            raise CommandError(f"No rates file at {path}")
+        except (KeyError, InvalidOperation, ValueError) as error:
+            raise CommandError(f"Couldn't read rates from {path}: {error}")
+        self.stdout.write(self.style.SUCCESS(f"Loaded {count} exchange rates from {path}"))
@@ -0,0 +1,36 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from expenses import loadtest
+
+
+class Command(BaseCommand):
+    help = ("Load a throwaway SQLite database from several worker processes and report read "
+            "and write throughput per worker count, for the default and production profiles. Prints JSON.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', default='1,2,4,8', help="Comma-separated worker counts")
+        parser.add_argument('--profiles', default='default,production',
+                            help="Comma-separated: " + ', '.join(loadtest.PROFILES))
+        parser.add_argument('--duration', type=float, default=5.0, help="Seconds per run")
+        parser.add_argument('--write-ratio', type=float, default=0.2,
+                            help="Fraction of operations that write")
+        parser.add_argument('--scale', default='100:10:6:200', help="users:trips:members:expenses to seed")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', '-o', help="Write the JSON report to this file")
+
+    def handle(self, *args, **options):
+        report = loadtest.run(
+            [int(n) for n in options['workers'].split(',') if n.strip()],
+            profiles=[p.strip() for p in options['profiles'].split(',') if p.strip()],
+            duration=options['duration'],
+            write_ratio=options['write_ratio'],
+            scale=tuple(int(part) for part in options['scale'].split(':')),
+            seed=options['seed'],
+        )
+        text = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as out:
+                out.write(text + '\n')
+        self.stdout.write(text)
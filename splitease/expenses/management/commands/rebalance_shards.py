@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses import sharding
+
+
+class Command(BaseCommand):
+    help = ("Spread trips evenly over the shard databases, moving the trips still in default onto shards "
+            "and trips off the fullest shards")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only list the moves")
+
+    def handle(self, *args, **options):
+        if not sharding.enabled():
+            raise CommandError("Trips aren't sharded; set SPLITEASE_SHARDS")
+        moves = sharding.plan_rebalance()
+        rows = 0
+        for trip_id, source, target in moves:
+            self.stdout.write(f"Trip {trip_id}: {source} -> {target}")
+            if not options['dry_run']:
+                rows += sharding.move_trip(trip_id, target)
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f"Would move {len(moves)} trips"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Moved {len(moves)} trips ({rows} rows)"))
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses import rebuild
+from expenses.models import Trip
+
+
+class Command(BaseCommand):
+    help = "Recompute member balances and debts from the expense history, or check them with --verify"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trip', type=int, action='append', dest='trips',
+                            help="Only this trip (repeatable; default: every trip)")
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Worker processes (default: one per CPU; 1 runs in this process)")
+        parser.add_argument('--chunk-size', type=int, default=rebuild.CHUNK_SIZE, help="Trips per chunk")
+        parser.add_argument('--verify', action='store_true',
+                            help="Report balances that don't match the expenses without writing anything")
+
+    def handle(self, *args, **options):
+        trip_ids = options['trips']
+        if trip_ids:
+            missing = set(trip_ids) - set(Trip.objects.filter(id__in=trip_ids).values_list('id', flat=True))
+            if missing:
+                raise CommandError(f"Trips {', '.join(map(str, sorted(missing)))} do not exist")
+        if options['workers'] is not None and options['workers'] < 1:
+            raise CommandError("--workers must be at least 1")
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be at least 1")
+
+        report = rebuild.rebuild(trip_ids, workers=options['workers'], chunk_size=options['chunk_size'],
+                                 verify=options['verify'])
+        for m in report['mismatches']:
+            self.stdout.write(f"Trip {m.trip_id}, user {m.user_id}: {m.check} is {m.found}, expenses say {m.expected}")
+        checked = f"{report['trips']} trips and {report['expenses']} expenses"
+        out_of_step = len({m.trip_id for m in report['mismatches']})
+
+        if options['verify']:
+            if out_of_step:
+                raise CommandError(f"{out_of_step} of {checked} are out of step")
+            self.stdout.write(self.style.SUCCESS(f"Checked {checked}: all balances match"))
+            return
+        self.stdout.write(self.style.SUCCESS(f"Checked {checked}; corrected {len(report['written'])} trips"))
+        if report['skipped']:
+            skipped = ', '.join(map(str, report['skipped']))
+            self.stdout.write(self.style.WARNING(f"Trips {skipped} changed while being rebuilt and were left alone; "
+                                                 "run again to pick them up"))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses import analytics
+from expenses.models import Trip
+
+
+class Command(BaseCommand):
+    help = "Recompute the spending rollups behind the analytics pages from the expenses"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trip', type=int, help="Only rebuild this trip (default: every trip)")
+
+    def handle(self, *args, **options):
+        trip = None
+        if options['trip'] is not None:
+            trip = Trip.objects.filter(id=options['trip']).first()
+            if trip is None:
+                raise CommandError(f"Trip {options['trip']} does not exist")
+        written = analytics.rebuild(trip)
+        scope = f"trip {trip.id}" if trip else "every trip"
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} spending rollups for {scope}"))
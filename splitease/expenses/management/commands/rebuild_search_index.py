@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses import search
+
+
+class Command(BaseCommand):
+    help = "Refill the full-text expense search index from the expense table"
+
+    def handle(self, *args, **options):
+        try:
+            indexed = search.rebuild()
+        except RuntimeError as error:
+            raise CommandError(str(error))
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} expenses for search"))
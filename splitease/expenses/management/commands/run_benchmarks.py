@@ -0,0 +1,32 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from expenses import benchmarks
+
+
+class Command(BaseCommand):
+    help = ("Benchmark home, trip_dashboard, add_expense, create_trip and settlement "
+            "on synthetic data at several scales, in throwaway databases. Prints JSON.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default='small,medium',
+                            help="Comma-separated: small, medium, large or users:trips:members:expenses")
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--cached', action='store_true',
+                            help="Keep page caches between requests instead of clearing them")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', '-o', help="Write the JSON report to this file")
+
+    def handle(self, *args, **options):
+        report = benchmarks.run(
+            [scale.strip() for scale in options['scales'].split(',') if scale.strip()],
+            iterations=options['iterations'],
+            cached=options['cached'],
+            seed=options['seed'],
+        )
+        text = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as out:
+                out.write(text + '\n')
+        self.stdout.write(text)
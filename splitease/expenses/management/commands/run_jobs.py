@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses import jobs
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs (reminder refreshes and emails) on a pool of threads"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4, help="Jobs run at once")
+        parser.add_argument('--batch', type=int, default=None, help="Jobs claimed per poll (default: 4 per thread)")
+        parser.add_argument('--poll', type=float, default=1.0, help="Seconds to wait when the queue is empty")
+        parser.add_argument('--once', action='store_true', help="Exit once no jobs are ready instead of polling")
+        parser.add_argument('--reclaim-after', type=int, default=600,
+                            help="Requeue jobs another worker has had running for this many seconds")
+
+    def handle(self, *args, **options):
+        if options['threads'] < 1:
+            raise CommandError("--threads must be at least 1")
+        reclaimed = jobs.reclaim(timedelta(seconds=options['reclaim_after']))
+        if reclaimed:
+            self.stdout.write(self.style.WARNING(f"Requeued {reclaimed} jobs left running by a stopped worker"))
+        ran, failed = jobs.work(threads=options['threads'], batch=options['batch'], poll=options['poll'],
+                                once=options['once'])
+        self.stdout.write(self.style.SUCCESS(f"Ran {ran} jobs ({failed} failed)"))
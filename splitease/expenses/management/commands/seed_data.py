@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from expenses import synthetic
+
+
+class Command(BaseCommand):
+    help = "Seed synthetic users, trips and expenses for load testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--trips', type=int, default=10)
+        parser.add_argument('--members', type=int, default=6, help="Members per trip")
+        parser.add_argument('--expenses', type=int, default=100, help="Expenses per trip")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed (also keeps usernames unique per run)")
+        parser.add_argument('--prefix', default='synth', help="Username prefix for generated users")
+
+    def handle(self, *args, **options):
+        created = synthetic.seed(
+            users=options['users'],
+            trips=options['trips'],
+            members_per_trip=options['members'],
+            expenses_per_trip=options['expenses'],
+            seed=options['seed'],
+            prefix=options['prefix'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {created['users']} users, {created['trips']} trips and {created['expenses']} expenses"
+        ))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from expenses import reminders
+
+
+class Command(BaseCommand):
+    help = "Queue emails for every debt reminder that is due (run it from cron; run_jobs sends them)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trip', type=int, action='append', dest='trips',
+                            help="Only this trip (repeatable; default: every trip)")
+        parser.add_argument('--now', action='store_true', help="Send them from this process instead of queueing")
+
+    def handle(self, *args, **options):
+        if options['now']:
+            sent = sum(reminders.send(trip_id) for trip_id in options['trips']) if options['trips'] else reminders.send()
+            self.stdout.write(self.style.SUCCESS(f"Sent {sent} reminders"))
+            return
+        trip_ids = reminders.schedule(options['trips'])
+        self.stdout.write(self.style.SUCCESS(f"Queued reminders for {len(trip_ids)} trips"))
@@ -0,0 +1,77 @@
+"""
+In-process request metrics, exposed in the Prometheus text format.
+
+Each worker process keeps its own histograms; Prometheus scrapes every worker
+and sums them. Nothing here talks to the database.
+"""
+import threading
+from collections import defaultdict
+
+# Histogram upper bounds, in seconds for durations and in queries for counts
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250, 500)
+
+HISTOGRAMS = {
+    'splitease_request_duration_seconds': ("Wall time spent in the view and middleware", DURATION_BUCKETS),
+    'splitease_db_query_duration_seconds': ("Time spent running SQL per request", DURATION_BUCKETS),
+    'splitease_template_render_seconds': ("Time spent rendering templates per request", DURATION_BUCKETS),
+    'splitease_db_queries': ("SQL queries issued per request", QUERY_BUCKETS),
+}
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.total += value
+        self.count += 1
+
+
+_lock = threading.Lock()
+_series = {name: defaultdict(lambda buckets=buckets: Histogram(buckets))
+           for name, (_, buckets) in HISTOGRAMS.items()}
+
+
+def observe_request(view, seconds, queries, query_seconds, template_seconds):
+    with _lock:
+        _series['splitease_request_duration_seconds'][view].observe(seconds)
+        _series['splitease_db_query_duration_seconds'][view].observe(query_seconds)
+        _series['splitease_template_render_seconds'][view].observe(template_seconds)
+        _series['splitease_db_queries'][view].observe(queries)
+
+
+def reset():
+    with _lock:
+        for series in _series.values():
+            series.clear()
+
+
+def _label(view):
+    return view.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def render_prometheus():
+    """All histograms in the Prometheus text exposition format"""
+    lines = []
+    with _lock:
+        for name, (help_text, _) in HISTOGRAMS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            for view, histogram in sorted(_series[name].items()):
+                label = _label(view)
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{view="{label}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{view="{label}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{name}_sum{{view="{label}"}} {histogram.total:.6f}')
+                lines.append(f'{name}_count{{view="{label}"}} {histogram.count}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,150 @@
+"""
+Request profiling.
+
+ProfilingMiddleware times every request, counts and times its SQL through a
+database execute wrapper and times template rendering. The numbers go out as
+a Server-Timing header (visible in the browser's network panel) and into the
+histograms served at /metrics. With PROFILING_SAMPLE_RATE above zero, that
+fraction of requests also runs under cProfile, and the ones slower than
+PROFILING_SLOW_MS have their stats dumped to PROFILING_DUMP_DIR.
+
+The middleware works both ways round, so async views served over ASGI stay on
+the event loop instead of being pushed into a thread for its sake.
+"""
+import cProfile
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends.django import Template
+
+from . import metrics
+
+# Stats of the request being served. Context variables follow a request into
+# the threads the async ORM runs its queries on, which connections don't.
+_current = ContextVar('splitease_request_stats', default=None)
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.template_seconds = 0.0
+
+
+def _timed_execute(execute, sql, params, many, context):
+    # Database execute wrapper: time every statement run on behalf of a request
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.query_seconds += time.perf_counter() - started
+
+
+def _install(connection, **kwargs):
+    if _timed_execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_timed_execute)
+
+
+# Connections are per thread: wrap each one as it connects, and the ones this
+# thread already has as each request starts
+connection_created.connect(_install)
+
+
+def _timed_render(render):
+    def wrapper(self, context=None, request=None):
+        stats = _current.get()
+        if stats is None:
+            return render(self, context, request)
+        started = time.perf_counter()
+        try:
+            return render(self, context, request)
+        finally:
+            stats.template_seconds += time.perf_counter() - started
+    wrapper.timed = True
+    return wrapper
+
+
+# Template rendering has no hook of its own, so time the backend's render() once, globally
+if not getattr(Template.render, 'timed', False):
+    Template.render = _timed_render(Template.render)
+
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with self.profiled() as state:
+            state['response'] = self.get_response(request)
+        return self.finish(request, state)
+
+    async def __acall__(self, request):
+        with self.profiled() as state:
+            state['response'] = await self.get_response(request)
+        return self.finish(request, state)
+
+    @contextmanager
+    def profiled(self):
+        for connection in connections.all():
+            _install(connection)
+        state = {'stats': RequestStats(), 'profiler': None}
+        if random.random() < getattr(settings, 'PROFILING_SAMPLE_RATE', 0):
+            state['profiler'] = cProfile.Profile()
+
+        token = _current.set(state['stats'])
+        started = time.perf_counter()
+        try:
+            if state['profiler']:
+                try:
+                    state['profiler'].enable()
+                except ValueError:
+                    # Another request on this event loop is already being profiled
+                    state['profiler'] = None
+            try:
+                yield state
+            finally:
+                if state['profiler']:
+                    state['profiler'].disable()
+        finally:
+            _current.reset(token)
+        state['elapsed'] = time.perf_counter() - started
+
+    def finish(self, request, state):
+        stats, profiler, elapsed = state['stats'], state['profiler'], state['elapsed']
+        response = state['response']
+        match = request.resolver_match
+        view = (match.view_name if match else None) or 'unresolved'
+        metrics.observe_request(view, elapsed, stats.queries, stats.query_seconds, stats.template_seconds)
+        response['Server-Timing'] = ', '.join([
+            f'total;dur={elapsed * 1000:.1f}',
+            f'db;dur={stats.query_seconds * 1000:.1f};desc="{stats.queries} queries"',
+            f'tpl;dur={stats.template_seconds * 1000:.1f}',
+        ])
+
+        if profiler and elapsed * 1000 >= getattr(settings, 'PROFILING_SLOW_MS', 500):
+            self.dump(profiler, view, elapsed)
+        return response
+
+    def dump(self, profiler, view, elapsed):
+        directory = Path(getattr(settings, 'PROFILING_DUMP_DIR', 'profiles'))
+        directory.mkdir(parents=True, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{view.replace(':', '_')}-{elapsed * 1000:.0f}ms.prof"
+        profiler.dump_stats(directory / name)
@@ -0,0 +1,92 @@
+# Generated by Django 6.0.1 on 2026-10-18 07:12
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import migrations
+
+
+def _equal_split(paise, member_ids):
+    """paise split equally, the paise left over going one each to the first members, as splits.allocate() does"""
+    share, leftover = divmod(paise, len(member_ids))
+    return {user_id: share + (index < leftover) for index, user_id in enumerate(member_ids)}
+
+
+def _paise(rupees):
+    return int((rupees * 100).to_integral_value())
+
+
+def backfill_balances(apps, schema_editor):
+    """
+    Seed MemberBalance, and the ledger with an opening entry per balance, from
+    the expenses and pairwise Debt rows that existed before the ledger.
+
+    A member's opening 'expense' entry is their side of the trip's expenses,
+    each split equally in whole paise, as rebuild_balances and deleting an
+    expense from before the ledger count them. The Debt rows kept every share
+    to a fraction of a paisa; when they differ from that by no more than the
+    rounding (a paisa per expense), the expenses win. A trip whose rows are
+    further off had debts settled before there was a ledger: its balances are
+    what the rows still say, and what was settled goes in as a 'settlement'
+    entry with no payment.
+    """
+    Debt = apps.get_model('expenses', 'Debt')
+    Expense = apps.get_model('expenses', 'Expense')
+    LedgerEntry = apps.get_model('expenses', 'LedgerEntry')
+    MemberBalance = apps.get_model('expenses', 'MemberBalance')
+    Trip = apps.get_model('expenses', 'Trip')
+
+    owed = defaultdict(lambda: defaultdict(Decimal))
+    for debt in Debt.objects.exclude(amount=0).iterator():
+        owed[debt.trip_id][debt.to_user_id] += debt.amount
+        owed[debt.trip_id][debt.from_user_id] -= debt.amount
+
+    members = defaultdict(list)
+    for trip_id, user_id in (Trip.members.through.objects.order_by('trip_id', 'user_id')
+                             .values_list('trip_id', 'user_id')):
+        members[trip_id].append(user_id)
+    spent = defaultdict(lambda: defaultdict(int))
+    expense_counts = defaultdict(int)
+    for expense in Expense.objects.iterator():
+        paise = _paise(expense.amount)
+        spent[expense.trip_id][expense.paid_by_id] += paise
+        if members[expense.trip_id]:
+            for user_id, share in _equal_split(paise, members[expense.trip_id]).items():
+                spent[expense.trip_id][user_id] -= share
+        else:
+            # Nobody to split with: the expense never moved a balance
+            spent[expense.trip_id][expense.paid_by_id] -= paise
+        expense_counts[expense.trip_id] += 1
+
+    balances = []
+    entries = []
+    for trip_id in owed.keys() | spent.keys():
+        opening = spent[trip_id]
+        still_owed = {user_id: _paise(amount) for user_id, amount in owed[trip_id].items()}
+        users = sorted(opening.keys() | still_owed.keys())
+        settled = {user_id: still_owed.get(user_id, 0) - opening[user_id] for user_id in users}
+        if all(abs(amount) <= expense_counts[trip_id] for amount in settled.values()):
+            # Only the rounding of the old shares
+            settled = {}
+        for user_id in users:
+            balance = opening[user_id] + settled.get(user_id, 0)
+            if balance:
+                balances.append(MemberBalance(trip_id=trip_id, user_id=user_id,
+                                              balance=Decimal(balance).scaleb(-2)))
+            for kind, amount in (('expense', opening[user_id]), ('settlement', settled.get(user_id, 0))):
+                if amount:
+                    entries.append(LedgerEntry(trip_id=trip_id, user_id=user_id, kind=kind,
+                                               amount=Decimal(amount).scaleb(-2)))
+    MemberBalance.objects.bulk_create(balances, batch_size=2000)
+    LedgerEntry.objects.bulk_create(entries, batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0006_ledgerentry_memberbalance'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 6.0.1 on 2026-10-18 07:15
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fill_missing_dates(apps, schema_editor):
+    """Keyset pagination orders by date, so every expense needs one"""
+    Expense = apps.get_model('expenses', 'Expense')
+    for expense in Expense.objects.filter(date__isnull=True).select_related('trip'):
+        created = expense.trip.created_at or timezone.now()
+        expense.date = created.date()
+        expense.save(update_fields=['date'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0007_backfill_memberbalance'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_missing_dates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['trip', 'date', 'id'], name='expense_trip_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['trip', 'category', 'date', 'id'], name='expense_trip_category_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['trip', 'paid_by', 'date', 'id'], name='expense_trip_payer_idx'),
+        ),
+    ]
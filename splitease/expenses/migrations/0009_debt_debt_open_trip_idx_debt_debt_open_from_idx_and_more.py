@@ -0,0 +1,35 @@
+# Generated by Django 6.0.1 on 2026-10-18 07:23
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0008_expense_expense_trip_date_idx_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='debt',
+            index=models.Index(condition=models.Q(('amount__gt', 0)), fields=['trip', 'from_user', 'to_user'], name='debt_open_trip_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='debt',
+            index=models.Index(condition=models.Q(('amount__gt', 0)), fields=['from_user', 'trip'], name='debt_open_from_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='debt',
+            index=models.Index(condition=models.Q(('amount__gt', 0)), fields=['to_user', 'trip'], name='debt_open_to_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tripmember',
+            index=models.Index(fields=['trip', 'user'], name='tripmember_trip_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tripmember',
+            index=models.Index(fields=['trip', 'name'], name='tripmember_trip_name_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 6.0.1 on 2026-10-18 07:30
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0009_debt_debt_open_trip_idx_debt_debt_open_from_idx_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expense',
+            name='split_method',
+            field=models.CharField(choices=[('equal', 'Equally'), ('shares', 'By shares'), ('percentage', 'By percentage'), ('exact', 'Exact amounts')], default='equal', max_length=20),
+        ),
+        migrations.CreateModel(
+            name='ExpenseSplit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('share', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('weight', models.DecimalField(blank=True, decimal_places=4, max_digits=12, null=True)),
+                ('expense', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='splits', to='expenses.expense')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='expense_splits', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('expense', 'user')},
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 6.0.1 on 2026-10-18 07:31
+
+from django.db import migrations
+
+
+def backfill_splits(apps, schema_editor):
+    """
+    Rebuild each ledger-era expense's shares from its posting entries: members
+    who didn't pay were debited their share, and the payer was credited the
+    amount less their own.
+    """
+    Expense = apps.get_model('expenses', 'Expense')
+    ExpenseSplit = apps.get_model('expenses', 'ExpenseSplit')
+    LedgerEntry = apps.get_model('expenses', 'LedgerEntry')
+
+    posted = {}
+    for entry in LedgerEntry.objects.filter(kind='expense', expense__isnull=False).iterator():
+        posted.setdefault(entry.expense_id, {})[entry.user_id] = entry.amount
+
+    splits = []
+    for expense in Expense.objects.filter(id__in=list(posted)).iterator():
+        for user_id, amount in posted[expense.id].items():
+            share = expense.amount - amount if user_id == expense.paid_by_id else -amount
+            if share:
+                splits.append(ExpenseSplit(expense_id=expense.id, user_id=user_id, share=share))
+        if expense.paid_by_id not in posted[expense.id]:
+            # The payer's entry nets to zero when they paid only for themselves
+            splits.append(ExpenseSplit(expense_id=expense.id, user_id=expense.paid_by_id, share=expense.amount))
+    ExpenseSplit.objects.bulk_create(splits, batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0010_expense_split_method_expensesplit'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_splits, migrations.RunPython.noop),
+    ]
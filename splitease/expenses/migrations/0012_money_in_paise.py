@@ -0,0 +1,73 @@
+# Generated by Django 6.0.1 on 2026-10-18 09:12
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import BigIntegerField, F
+from django.db.models.functions import Cast, Round
+
+import expenses.money
+
+# (model, field, decimal column it replaces) for every amount of money
+MONEY_FIELDS = [
+    ('expense', 'amount', models.DecimalField(max_digits=10, decimal_places=2)),
+    ('expensesplit', 'share', models.DecimalField(max_digits=12, decimal_places=2)),
+    ('debt', 'amount', models.DecimalField(max_digits=10, decimal_places=2, default=0)),
+    ('ledgerentry', 'amount', models.DecimalField(max_digits=12, decimal_places=2)),
+    ('memberbalance', 'balance', models.DecimalField(max_digits=12, decimal_places=2, default=0)),
+]
+
+OPEN_DEBT_INDEXES = [
+    models.Index(condition=models.Q(('amount__gt', 0)), fields=['trip', 'from_user', 'to_user'],
+                 name='debt_open_trip_idx'),
+    models.Index(condition=models.Q(('amount__gt', 0)), fields=['from_user', 'trip'],
+                 name='debt_open_from_idx'),
+    models.Index(condition=models.Q(('amount__gt', 0)), fields=['to_user', 'trip'],
+                 name='debt_open_to_idx'),
+]
+
+
+def to_paise(apps, schema_editor):
+    # One UPDATE per table. Rounding first matters on SQLite, where decimals are
+    # stored as floats and 33.33 * 100 is 3332.9999...
+    for model, field, _ in MONEY_FIELDS:
+        Model = apps.get_model('expenses', model)
+        Model.objects.update(**{f'{field}_paise': Cast(Round(F(field) * 100), BigIntegerField())})
+
+
+def to_rupees(apps, schema_editor):
+    for model, field, _ in MONEY_FIELDS:
+        Model = apps.get_model('expenses', model)
+        rows = list(Model.objects.only('pk', f'{field}_paise'))
+        for row in rows:
+            setattr(row, field, Decimal(int(getattr(row, f'{field}_paise'))).scaleb(-2))
+        Model.objects.bulk_update(rows, [field], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0011_backfill_expensesplit'),
+    ]
+
+    operations = [
+        *[migrations.RemoveIndex(model_name='debt', name=index.name) for index in OPEN_DEBT_INDEXES],
+        *[migrations.AddField(model_name=model, name=f'{field}_paise',
+                              field=expenses.money.MoneyField(null=True))
+          for model, field, _ in MONEY_FIELDS],
+        # Nullable for the moment, so that migrating backwards can re-add them empty before to_rupees fills them
+        *[migrations.AlterField(model_name=model, name=field,
+                                field=models.DecimalField(max_digits=column.max_digits, decimal_places=2, null=True))
+          for model, field, column in MONEY_FIELDS],
+        migrations.RunPython(to_paise, to_rupees),
+        *[migrations.RemoveField(model_name=model, name=field) for model, field, _ in MONEY_FIELDS],
+        *[migrations.RenameField(model_name=model, old_name=f'{field}_paise', new_name=field)
+          for model, field, _ in MONEY_FIELDS],
+        migrations.AlterField(model_name='expense', name='amount', field=expenses.money.MoneyField()),
+        migrations.AlterField(model_name='expensesplit', name='share', field=expenses.money.MoneyField()),
+        migrations.AlterField(model_name='debt', name='amount', field=expenses.money.MoneyField(default=0)),
+        migrations.AlterField(model_name='ledgerentry', name='amount', field=expenses.money.MoneyField()),
+        migrations.AlterField(model_name='memberbalance', name='balance',
+                              field=expenses.money.MoneyField(default=0)),
+        *[migrations.AddIndex(model_name='debt', index=index) for index in OPEN_DEBT_INDEXES],
+    ]
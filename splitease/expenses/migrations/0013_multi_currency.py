@@ -0,0 +1,54 @@
+# Generated by Django 6.0.1 on 2026-10-18 07:40
+
+import expenses.money
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_base_amounts(apps, schema_editor):
+    # Everything so far was in rupees, in rupee trips
+    Expense = apps.get_model('expenses', 'Expense')
+    Expense.objects.update(base_amount=F('amount'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0012_money_in_paise'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expense',
+            name='base_amount',
+            field=expenses.money.MoneyField(null=True),
+        ),
+        migrations.AddField(
+            model_name='expense',
+            name='currency',
+            field=models.CharField(choices=[('INR', 'Indian rupee'), ('USD', 'US dollar'), ('EUR', 'Euro'), ('GBP', 'Pound sterling'), ('AED', 'UAE dirham'), ('SGD', 'Singapore dollar'), ('THB', 'Thai baht'), ('MYR', 'Malaysian ringgit'), ('NPR', 'Nepalese rupee'), ('LKR', 'Sri Lankan rupee')], default='INR', max_length=3),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='base_currency',
+            field=models.CharField(choices=[('INR', 'Indian rupee'), ('USD', 'US dollar'), ('EUR', 'Euro'), ('GBP', 'Pound sterling'), ('AED', 'UAE dirham'), ('SGD', 'Singapore dollar'), ('THB', 'Thai baht'), ('MYR', 'Malaysian ringgit'), ('NPR', 'Nepalese rupee'), ('LKR', 'Sri Lankan rupee')], default='INR', max_length=3),
+        ),
+        migrations.RunPython(backfill_base_amounts, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='expense',
+            name='base_amount',
+            field=expenses.money.MoneyField(),
+        ),
+        migrations.CreateModel(
+            name='FxRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(choices=[('INR', 'Indian rupee'), ('USD', 'US dollar'), ('EUR', 'Euro'), ('GBP', 'Pound sterling'), ('AED', 'UAE dirham'), ('SGD', 'Singapore dollar'), ('THB', 'Thai baht'), ('MYR', 'Malaysian ringgit'), ('NPR', 'Nepalese rupee'), ('LKR', 'Sri Lankan rupee')], max_length=3)),
+                ('date', models.DateField()),
+                ('rate', models.DecimalField(decimal_places=8, max_digits=18)),
+            ],
+            options={
+                'unique_together': {('currency', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 6.0.1 on 2026-10-18 07:45
+
+import django.db.models.deletion
+import expenses.money
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+
+
+def build_rollups(apps, schema_editor):
+    Expense = apps.get_model('expenses', 'Expense')
+    SpendingRollup = apps.get_model('expenses', 'SpendingRollup')
+    groups = (Expense.objects.filter(date__isnull=False)
+              .values('trip_id', 'category', 'date', 'paid_by_id', trip_currency=F('trip__base_currency'))
+              .annotate(total=Sum('base_amount'), count=Count('id'))
+              .order_by())
+    SpendingRollup.objects.bulk_create(
+        [SpendingRollup(currency=row.pop('trip_currency'), **row) for row in groups], batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0013_multi_currency'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpendingRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(choices=[('Food', 'Food'), ('Travel', 'Travel'), ('Stay', 'Stay'), ('Other', 'Other')], max_length=50)),
+                ('date', models.DateField()),
+                ('currency', models.CharField(choices=[('INR', 'Indian rupee'), ('USD', 'US dollar'), ('EUR', 'Euro'), ('GBP', 'Pound sterling'), ('AED', 'UAE dirham'), ('SGD', 'Singapore dollar'), ('THB', 'Thai baht'), ('MYR', 'Malaysian ringgit'), ('NPR', 'Nepalese rupee'), ('LKR', 'Sri Lankan rupee')], default='INR', max_length=3)),
+                ('total', expenses.money.MoneyField(default=0)),
+                ('count', models.IntegerField(default=0)),
+                ('paid_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='spending_rollups', to=settings.AUTH_USER_MODEL)),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='expenses.trip')),
+            ],
+            options={
+                'unique_together': {('trip', 'category', 'date', 'paid_by')},
+            },
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-18 07:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0014_spendingrollup'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ledgerentry',
+            name='kind',
+            field=models.CharField(choices=[('expense', 'Expense'), ('reversal', 'Reversal'), ('settlement', 'Settlement'), ('correction', 'Correction')], default='expense', max_length=20),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 6.0.1 on 2026-10-18 07:56
+
+import django.db.models.deletion
+import expenses.money
+from django.conf import settings
+from django.db import migrations, models
+
+
+def pair_settlements(apps, schema_editor):
+    """
+    Turn settlement entries written before payments existed into Payments. Each
+    settlement wrote the debtor's entry and then the creditor's, so consecutive
+    entries of a trip with opposite amounts are one payment.
+    """
+    LedgerEntry = apps.get_model('expenses', 'LedgerEntry')
+    Payment = apps.get_model('expenses', 'Payment')
+    entries = list(LedgerEntry.objects.filter(kind='settlement', payment__isnull=True).order_by('trip_id', 'id'))
+    linked = []
+    for debtor, creditor in zip(entries, entries[1:]):
+        if debtor.payment_id or debtor.trip_id != creditor.trip_id or debtor.amount <= 0 \
+                or debtor.amount + creditor.amount != 0:
+            continue
+        payment = Payment.objects.create(trip_id=debtor.trip_id, from_user_id=debtor.user_id,
+                                         to_user_id=creditor.user_id, amount=debtor.amount)
+        Payment.objects.filter(pk=payment.pk).update(created_at=debtor.created_at)
+        debtor.payment_id = creditor.payment_id = payment.pk
+        linked += [debtor, creditor]
+    LedgerEntry.objects.bulk_update(linked, ['payment'], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0015_ledger_corrections'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Payment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', expenses.money.MoneyField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('from_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payments_made', to=settings.AUTH_USER_MODEL)),
+                ('to_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payments_received', to=settings.AUTH_USER_MODEL)),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payments', to='expenses.trip')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='ledgerentry',
+            name='payment',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='expenses.payment'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['trip', '-created_at'], name='payment_trip_created_idx'),
+        ),
+        migrations.RunPython(pair_settlements, migrations.RunPython.noop),
+    ]
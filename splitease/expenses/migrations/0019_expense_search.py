@@ -0,0 +1,61 @@
+# Generated by Django 6.0.1 on 2026-10-18 08:09
+
+from django.db import migrations
+
+PAYER_NAME = "(SELECT trim(first_name || ' ' || username) FROM auth_user WHERE id = {expense}.paid_by_id)"
+
+INDEX_ROW = (
+    "INSERT INTO expenses_search (rowid, description, category, payer, trip_id) "
+    "VALUES (NEW.id, NEW.description, NEW.category, " + PAYER_NAME.format(expense='NEW') + ", NEW.trip_id);"
+)
+
+CREATE = [
+    "CREATE VIRTUAL TABLE expenses_search USING fts5("
+    "description, category, payer, trip_id UNINDEXED, tokenize = 'unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER expenses_search_insert AFTER INSERT ON expenses_expense BEGIN " + INDEX_ROW + " END",
+    "CREATE TRIGGER expenses_search_update AFTER UPDATE OF description, category, paid_by_id, trip_id "
+    "ON expenses_expense BEGIN DELETE FROM expenses_search WHERE rowid = OLD.id; " + INDEX_ROW + " END",
+    "CREATE TRIGGER expenses_search_delete AFTER DELETE ON expenses_expense BEGIN "
+    "DELETE FROM expenses_search WHERE rowid = OLD.id; END",
+    # Payers are searched by name, so a rename reaches every expense they paid for
+    "CREATE TRIGGER expenses_search_payer AFTER UPDATE OF first_name, username ON auth_user BEGIN "
+    "UPDATE expenses_search SET payer = trim(NEW.first_name || ' ' || NEW.username) "
+    "WHERE rowid IN (SELECT id FROM expenses_expense WHERE paid_by_id = NEW.id); END",
+    "INSERT INTO expenses_search (rowid, description, category, payer, trip_id) "
+    "SELECT id, description, category, " + PAYER_NAME.format(expense='expenses_expense') + ", trip_id "
+    "FROM expenses_expense",
+]
+
+DROP = [
+    "DROP TRIGGER IF EXISTS expenses_search_payer",
+    "DROP TRIGGER IF EXISTS expenses_search_delete",
+    "DROP TRIGGER IF EXISTS expenses_search_update",
+    "DROP TRIGGER IF EXISTS expenses_search_insert",
+    "DROP TABLE IF EXISTS expenses_search",
+]
+
+
+def create_index(apps, schema_editor):
+    # FTS5 is SQLite's; elsewhere search falls back to filtering the expense table
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in CREATE:
+            schema_editor.execute(statement)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in DROP:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0018_change_log'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        # Tagged with the model, so every shard database indexes its own expenses too
+        migrations.RunPython(create_index, drop_index, hints={'model_name': 'expense'}),
+    ]
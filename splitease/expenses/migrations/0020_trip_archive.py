@@ -0,0 +1,60 @@
+# Generated by Django 6.0.1 on 2026-10-18 08:14
+
+import django.db.models.deletion
+import expenses.money
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0019_expense_search'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='archived_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='ledgerentry',
+            name='kind',
+            field=models.CharField(choices=[('expense', 'Expense'), ('reversal', 'Reversal'), ('settlement', 'Settlement'), ('correction', 'Correction'), ('archive', 'Archive')], default='expense', max_length=20),
+        ),
+        migrations.CreateModel(
+            name='ArchivedBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('paid', expenses.money.MoneyField(default=0)),
+                ('share', expenses.money.MoneyField(default=0)),
+                ('balance', expenses.money.MoneyField(default=0)),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_balances', to='expenses.trip')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('trip', 'user')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedExpense',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('amount', expenses.money.MoneyField()),
+                ('currency', models.CharField(choices=[('INR', 'Indian rupee'), ('USD', 'US dollar'), ('EUR', 'Euro'), ('GBP', 'Pound sterling'), ('AED', 'UAE dirham'), ('SGD', 'Singapore dollar'), ('THB', 'Thai baht'), ('MYR', 'Malaysian ringgit'), ('NPR', 'Nepalese rupee'), ('LKR', 'Sri Lankan rupee')], default='INR', max_length=3)),
+                ('base_amount', expenses.money.MoneyField()),
+                ('category', models.CharField(choices=[('Food', 'Food'), ('Travel', 'Travel'), ('Stay', 'Stay'), ('Other', 'Other')], max_length=50)),
+                ('description', models.CharField(max_length=255)),
+                ('date', models.DateField(blank=True, null=True)),
+                ('split_method', models.CharField(choices=[('equal', 'Equally'), ('shares', 'By shares'), ('percentage', 'By percentage'), ('exact', 'Exact amounts')], default='equal', max_length=20)),
+                ('shares', models.JSONField(default=dict)),
+                ('paid_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_expenses', to='expenses.trip')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['trip', 'date', 'id'], name='archived_expense_trip_date_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 6.0.1 on 2026-10-18 08:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0020_trip_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TripShard',
+            fields=[
+                ('trip', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='shard', serialize=False, to='expenses.trip')),
+                ('alias', models.CharField(max_length=50)),
+            ],
+        ),
+    ]
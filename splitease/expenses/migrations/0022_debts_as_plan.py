@@ -0,0 +1,65 @@
+# Generated by Django 6.0.1 on 2026-10-18 13:05
+
+import heapq
+from collections import defaultdict
+
+from django.db import migrations
+
+
+def _plan(balances):
+    """
+    (debtor, creditor, paise) payments settling {user_id: paise}, the biggest
+    debtor paying the biggest creditor each time, as settlement.simplify() does
+    """
+    creditors = [(-paise, user_id) for user_id, paise in balances.items() if paise > 0]
+    debtors = [(paise, user_id) for user_id, paise in balances.items() if paise < 0]
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+    payments = []
+    while creditors and debtors:
+        credit, creditor_id = heapq.heappop(creditors)
+        debit, debtor_id = heapq.heappop(debtors)
+        paise = min(-credit, -debit)
+        payments.append((debtor_id, creditor_id, paise))
+        if -credit > paise:
+            heapq.heappush(creditors, (credit + paise, creditor_id))
+        if -debit > paise:
+            heapq.heappush(debtors, (debit + paise, debtor_id))
+    return payments
+
+
+def debts_as_plan(apps, schema_editor):
+    """
+    Rewrite every trip's Debt rows as its settlement plan. Posting an expense
+    used to add each share to a pairwise row, so the rows could say two members
+    owe each other while their balances say nobody owes anything.
+    """
+    db = schema_editor.connection.alias
+    Debt = apps.get_model('expenses', 'Debt')
+    MemberBalance = apps.get_model('expenses', 'MemberBalance')
+
+    balances = defaultdict(dict)
+    for trip_id, user_id, balance in (MemberBalance.objects.using(db)
+                                      .values_list('trip_id', 'user_id', 'balance').iterator()):
+        balances[trip_id][user_id] = int(balance)
+    Debt.objects.using(db).filter(amount__gt=0).update(amount=0)
+    Debt.objects.using(db).bulk_create(
+        [Debt(trip_id=trip_id, from_user_id=debtor_id, to_user_id=creditor_id, amount=paise)
+         for trip_id, trip_balances in balances.items() for debtor_id, creditor_id, paise in _plan(trip_balances)],
+        batch_size=2000,
+        update_conflicts=True,
+        unique_fields=['trip', 'from_user', 'to_user'],
+        update_fields=['amount'],
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0021_trip_shard'),
+    ]
+
+    operations = [
+        # Tagged with the model, so every shard database re-plans its own trips too
+        migrations.RunPython(debts_as_plan, migrations.RunPython.noop, hints={'model_name': 'debt'}),
+    ]
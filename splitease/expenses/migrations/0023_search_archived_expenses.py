@@ -0,0 +1,69 @@
+# Generated by Django 6.0.1 on 2026-10-18 15:40
+
+from django.db import migrations
+
+PAYER_NAME = "(SELECT trim(first_name || ' ' || username) FROM auth_user WHERE id = {expense}.paid_by_id)"
+
+INDEX_ROW = (
+    "INSERT INTO expenses_search (rowid, description, category, payer, trip_id) "
+    "VALUES (NEW.id, NEW.description, NEW.category, " + PAYER_NAME.format(expense='NEW') + ", NEW.trip_id);"
+)
+
+CREATE = [
+    # Archiving copies an expense to the archive before deleting it: the copy takes over its row,
+    # and deleting the expense leaves that alone
+    "CREATE TRIGGER expenses_search_archive AFTER INSERT ON expenses_archivedexpense BEGIN "
+    "DELETE FROM expenses_search WHERE rowid = NEW.id; " + INDEX_ROW + " END",
+    "CREATE TRIGGER expenses_search_archive_delete AFTER DELETE ON expenses_archivedexpense BEGIN "
+    "DELETE FROM expenses_search WHERE rowid = OLD.id; END",
+    "DROP TRIGGER expenses_search_delete",
+    "CREATE TRIGGER expenses_search_delete AFTER DELETE ON expenses_expense "
+    "WHEN NOT EXISTS (SELECT 1 FROM expenses_archivedexpense WHERE id = OLD.id) BEGIN "
+    "DELETE FROM expenses_search WHERE rowid = OLD.id; END",
+    "DROP TRIGGER expenses_search_payer",
+    "CREATE TRIGGER expenses_search_payer AFTER UPDATE OF first_name, username ON auth_user BEGIN "
+    "UPDATE expenses_search SET payer = trim(NEW.first_name || ' ' || NEW.username) "
+    "WHERE rowid IN (SELECT id FROM expenses_expense WHERE paid_by_id = NEW.id "
+    "UNION ALL SELECT id FROM expenses_archivedexpense WHERE paid_by_id = NEW.id); END",
+    # Trips archived so far dropped out of the index
+    "INSERT INTO expenses_search (rowid, description, category, payer, trip_id) "
+    "SELECT id, description, category, " + PAYER_NAME.format(expense='expenses_archivedexpense') + ", trip_id "
+    "FROM expenses_archivedexpense WHERE id NOT IN (SELECT rowid FROM expenses_search)",
+]
+
+DROP = [
+    "DELETE FROM expenses_search WHERE rowid IN (SELECT id FROM expenses_archivedexpense)",
+    "DROP TRIGGER IF EXISTS expenses_search_payer",
+    "CREATE TRIGGER expenses_search_payer AFTER UPDATE OF first_name, username ON auth_user BEGIN "
+    "UPDATE expenses_search SET payer = trim(NEW.first_name || ' ' || NEW.username) "
+    "WHERE rowid IN (SELECT id FROM expenses_expense WHERE paid_by_id = NEW.id); END",
+    "DROP TRIGGER IF EXISTS expenses_search_delete",
+    "CREATE TRIGGER expenses_search_delete AFTER DELETE ON expenses_expense BEGIN "
+    "DELETE FROM expenses_search WHERE rowid = OLD.id; END",
+    "DROP TRIGGER IF EXISTS expenses_search_archive_delete",
+    "DROP TRIGGER IF EXISTS expenses_search_archive",
+]
+
+
+def index_archive(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in CREATE:
+            schema_editor.execute(statement)
+
+
+def unindex_archive(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in DROP:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0022_debts_as_plan'),
+    ]
+
+    operations = [
+        # Tagged with the model, so every shard database indexes its own archive too
+        migrations.RunPython(index_archive, unindex_archive, hints={'model_name': 'archivedexpense'}),
+    ]
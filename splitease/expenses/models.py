@@ -1,5 +1,8 @@
 from django.db import models
 from django.contrib.auth.models import User#djangos built in user system
+from django.utils import timezone
+from .money import CURRENCIES, DEFAULT_CURRENCY, MoneyField, display
+from .splits import METHODS as SPLIT_METHODS
 
 class Trip(models.Model):
     name = models.CharField(max_length=100)
@@ -7,10 +10,18 @@ class Trip(models.Model):
     members = models.ManyToManyField(User, related_name="trips")
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name="created_trips", null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True,null=True, blank=True)
+    # Balances, debts and settlements of the trip are all in this currency
+    base_currency = models.CharField(max_length=3, choices=CURRENCIES, default=DEFAULT_CURRENCY)
+    # Set once the trip is archived and its expenses moved to ArchivedExpense (see archive.py)
+    archived_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return self.name
 
+    def expense_history(self):
+        """The trip's expenses, from the archive once the trip is archived"""
+        return self.archived_expenses.all() if self.archived_at else self.expenses.all()
+
 class TripMember(models.Model):
     trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name="trip_members")
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
@@ -20,6 +31,11 @@ class TripMember(models.Model):
 
     class Meta:
         unique_together = ('trip', 'whatsapp_number')
+        # Finding a trip's row for a given account, or for a placeholder by name
+        indexes = [
+            models.Index(fields=['trip', 'user'], name='tripmember_trip_user_idx'),
+            models.Index(fields=['trip', 'name'], name='tripmember_trip_name_idx'),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.whatsapp_number}) - {self.trip.name}"
@@ -41,23 +57,283 @@ class Expense(models.Model):
         ('Other', 'Other'),
     ]
     trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name="expenses")
-    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    # What was paid, in the currency it was paid in
+    amount = MoneyField()
+    currency = models.CharField(max_length=3, choices=CURRENCIES, default=DEFAULT_CURRENCY)
+    # The same converted to the trip's base currency when it was posted; splits use this
+    base_amount = MoneyField()
     paid_by = models.ForeignKey(User, on_delete=models.CASCADE)
     category = models.CharField(max_length=50, choices=CATEGORIES)
     description = models.CharField(max_length=255)
     date = models.DateField(auto_now_add=True,null=True, blank=True)
+    split_method = models.CharField(max_length=20, choices=SPLIT_METHODS, default='equal')
+
+    class Meta:
+        # Back the keyset pagination of the expense history, with and without filters
+        indexes = [
+            models.Index(fields=['trip', 'date', 'id'], name='expense_trip_date_idx'),
+            models.Index(fields=['trip', 'category', 'date', 'id'], name='expense_trip_category_idx'),
+            models.Index(fields=['trip', 'paid_by', 'date', 'id'], name='expense_trip_payer_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.description} ({self.amount})"
+        return f"{self.description} ({display(self.amount, self.currency)})"
+
+class ExpenseSplit(models.Model):
+    """One member's share of an expense, exactly as the split engine allocated it"""
+    expense = models.ForeignKey(Expense, on_delete=models.CASCADE, related_name="splits")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="expense_splits")
+    share = MoneyField()
+    # The weight or percentage the share was worked out from (none for equal or exact splits)
+    weight = models.DecimalField(max_digits=12, decimal_places=4, null=True, blank=True)
+
+    class Meta:
+        unique_together = ('expense', 'user')
+
+    def __str__(self):
+        return f"{self.user} pays {self.share} of {self.expense}"
 
 class Debt(models.Model):
+    """One payment in the trip's settlement plan, re-planned whenever a balance changes"""
     trip = models.ForeignKey(Trip, on_delete=models.CASCADE)
     from_user = models.ForeignKey(User, related_name="debts_to_pay", on_delete=models.CASCADE)
     to_user = models.ForeignKey(User, related_name="debts_to_receive", on_delete=models.CASCADE)
-    amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    amount = MoneyField(default=0)
 
     class Meta:
         unique_together = ('trip', 'from_user', 'to_user')
+        # Amounts never go negative and settled rows stay behind at zero, so the
+        # open (amount > 0) ones get partial indexes:
+        # per trip for settlement plans, per side for a member's own debts
+        indexes = [
+            models.Index(fields=['trip', 'from_user', 'to_user'], condition=models.Q(amount__gt=0),
+                         name='debt_open_trip_idx'),
+            models.Index(fields=['from_user', 'trip'], condition=models.Q(amount__gt=0),
+                         name='debt_open_from_idx'),
+            models.Index(fields=['to_user', 'trip'], condition=models.Q(amount__gt=0),
+                         name='debt_open_to_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.from_user} owes {self.amount} to {self.to_user}"
+
+class Payment(models.Model):
+    """
+    Money one member paid another towards what they owe, in the trip's currency.
+    A payment can cover a planned transfer in full or only part of it.
+    """
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name="payments")
+    from_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="payments_made")
+    to_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="payments_received")
+    amount = MoneyField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # Newest first on the dashboard
+        indexes = [models.Index(fields=['trip', '-created_at'], name='payment_trip_created_idx')]
+
+    def __str__(self):
+        return f"{self.from_user} paid {self.amount} to {self.to_user}"
+
+class LedgerEntry(models.Model):
+    """
+    Append-only record of every change to a member's balance.
+    Positive amounts mean the member is owed more, negative means they owe more.
+    Rows are never edited: deleting an expense adds reversal entries instead.
+    Archiving a trip folds its entries into one 'archive' entry per member.
+    """
+    KINDS = [
+        ('expense', 'Expense'),
+        ('reversal', 'Reversal'),
+        ('settlement', 'Settlement'),
+        # Written by rebuild_balances when a balance had drifted from the expenses
+        ('correction', 'Correction'),
+        # What a member's entries added up to when their trip was archived
+        ('archive', 'Archive'),
+    ]
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name="ledger_entries")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="ledger_entries")
+    expense = models.ForeignKey(Expense, on_delete=models.SET_NULL, null=True, blank=True, related_name="ledger_entries")
+    payment = models.ForeignKey(Payment, on_delete=models.SET_NULL, null=True, blank=True, related_name="ledger_entries")
+    amount = MoneyField()
+    kind = models.CharField(max_length=20, choices=KINDS, default='expense')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.user} {self.amount:+} ({self.kind})"
+
+class MemberBalance(models.Model):
+    """Running net balance of one member in one trip, kept in step with the ledger"""
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name="balances")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="trip_balances")
+    balance = MoneyField(default=0)
+
+    class Meta:
+        unique_together = ('trip', 'user')
+
+    def __str__(self):
+        return f"{self.user}: {self.balance} in {self.trip.name}"
+
+class FxRate(models.Model):
+    """What one unit of a currency was worth in rupees on a date (see fx.py)"""
+    currency = models.CharField(max_length=3, choices=CURRENCIES)
+    date = models.DateField()
+    rate = models.DecimalField(max_digits=18, decimal_places=8)
+
+    class Meta:
+        unique_together = ('currency', 'date')
+
+    def __str__(self):
+        return f"{self.currency} {self.rate} on {self.date}"
+
+class SpendingRollup(models.Model):
+    """
+    Spending of one payer in one category on one day of a trip, in the trip's
+    currency. Kept up to date as expenses come and go (see analytics.py).
+    """
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name="rollups")
+    category = models.CharField(max_length=50, choices=Expense.CATEGORIES)
+    date = models.DateField()
+    paid_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name="spending_rollups")
+    # The trip's base currency, copied here so cross-trip totals need no join
+    currency = models.CharField(max_length=3, choices=CURRENCIES, default=DEFAULT_CURRENCY)
+    total = MoneyField(default=0)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('trip', 'category', 'date', 'paid_by')
+
+    def __str__(self):
+        return f"{self.paid_by} spent {self.total} on {self.category} on {self.date}"
+
+class Reminder(models.Model):
+    """
+    A nudge for one planned payment, worked out ahead of time (see reminders.py)
+    so pages and the reminder emails don't build the text and links themselves.
+    """
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name="reminders")
+    debtor = models.ForeignKey(User, on_delete=models.CASCADE, related_name="reminders_to_pay")
+    creditor = models.ForeignKey(User, on_delete=models.CASCADE, related_name="reminders_to_receive")
+    amount = MoneyField()
+    message = models.TextField()
+    # Click-to-chat link to the debtor with the message filled in; blank without a number
+    whatsapp_url = models.URLField(max_length=2000, blank=True)
+    updated_at = models.DateTimeField(default=timezone.now)
+    last_sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('trip', 'debtor', 'creditor')
+
+    def __str__(self):
+        return f"{self.debtor} to pay {self.amount} to {self.creditor}"
+
+class Job(models.Model):
+    """A piece of background work for manage.py run_jobs (see jobs.py)"""
+    STATUSES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('failed', 'Failed'),
+    ]
+    kind = models.CharField(max_length=50)
+    # Jobs sharing a key are one job for as long as it is waiting to run
+    key = models.CharField(max_length=100, null=True, blank=True)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    claimed_by = models.CharField(max_length=100, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_after'], name='job_ready_idx')]
+        constraints = [
+            models.UniqueConstraint(fields=['key'], condition=models.Q(status='pending'), name='job_pending_key_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} job {self.pk} ({self.status})"
+
+class Change(models.Model):
+    """
+    One entry in the change log mobile clients sync from (see changelog.py). The
+    id is the sync cursor. Trip and user are plain ids, not foreign keys, so
+    entries outlive the rows they describe.
+    """
+    MODELS = [
+        ('trip', 'Trip'),
+        ('membership', 'Membership'),
+        ('tripmember', 'Trip member'),
+        ('expense', 'Expense'),
+        # The trip's debts as a whole: they change in bulk with every expense
+        ('debts', 'Debts'),
+    ]
+    ACTIONS = [
+        ('insert', 'Insert'),
+        ('update', 'Update'),
+        ('delete', 'Delete'),
+    ]
+    trip_id = models.BigIntegerField()
+    model = models.CharField(max_length=10, choices=MODELS)
+    object_id = models.BigIntegerField(null=True, blank=True)
+    action = models.CharField(max_length=6, choices=ACTIONS)
+    # Set when someone joins or leaves a trip, so they hear about trips they are no longer in
+    user_id = models.BigIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['trip_id', 'id'], name='change_trip_idx'),
+            models.Index(fields=['user_id', 'id'], condition=models.Q(user_id__isnull=False),
+                         name='change_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.action} {self.model} {self.object_id} in trip {self.trip_id}"
+
+class ArchivedExpense(models.Model):
+    """
+    An expense of an archived trip, moved out of the Expense table. It keeps
+    its id and fields, so it reads like an Expense, with its splits inline.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name="archived_expenses")
+    amount = MoneyField()
+    currency = models.CharField(max_length=3, choices=CURRENCIES, default=DEFAULT_CURRENCY)
+    base_amount = MoneyField()
+    paid_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    category = models.CharField(max_length=50, choices=Expense.CATEGORIES)
+    description = models.CharField(max_length=255)
+    date = models.DateField(null=True, blank=True)
+    split_method = models.CharField(max_length=20, choices=SPLIT_METHODS, default='equal')
+    # {user_id: share in paise}, what the ExpenseSplit rows held
+    shares = models.JSONField(default=dict)
+
+    class Meta:
+        indexes = [models.Index(fields=['trip', 'date', 'id'], name='archived_expense_trip_date_idx')]
+
+    def __str__(self):
+        return f"{self.description} ({display(self.amount, self.currency)})"
+
+class ArchivedBalance(models.Model):
+    """What one member had paid, owed and was left with when their trip was archived"""
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name="archived_balances")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    paid = MoneyField(default=0)
+    share = MoneyField(default=0)
+    balance = MoneyField(default=0)
+
+    class Meta:
+        unique_together = ('trip', 'user')
+
+    def __str__(self):
+        return f"{self.user}: {self.balance} in {self.trip.name} (archived)"
+
+class TripShard(models.Model):
+    """Which shard database holds a trip's rows, when trips are sharded (see sharding.py)"""
+    trip = models.OneToOneField(Trip, on_delete=models.CASCADE, primary_key=True, related_name="shard")
+    alias = models.CharField(max_length=50)
 
     def __str__(self):
-        return f"{self.from_user} owes {self.amount} to {self.to_user}"
\ No newline at end of file
+        return f"{self.trip.name} on {self.alias}"
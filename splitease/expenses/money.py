@@ -0,0 +1,113 @@
+"""
+Money as whole paise.
+
+Every amount is stored in a BigIntegerField as an integer number of paise and
+read back as Money, an int that prints as rupees ("1234.50"). Sums, balances
+and splits are plain integer arithmetic, exact and cheap, while templates,
+CSV exports and messages still show the familiar rupee form.
+
+Ints (and Money) are always paise. Decimals and text are always rupees, which
+is what forms and callers like create_expense(amount=Decimal('99.50')) hand in.
+Arithmetic is left to int, at full speed, and gives plain ints back: wrap a
+result in Money() where it is going to be shown.
+
+Amounts in other currencies are kept the same way, in hundredths (cents,
+fils, satang), with the currency code stored alongside; see fx.py.
+"""
+from decimal import Decimal, InvalidOperation
+
+from django import forms
+from django.core.exceptions import ValidationError
+from django.db import models
+
+PAISE = 100
+
+DEFAULT_CURRENCY = 'INR'
+
+CURRENCIES = [
+    ('INR', 'Indian rupee'),
+    ('USD', 'US dollar'),
+    ('EUR', 'Euro'),
+    ('GBP', 'Pound sterling'),
+    ('AED', 'UAE dirham'),
+    ('SGD', 'Singapore dollar'),
+    ('THB', 'Thai baht'),
+    ('MYR', 'Malaysian ringgit'),
+    ('NPR', 'Nepalese rupee'),
+    ('LKR', 'Sri Lankan rupee'),
+]
+
+# Currencies missing here are shown with their code, as in "AED 12.00"
+SYMBOLS = {'INR': '₹', 'USD': '$', 'EUR': '€', 'GBP': '£', 'THB': '฿'}
+
+
+class Money(int):
+    """An amount in paise that prints in rupees"""
+    __slots__ = ()
+
+    @classmethod
+    def from_rupees(cls, value):
+        """Decimal or text rupees; refuses fractions of a paisa"""
+        rupees = Decimal(str(value)) if isinstance(value, float) else Decimal(value)
+        if not rupees.is_finite():
+            raise ValueError(f"{value} is not an amount")
+        paise = rupees * PAISE
+        if paise != paise.to_integral_value():
+            raise ValueError(f"{value} has fractions of a paisa")
+        return cls(paise)
+
+    @classmethod
+    def coerce(cls, value):
+        """Money as is, ints as paise, anything else as rupees"""
+        if isinstance(value, cls):
+            return value
+        if isinstance(value, int) and not isinstance(value, bool):
+            return cls(value)
+        return cls.from_rupees(value)
+
+    @property
+    def rupees(self):
+        return Decimal(int(self)).scaleb(-2)
+
+    def __str__(self):
+        sign = '-' if self < 0 else ''
+        rupees, paise = divmod(abs(int(self)), PAISE)
+        return f"{sign}{rupees}.{paise:02d}"
+
+    def __repr__(self):
+        return f"Money({int(self)})"
+
+    def __format__(self, spec):
+        return format(self.rupees, spec) if spec else str(self)
+
+
+def display(amount, currency=DEFAULT_CURRENCY):
+    """An amount with its currency: '₹1234.50', '$3.20' or 'AED 12.00'"""
+    symbol = SYMBOLS.get(currency)
+    return f"{symbol}{Money.coerce(amount)}" if symbol else f"{currency} {Money.coerce(amount)}"
+
+
+class MoneyField(models.BigIntegerField):
+    """An amount stored as paise and read back as Money"""
+    description = "Amount in paise"
+
+    def from_db_value(self, value, expression, connection):
+        return None if value is None else Money(value)
+
+    def to_python(self, value):
+        if value is None:
+            return value
+        try:
+            return Money.coerce(value)
+        except (InvalidOperation, TypeError, ValueError):
+            raise ValidationError(f"{value} is not an amount in rupees and paise", code='invalid')
+
+    def get_prep_value(self, value):
+        value = models.Field.get_prep_value(self, value)
+        return None if value is None else int(Money.coerce(value))
+
+    def formfield(self, **kwargs):
+        # Forms take rupees with two decimals; to_python turns them into paise
+        return models.Field.formfield(self, **{
+            'form_class': forms.DecimalField, 'max_digits': 17, 'decimal_places': 2, **kwargs,
+        })
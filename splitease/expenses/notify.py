@@ -0,0 +1,50 @@
+"""
+Where reminders go.
+
+A sender takes a batch of Notices and delivers them. Which one is used comes
+from the REMINDER_SENDER setting, so deployments can plug in their own (SMS,
+a push service) with the same send_many() method:
+
+- EmailSender hands them to Django's email backend over one connection.
+- FileSender writes them to REMINDER_OUTBOX, one file per notice, for
+  development and for running without a mail server.
+"""
+import re
+from collections import namedtuple
+from pathlib import Path
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+Notice = namedtuple('Notice', ['to', 'subject', 'text', 'html'])
+
+
+class EmailSender:
+    def send_many(self, notices):
+        messages = []
+        for notice in notices:
+            message = EmailMultiAlternatives(notice.subject, notice.text, settings.DEFAULT_FROM_EMAIL, [notice.to])
+            message.attach_alternative(notice.html, 'text/html')
+            messages.append(message)
+        with get_connection() as connection:
+            return connection.send_messages(messages) or 0
+
+
+class FileSender:
+    def __init__(self, outbox=None):
+        self.outbox = Path(outbox or settings.REMINDER_OUTBOX)
+
+    def send_many(self, notices):
+        self.outbox.mkdir(parents=True, exist_ok=True)
+        stamp = timezone.now().strftime('%Y%m%d-%H%M%S-%f')
+        for i, notice in enumerate(notices):
+            name = re.sub(r'[^\w.@-]', '_', notice.to)
+            path = self.outbox / f"{stamp}-{i:04d}-{name}.html"
+            path.write_text(f"<!-- To: {notice.to}\n     Subject: {notice.subject} -->\n{notice.html}", encoding='utf-8')
+        return len(notices)
+
+
+def get_sender():
+    return import_string(settings.REMINDER_SENDER)()
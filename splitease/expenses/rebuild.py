@@ -0,0 +1,271 @@
+"""
+Full rebuild of balances and debts from the expense history.
+
+The ledger keeps MemberBalance and Debt in step with every post, but rows
+changed behind its back (the admin, raw SQL, expenses deleted before deletes
+were reversed) leave them wrong with nothing to replay. rebuild() works out
+what every balance should be from scratch:
+
+    what a member paid - their shares of expenses
+        + what they paid back to others - what others paid back to them
+
+then compares it with the stored balances, with the ledger and with the open
+debts, and writes corrections only for the trips that are out of step.
+
+Trips are handled in chunks. Each chunk is summed by the database (a handful
+of GROUP BY queries streamed with iterator(), so memory depends on members,
+not on expenses) in a pool of worker processes, while this process writes the
+results back with bulk upserts. Corrections go into the ledger too, as
+'correction' entries, so the ledger still adds up to the balances afterwards.
+
+Writes are checked against the trip's newest ledger entry as of the read: a
+trip that moved while its chunk was being summed is left alone and reported.
+When trips are sharded each chunk holds trips of one database, and is summed
+and written there.
+"""
+import os
+from collections import defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.db import connections, transaction
+from django.db.models import Count, F, Max, Sum
+
+from . import changelog, sharding
+from .caching import trip_changed
+from .models import Debt, Expense, ExpenseSplit, LedgerEntry, MemberBalance, Payment, Trip
+from .money import Money
+from .settlement import simplify
+from .splits import Split, compute_shares
+
+CHUNK_SIZE = 500
+STREAM_SIZE = 2000
+
+# What a rebuild compares against the expense history
+CHECKS = ('balance', 'ledger', 'debts')
+
+Mismatch = namedtuple('Mismatch', ['trip_id', 'user_id', 'check', 'found', 'expected'])
+
+
+class TripState:
+    """One trip's balances as recomputed, next to what is stored"""
+    __slots__ = ('trip_id', 'version', 'expected', 'balance', 'ledger', 'debts', 'expenses')
+
+    def __init__(self, trip_id):
+        self.trip_id = trip_id
+        self.version = 0
+        self.expenses = 0
+        self.expected = defaultdict(int)
+        for check in CHECKS:
+            setattr(self, check, defaultdict(int))
+
+    def mismatches(self):
+        users = set(self.expected)
+        for check in CHECKS:
+            users.update(getattr(self, check))
+        return [
+            Mismatch(self.trip_id, user_id, check, Money(getattr(self, check)[user_id]),
+                     Money(self.expected[user_id]))
+            for user_id in sorted(users) for check in CHECKS
+            if getattr(self, check)[user_id] != self.expected[user_id]
+        ]
+
+
+def _stream(queryset):
+    return queryset.order_by().iterator(chunk_size=STREAM_SIZE)
+
+
+def recompute(trip_ids, using=sharding.DEFAULT):
+    """
+    Recomputed and stored balances of each trip in trip_ids, all of them living
+    in database using, as a list of TripState.
+    Only reads; safe to run in any number of processes at once.
+    """
+    with sharding.using(using):
+        return _recompute(trip_ids)
+
+
+def _recompute(trip_ids):
+    states = {trip_id: TripState(trip_id) for trip_id in trip_ids}
+    # Version first: anything posted from here on shows up as a newer ledger entry
+    for trip_id, version in _stream(LedgerEntry.objects.filter(trip_id__in=trip_ids)
+                                    .values('trip_id').annotate(Max('id')).values_list('trip_id', 'id__max')):
+        states[trip_id].version = version
+
+    for trip_id, user_id, paid, count in _stream(
+            Expense.objects.filter(trip_id__in=trip_ids).values('trip_id', 'paid_by_id')
+            .annotate(Sum('base_amount'), Count('id')).values_list('trip_id', 'paid_by_id', 'base_amount__sum', 'id__count')):
+        states[trip_id].expected[user_id] += paid
+        states[trip_id].expenses += count
+    for trip_id, user_id, owed in _stream(
+            ExpenseSplit.objects.filter(expense__trip_id__in=trip_ids).values('expense__trip_id', 'user_id')
+            .annotate(Sum('share')).values_list('expense__trip_id', 'user_id', 'share__sum')):
+        states[trip_id].expected[user_id] -= owed
+    _split_legacy_expenses(states)
+    for side, sign in (('from_user_id', 1), ('to_user_id', -1)):
+        for trip_id, user_id, amount in _stream(
+                Payment.objects.filter(trip_id__in=trip_ids).values('trip_id', side)
+                .annotate(Sum('amount')).values_list('trip_id', side, 'amount__sum')):
+            states[trip_id].expected[user_id] += sign * amount
+    # Settlements recorded before there were Payment rows
+    for trip_id, user_id, amount in _stream(
+            LedgerEntry.objects.filter(trip_id__in=trip_ids, kind='settlement', payment__isnull=True)
+            .values('trip_id', 'user_id').annotate(Sum('amount')).values_list('trip_id', 'user_id', 'amount__sum')):
+        states[trip_id].expected[user_id] += amount
+
+    for trip_id, user_id, amount in _stream(
+            LedgerEntry.objects.filter(trip_id__in=trip_ids).values('trip_id', 'user_id')
+            .annotate(Sum('amount')).values_list('trip_id', 'user_id', 'amount__sum')):
+        states[trip_id].ledger[user_id] = amount
+    for trip_id, user_id, balance in _stream(
+            MemberBalance.objects.filter(trip_id__in=trip_ids).values_list('trip_id', 'user_id', 'balance')):
+        states[trip_id].balance[user_id] = balance
+    for trip_id, debtor_id, creditor_id, amount in _stream(
+            Debt.objects.filter(trip_id__in=trip_ids, amount__gt=0)
+            .values_list('trip_id', 'from_user_id', 'to_user_id', 'amount')):
+        states[trip_id].debts[creditor_id] += amount
+        states[trip_id].debts[debtor_id] -= amount
+    return list(states.values())
+
+
+def _split_legacy_expenses(states):
+    """Expenses posted before splits were stored count as split equally, as reverse_expense does"""
+    legacy = list(_stream(Expense.objects.filter(trip_id__in=list(states), splits__isnull=True)
+                          .values_list('trip_id', 'paid_by_id', 'base_amount')))
+    if not legacy:
+        return
+    members = defaultdict(list)
+    # In id order, like the opening balances of migration 0007
+    for trip_id, user_id in (Trip.members.through.objects.filter(trip_id__in={row[0] for row in legacy})
+                             .order_by('trip_id', 'user_id').values_list('trip_id', 'user_id')
+                             .iterator(chunk_size=STREAM_SIZE)):
+        members[trip_id].append(user_id)
+    for trip_id, payer_id, base_amount in legacy:
+        if members[trip_id]:
+            for user_id, share in compute_shares(base_amount, Split('equal', members[trip_id])).items():
+                states[trip_id].expected[user_id] -= share
+        else:
+            # Nobody to split with: the expense never moved a balance
+            states[trip_id].expected[payer_id] -= base_amount
+
+
+def _lock_trips(trip_ids, using):
+    """lock_trip() for several trips at once"""
+    trips = Trip.objects.using(using).filter(id__in=trip_ids)
+    if connections[using].features.has_select_for_update:
+        list(trips.select_for_update().values_list('id', flat=True))
+    else:
+        trips.update(id=F('id'))
+
+
+def write(states, using=sharding.DEFAULT):
+    """
+    Bring the stored balances, ledger and debts of states that are out of step
+    back in line with the expense history; the trips live in database using.
+    Returns the trip ids written and the trip ids skipped because they changed
+    since they were recomputed (a trip moved to another shard since included).
+    """
+    states = {state.trip_id: state for state in states if state.mismatches()}
+    if not states:
+        return [], []
+    with sharding.using(using), transaction.atomic(using=using):
+        _lock_trips(list(states), using)
+        versions = dict(LedgerEntry.objects.filter(trip_id__in=list(states)).values('trip_id')
+                        .annotate(Max('id')).values_list('trip_id', 'id__max').order_by())
+        skipped = sorted(trip_id for trip_id, state in states.items()
+                         if versions.get(trip_id, 0) != state.version)
+        for trip_id in skipped:
+            del states[trip_id]
+        if not states:
+            return [], skipped
+
+        corrections = []
+        balances = []
+        debts = []
+        for trip_id, state in states.items():
+            for user_id in set(state.expected) | set(state.ledger) | set(state.balance):
+                expected = state.expected[user_id]
+                if expected != state.ledger[user_id]:
+                    corrections.append(LedgerEntry(trip_id=trip_id, user_id=user_id, kind='correction',
+                                                   amount=Money(expected - state.ledger[user_id])))
+                balances.append(MemberBalance(trip_id=trip_id, user_id=user_id, balance=Money(expected)))
+            debts.extend(Debt(trip_id=trip_id, from_user_id=t.debtor_id, to_user_id=t.creditor_id, amount=t.amount)
+                         for t in simplify(state.expected))
+
+        LedgerEntry.objects.bulk_create(corrections, batch_size=STREAM_SIZE)
+        MemberBalance.objects.bulk_create(balances, batch_size=STREAM_SIZE, update_conflicts=True,
+                                          unique_fields=['trip', 'user'], update_fields=['balance'])
+        # Same as store_plan(): the trip's debts become its settlement plan
+        Debt.objects.filter(trip_id__in=list(states), amount__gt=0).update(amount=0)
+        Debt.objects.bulk_create(debts, batch_size=STREAM_SIZE, update_conflicts=True,
+                                 unique_fields=['trip', 'from_user', 'to_user'], update_fields=['amount'])
+        changelog.debts_changed(sorted(states))
+        for trip_id in states:
+            trip_changed(trip_id)
+    return sorted(states), skipped
+
+
+def _start_worker(database_names):
+    import django
+    django.setup()
+    # Each worker opens its own connections, to the same databases as the parent
+    connections.close_all()
+    for alias, name in database_names.items():
+        connections[alias].settings_dict['NAME'] = name
+
+
+def _chunks(trip_ids, size):
+    trip_ids = iter(trip_ids)
+    while chunk := list(islice(trip_ids, size)):
+        yield chunk
+
+
+def rebuild(trip_ids=None, workers=None, chunk_size=CHUNK_SIZE, verify=False):
+    """
+    Recompute the balances of trip_ids (default every trip) from their expenses
+    and, unless verify, write back corrections. Archived trips are left out:
+    their expenses are no longer there to recompute from. workers is the number of worker
+    processes (default one per CPU; 1 runs everything in this process).
+
+    Returns a report with the number of trips and expenses looked at, every
+    Mismatch found, and the trip ids written and skipped.
+    """
+    # A list rather than a cursor: the pool closes this process's connection
+    trips = Trip.objects.filter(archived_at__isnull=True)
+    if trip_ids is not None:
+        trips = trips.filter(id__in=list(trip_ids))
+    trip_ids = list(trips.order_by('id').values_list('id', flat=True))
+    workers = workers or os.cpu_count() or 1
+    report = {'trips': 0, 'expenses': 0, 'mismatches': [], 'written': [], 'skipped': []}
+
+    def collect(using, states):
+        report['trips'] += len(states)
+        report['expenses'] += sum(state.expenses for state in states)
+        for state in states:
+            report['mismatches'].extend(state.mismatches())
+        if not verify:
+            written, skipped = write(states, using)
+            report['written'].extend(written)
+            report['skipped'].extend(skipped)
+
+    chunks = ((using, chunk) for using, ids in sharding.group(trip_ids).items()
+              for chunk in _chunks(ids, chunk_size))
+    if workers == 1:
+        for using, chunk in chunks:
+            collect(using, recompute(chunk, using))
+        return report
+
+    # Forked workers must not share this process's connections
+    database_names = {alias: str(connections[alias].settings_dict['NAME']) for alias in sharding.databases()}
+    connections.close_all()
+    with ProcessPoolExecutor(workers, initializer=_start_worker, initargs=(database_names,)) as pool:
+        # A few chunks in flight per worker keeps them busy without queueing every trip up front
+        pending = []
+        for using, chunk in chunks:
+            pending.append((using, pool.submit(recompute, chunk, using)))
+            if len(pending) >= workers * 2:
+                using, future = pending.pop(0)
+                collect(using, future.result())
+        for using, future in pending:
+            collect(using, future.result())
+    return report
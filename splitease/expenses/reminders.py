@@ -0,0 +1,165 @@
+"""
+Debt reminders, worked out off the request path.
+
+Once a change to a trip commits, a 'refresh_reminders' job (keyed by trip, so
+a burst of changes runs it once) stores a Reminder for every payment in the
+trip's settlement plan: the friendly message and the WhatsApp link with it
+filled in. The dashboard reads those rows rather than building the text for
+every debt on every view, and only falls back to build() for a payment whose
+reminder hasn't caught up yet.
+
+'send_reminders' jobs, queued by `manage.py send_reminders` (run it from cron),
+email every reminder that is due: rendered from emails/debt_reminder.html and
+handed to the configured sender (see notify.py) BATCH_SIZE at a time.
+"""
+import re
+from datetime import timedelta
+from urllib.parse import quote
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Q
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import timezone
+
+from . import jobs, sharding
+from .models import Reminder, Trip, TripMember
+from .money import display
+from .notify import Notice, get_sender
+from .settlement import settlement_plan
+
+BATCH_SIZE = 100
+
+PHONE_NUMBER = re.compile(r'\+?[\d\s()-]{7,20}')
+
+
+def display_name(user):
+    return user.first_name or user.username
+
+
+def whatsapp_numbers(trip_members):
+    """
+    user -> the user's WhatsApp number in the trip, or None.
+    Members are matched by account, and placeholder members by name.
+    """
+    by_user = {}
+    by_name = {}
+    for trip_member in trip_members:
+        by_user.setdefault(trip_member.user_id, trip_member)
+        by_name.setdefault(trip_member.name, trip_member)
+
+    def number(user):
+        trip_member = by_user.get(user.id) or by_name.get(user.username)
+        return trip_member.whatsapp_number if trip_member else None
+    return number
+
+
+def message_text(trip, debtor, creditor, amount):
+    return (f"Hey {display_name(debtor)}, just a friendly nudge from SplitEase! 🌍 Regarding our trip {trip.name}, "
+            f"{display_name(creditor)} covered an expense and your share comes to "
+            f"{display(amount, trip.base_currency)}. Check the home dashboard of SplitEase for the full breakdown "
+            f"whenever you're free. Thanks! 🤝")
+
+
+def whatsapp_url(number, message):
+    """Click-to-chat link with the message filled in; '' if number isn't a phone number"""
+    if not number or not PHONE_NUMBER.fullmatch(number.strip()):
+        return ''
+    digits = ''.join(c for c in number if c.isdigit())
+    return f"https://wa.me/{digits}?text={quote(message)}"
+
+
+def build(trip, transfers, users, trip_members):
+    """Unsaved Reminders for transfers, with users as {user_id: User}"""
+    number = whatsapp_numbers(trip_members)
+    now = timezone.now()
+    reminders = []
+    for transfer in transfers:
+        debtor = users[transfer.debtor_id]
+        creditor = users[transfer.creditor_id]
+        message = message_text(trip, debtor, creditor, transfer.amount)
+        reminders.append(Reminder(trip=trip, debtor=debtor, creditor=creditor, amount=transfer.amount,
+                                  message=message, whatsapp_url=whatsapp_url(number(debtor), message),
+                                  updated_at=now))
+    return reminders
+
+
+def refresh(trip_id):
+    """Rewrite a trip's reminders to match its settlement plan. Job handler."""
+    trip = Trip.objects.filter(pk=trip_id).first()
+    if trip is None:
+        return  # Deleted since the job was queued, reminders and all
+    with sharding.on_trip(trip_id):
+        transfers = settlement_plan(trip)
+        users = User.objects.in_bulk({t.debtor_id for t in transfers} | {t.creditor_id for t in transfers})
+        reminders = build(trip, transfers, users, TripMember.objects.filter(trip=trip))
+    planned = {(t.debtor_id, t.creditor_id) for t in transfers}
+    with transaction.atomic():
+        stale = [pk for pk, debtor_id, creditor_id
+                 in Reminder.objects.filter(trip=trip).values_list('pk', 'debtor_id', 'creditor_id')
+                 if (debtor_id, creditor_id) not in planned]
+        Reminder.objects.filter(pk__in=stale).delete()
+        Reminder.objects.bulk_create(reminders, update_conflicts=True,
+                                     unique_fields=['trip', 'debtor', 'creditor'],
+                                     update_fields=['amount', 'message', 'whatsapp_url', 'updated_at'])
+
+
+def queue_refresh(trip_id):
+    jobs.enqueue('refresh_reminders', key=f'refresh-reminders:{trip_id}', trip_id=trip_id)
+
+
+def due(now=None):
+    """Reminders to email now: the debtor has an address and hasn't had one for REMINDER_INTERVAL"""
+    cutoff = (now or timezone.now()) - timedelta(hours=settings.REMINDER_INTERVAL_HOURS)
+    return (Reminder.objects.filter(amount__gt=0).exclude(debtor__email='')
+            .filter(Q(last_sent_at__isnull=True) | Q(last_sent_at__lt=cutoff)))
+
+
+def notice(reminder):
+    """The email for one reminder"""
+    trip = reminder.trip
+    amount = display(reminder.amount, trip.base_currency)
+    trip_url = settings.SITE_URL.rstrip('/') + reverse('trip_dashboard', args=[trip.id])
+    html = render_to_string('expenses/emails/debt_reminder.html', {
+        'debtor_name': display_name(reminder.debtor),
+        'creditor_name': display_name(reminder.creditor),
+        'trip_name': trip.name,
+        'amount': amount,
+        'trip_url': trip_url,
+        'interval_hours': settings.REMINDER_INTERVAL_HOURS,
+    })
+    subject = f"Reminder: {amount} to {display_name(reminder.creditor)} for {trip.name}"
+    return Notice(reminder.debtor.email, subject, f"{reminder.message}\n\n{trip_url}", html)
+
+
+def send(trip_id=None):
+    """
+    Email the due reminders of a trip (default: every trip) in batches. Job handler.
+    Each batch is marked sent once the sender accepts it, so a retry after a
+    failure only sends what is left. Returns the number sent.
+    """
+    reminders = due()
+    if trip_id is not None:
+        reminders = reminders.filter(trip_id=trip_id)
+    ids = list(reminders.order_by('id').values_list('id', flat=True))
+    sender = get_sender()
+    sent = 0
+    for start in range(0, len(ids), BATCH_SIZE):
+        batch = list(Reminder.objects.filter(id__in=ids[start:start + BATCH_SIZE])
+                     .select_related('trip', 'debtor', 'creditor').order_by('id'))
+        sender.send_many([notice(reminder) for reminder in batch])
+        Reminder.objects.filter(id__in=[reminder.id for reminder in batch]).update(last_sent_at=timezone.now())
+        sent += len(batch)
+    return sent
+
+
+def schedule(trip_ids=None):
+    """Queue a send job for each trip (of trip_ids, default all) with reminders due. Returns the trip ids."""
+    reminders = due()
+    if trip_ids is not None:
+        reminders = reminders.filter(trip_id__in=trip_ids)
+    trip_ids = sorted(set(reminders.values_list('trip_id', flat=True)))
+    jobs.enqueue_many('send_reminders', [(f'send-reminders:{trip_id}', {'trip_id': trip_id}) for trip_id in trip_ids])
+    return trip_ids
@@ -0,0 +1,147 @@
+"""
+Full-text search over the expenses of a user's trips.
+
+On SQLite the index is an FTS5 table, expenses_search, with one row per
+expense (the rowid is the expense id): its description, category and the
+payer's name, plus the trip id to scope results by. Triggers on the expense
+and user tables (see migration 0019) keep it in step with every write, the
+bulk ones that skip model signals included. The expenses of archived trips
+stay in it: an archived copy takes over its expense's row (migration 0023).
+`manage.py rebuild_search_index` refills it from scratch.
+
+A search is one MATCH against the index joined to the user's memberships,
+ranked by bm25 with the description counting most, then one query for the
+expenses on the page. Nothing scans the expense table.
+
+Other databases have no FTS5; there search falls back to a case-insensitive
+filter, newest first.
+
+With sharded trips every shard has its own index, of the expenses it holds.
+Each is searched at once and the results are merged by rank; bm25 weighs
+words by how rare they are in each index, so ranks across shards are close
+rather than exact.
+"""
+import re
+
+from django.db import connection, connections, transaction
+from django.db.models import Q
+
+from . import sharding
+from .models import ArchivedExpense, Expense, Trip
+
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+MAX_TERMS = 8
+
+# bm25 weights of the indexed columns: description, category, payer, trip_id
+WEIGHTS = (10.0, 2.0, 5.0, 0.0)
+
+PAYER_NAME = "(SELECT trim(first_name || ' ' || username) FROM auth_user WHERE id = {expense}.paid_by_id)"
+
+
+def available():
+    return connection.vendor == 'sqlite'
+
+
+def terms(query):
+    """The words of query, at most MAX_TERMS of them"""
+    return re.findall(r'\w+', query)[:MAX_TERMS]
+
+
+def match_expression(words):
+    """
+    An FTS5 query matching rows with every word, each as a prefix. Words are
+    quoted, so nothing a user types is read as query syntax.
+    """
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def _ranked(user, words, limit, offset, using=sharding.DEFAULT):
+    """(bm25 score, expense id) of the best matches in database using, best first"""
+    memberships = Trip.members.through._meta.db_table
+    weights = ', '.join(str(weight) for weight in WEIGHTS)
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f"SELECT bm25(expenses_search, {weights}) AS score, s.rowid FROM expenses_search s "
+            f"JOIN {memberships} m ON m.trip_id = s.trip_id AND m.user_id = %s "
+            f"WHERE expenses_search MATCH %s "
+            f"ORDER BY score, s.rowid DESC LIMIT %s OFFSET %s",
+            [user.id, match_expression(words), limit, offset],
+        )
+        return cursor.fetchall()
+
+
+def _ranked_ids(user, words, limit, offset):
+    return [expense_id for _, expense_id in _ranked(user, words, limit, offset)]
+
+
+def _filtered_ids(user, words, limit, offset):
+    found = []
+    for model in (Expense, ArchivedExpense):
+        expenses = model.objects.filter(trip__members=user)
+        for word in words:
+            expenses = expenses.filter(Q(description__icontains=word) | Q(category__icontains=word)
+                                       | Q(paid_by__first_name__icontains=word) | Q(paid_by__username__icontains=word))
+        found.append(expenses.values_list('id', 'date'))
+    rows = found[0].union(found[1]).order_by('-date', '-id')[offset:offset + limit]
+    return [expense_id for expense_id, _ in rows]
+
+
+def _load(ids, using=sharding.DEFAULT):
+    """{id: expense} of ids, with their trips and payers, live or archived"""
+    expenses = Expense.objects.using(using).select_related('trip', 'paid_by').in_bulk(ids)
+    archived = [expense_id for expense_id in ids if expense_id not in expenses]
+    if archived:
+        expenses.update(ArchivedExpense.objects.using(using).select_related('trip', 'paid_by').in_bulk(archived))
+    return expenses
+
+
+def search(user, query, page=1, limit=PAGE_SIZE):
+    """
+    Page page of the expenses in user's trips matching query, best first, with
+    their trips and payers. Returns (expenses, has_next).
+    """
+    words = terms(query)
+    if not words:
+        return [], False
+    if sharding.enabled():
+        return _search_shards(user, words, page, limit)
+    find = _ranked_ids if available() else _filtered_ids
+    # One extra row says whether there is another page
+    ids = find(user, words, limit + 1, (page - 1) * limit)
+    expenses = _load(ids[:limit])
+    return [expenses[expense_id] for expense_id in ids[:limit] if expense_id in expenses], len(ids) > limit
+
+
+def _search_shards(user, words, page, limit):
+    """search() across every database: the best rows of each, merged by rank"""
+    wanted = page * limit + 1
+    found = sharding.fan_out(lambda alias: [(rank, -expense_id, alias) for rank, expense_id
+                                            in _ranked(user, words, wanted, 0, alias)])
+    best = sorted(row for rows in found for row in rows)[(page - 1) * limit:wanted]
+    where = {-negated_id: alias for _, negated_id, alias in best[:limit]}
+    expenses = {}
+    for alias in set(where.values()):
+        ids = [expense_id for expense_id, found_in in where.items() if found_in == alias]
+        expenses.update(_load(ids, alias))
+    return [expenses[expense_id] for expense_id in where if expense_id in expenses], len(best) > limit
+
+
+def rebuild():
+    """Refill the search index from the expense and archive tables. Returns the number of expenses indexed."""
+    if not available():
+        raise RuntimeError("The search index needs SQLite with FTS5")
+    indexed = 0
+    # Each shard's index covers the expenses it holds
+    for alias in sharding.databases():
+        with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+            cursor.execute("DELETE FROM expenses_search")
+            for table in ('expenses_expense', 'expenses_archivedexpense'):
+                cursor.execute(
+                    "INSERT INTO expenses_search (rowid, description, category, payer, trip_id) "
+                    f"SELECT id, description, category, {PAYER_NAME.format(expense=table)}, trip_id FROM {table}"
+                )
+                indexed += cursor.rowcount
+            # Merge the index's segments into one now that it was written in bulk
+            cursor.execute("INSERT INTO expenses_search (expenses_search) VALUES ('optimize')")
+    return indexed
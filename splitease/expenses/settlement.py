@@ -0,0 +1,102 @@
+"""
+Settlement engine: turns a trip's balances into the smallest list of payments.
+
+Every member has a single net balance (what they are owed minus what they
+owe), kept up to date by the ledger. Pairing the biggest debtor with the
+biggest creditor over and over settles at least one person per payment, so a
+trip with N members never needs more than N - 1 transfers, however many
+expenses it has. The plan is stored as the trip's Debt rows, and re-planned
+whenever a balance changes.
+"""
+import heapq
+from collections import namedtuple
+
+from . import changelog, sharding
+from .caching import trip_changed
+from .models import Debt, MemberBalance
+from .money import Money
+
+Transfer = namedtuple('Transfer', ['debtor_id', 'creditor_id', 'amount'])
+
+
+def net_balances(trip):
+    """
+    Net balance per user id for a trip, read from the materialized MemberBalance rows.
+    Positive means the user should receive money, negative means they owe.
+    """
+    return dict(MemberBalance.objects.filter(trip=trip).values_list('user_id', 'balance'))
+
+
+def simplify(balances):
+    """
+    Greedy minimum-cash-flow matching over {user_id: net balance}.
+
+    Uses two max-heaps so each step is O(log n): the largest debtor pays the
+    largest creditor, and whoever is left with a remainder goes back on the heap.
+    """
+    creditors = []
+    debtors = []
+    for user_id, amount in balances.items():
+        amount = Money.coerce(amount)
+        if amount > 0:
+            creditors.append((-amount, user_id))
+        elif amount < 0:
+            debtors.append((amount, user_id))
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+
+    transfers = []
+    while creditors and debtors:
+        credit, creditor_id = heapq.heappop(creditors)
+        debit, debtor_id = heapq.heappop(debtors)
+        # Both are stored negated, so the smaller magnitude is the larger value
+        amount = Money(min(-credit, -debit))
+        transfers.append(Transfer(debtor_id, creditor_id, amount))
+
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, creditor_id))
+        if -debit > amount:
+            heapq.heappush(debtors, (debit + amount, debtor_id))
+    return transfers
+
+
+async def anet_balances(trip):
+    """Async version of net_balances()"""
+    return {user_id: balance async for user_id, balance
+            in MemberBalance.objects.filter(trip=trip).values_list('user_id', 'balance')}
+
+
+def settlement_plan(trip):
+    """Minimal list of Transfers that settles everyone in the trip."""
+    return simplify(net_balances(trip))
+
+
+async def asettlement_plan(trip):
+    """Async version of settlement_plan()"""
+    return simplify(await anet_balances(trip))
+
+
+def store_plan(trip, transfers):
+    """
+    Rewrite the trip's Debt rows so they hold exactly these transfers.
+    Pairs that are no longer part of the plan are zeroed, not deleted.
+    """
+    rows = [
+        Debt(trip=trip, from_user_id=t.debtor_id, to_user_id=t.creditor_id, amount=t.amount)
+        for t in transfers
+    ]
+    with sharding.atomic(trip):
+        Debt.objects.filter(trip=trip, amount__gt=0).update(amount=0)
+        Debt.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=['trip', 'from_user', 'to_user'],
+            update_fields=['amount'],
+        )
+        changelog.debts_changed([trip.id])
+        trip_changed(trip.id)
+
+
+def replan(trip):
+    """Recompute the plan from current balances and store it as the trip's Debt rows"""
+    store_plan(trip, settlement_plan(trip))
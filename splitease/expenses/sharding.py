@@ -0,0 +1,447 @@
+"""
+Trips sharded across several SQLite files.
+
+SQLite lets one writer at a time into a database file, so with everything in
+db.sqlite3 a post to one trip waits for a post to any other. With TRIP_SHARDS
+set (see settings) every trip is placed on a shard database, and all that
+belongs to it lives there: its expenses and their splits, ledger, balances,
+debts, payments, rollups, TripMember rows and archive. Users, trips,
+memberships, the change log, reminders and jobs stay in default. Writes to
+trips on different shards take different files' locks and go side by side.
+
+TripShard, in default, says where each trip lives. A new trip goes to shard
+(id mod N); a trip without an entry, from before sharding was turned on,
+lives in default until rebalance_shards moves it. A shard also keeps copies
+of the trips, memberships and users its rows point at, kept up to date by the
+receivers in signals.py, so queries joining them run on a shard unchanged.
+
+Code working on one trip runs inside on_trip(), or atomic() which opens a
+transaction on the trip's database too, and TripShardRouter sends the trip's
+models there. Reads across trips, like the home page, run the same query on
+every database at once with fan_out() and merge the rows. Ids made on a shard
+start at its own offset (reserve_ids()), so ids are unique across databases
+and the merged rows keep them.
+
+move_trip() moves a trip to another shard, only ever a later one: ids start
+higher there, so the rows it brings can't collide with ids the shard hands out.
+
+With TRIP_SHARDS empty there is only default and every query is as before.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from itertools import islice
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Count, F
+from django.db.models.constants import OnConflict
+from django.db.models.fields import AutoFieldMixin
+
+from .models import (
+    ArchivedBalance, ArchivedExpense, Debt, Expense, ExpenseSplit, LedgerEntry, MemberBalance, Payment,
+    SpendingRollup, Trip, TripMember, TripShard,
+)
+
+DEFAULT = DEFAULT_DB_ALIAS
+CHUNK_SIZE = 2000
+
+# Ids made on the nth shard start above n * ID_SPACING
+ID_SPACING = 10 ** 12
+
+# Everything that belongs to one trip, splits before the expenses they join to
+SHARDED = [ExpenseSplit, LedgerEntry, Expense, Payment, Debt, MemberBalance, SpendingRollup, TripMember,
+           ArchivedExpense, ArchivedBalance]
+SHARDED_LABELS = {model._meta.label_lower for model in SHARDED}
+# Always read and written in default; the shards hold copies
+COPIED_LABELS = {'auth.user', 'expenses.trip', Trip.members.through._meta.label_lower}
+
+# (trip_id, alias) of the trip being worked on; trip_id is None across trips
+_trip = ContextVar('splitease_trip_shard', default=None)
+
+
+class TripMoved(RuntimeError):
+    """The trip moved to another shard while a write waited for it"""
+
+
+def enabled():
+    return bool(settings.TRIP_SHARDS)
+
+
+def databases():
+    """Every database holding trip rows: default, then the shards in order"""
+    return [DEFAULT, *settings.TRIP_SHARDS]
+
+
+def current():
+    """The database trip rows go to here"""
+    context = _trip.get()
+    return context[1] if context else DEFAULT
+
+
+def _lookup(trip_id):
+    return TripShard.objects.filter(trip_id=trip_id).values_list('alias', flat=True).first() or DEFAULT
+
+
+def db_for_trip(trip_id):
+    """The database holding trip_id's rows. No query when trips aren't sharded or already on this one."""
+    if not enabled():
+        return DEFAULT
+    context = _trip.get()
+    if context and context[0] == trip_id:
+        return context[1]
+    return _lookup(trip_id)
+
+
+def group(trip_ids):
+    """trip_ids as {database: [trip ids]}, keeping their order"""
+    trip_ids = list(trip_ids)
+    if not enabled():
+        return {DEFAULT: trip_ids}
+    placed = {}
+    for start in range(0, len(trip_ids), CHUNK_SIZE):
+        placed.update(TripShard.objects.filter(trip_id__in=trip_ids[start:start + CHUNK_SIZE])
+                      .values_list('trip_id', 'alias'))
+    groups = {}
+    for trip_id in trip_ids:
+        groups.setdefault(placed.get(trip_id, DEFAULT), []).append(trip_id)
+    return groups
+
+
+def check_placement(trip_id, alias):
+    """Raise TripMoved if trip_id no longer lives in alias. Call it holding the trip's lock."""
+    if enabled() and _lookup(trip_id) != alias:
+        raise TripMoved(f"Trip {trip_id} moved to another shard; try again")
+
+
+@contextmanager
+def using(alias, trip_id=None):
+    """Send trip rows to alias inside the block"""
+    token = _trip.set((trip_id, alias))
+    try:
+        yield alias
+    finally:
+        _trip.reset(token)
+
+
+@contextmanager
+def on_trip(trip_id):
+    """Send trip rows to trip_id's database inside the block, which gets the alias"""
+    context = _trip.get()
+    if context and context[0] == trip_id:
+        yield context[1]
+        return
+    with using(db_for_trip(trip_id), trip_id) as alias:
+        yield alias
+
+
+@contextmanager
+def atomic(trip):
+    """on_trip() for trip, in a transaction on its database"""
+    with on_trip(trip.pk) as alias, transaction.atomic(using=alias):
+        yield alias
+
+
+def trip_view(view):
+    """Run a view taking trip_id on that trip's database"""
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            trip_id = kwargs['trip_id']
+            alias = await sync_to_async(db_for_trip)(trip_id) if enabled() else DEFAULT
+            with using(alias, trip_id):
+                return await view(request, *args, **kwargs)
+    else:
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            with on_trip(kwargs['trip_id']):
+                return view(request, *args, **kwargs)
+    return wrapper
+
+
+class TripShardRouter:
+    """
+    Sends a trip's rows to the trip's database: that of the on_trip() block
+    around the query, else that of the trip (or trip row) the query hangs off.
+    Users, trips and memberships always go to default.
+    """
+
+    def _db(self, model, **hints):
+        if not enabled():
+            return None
+        label = model._meta.label_lower
+        if label in COPIED_LABELS:
+            return DEFAULT
+        if label not in SHARDED_LABELS:
+            return None
+        context = _trip.get()
+        if context:
+            return context[1]
+        instance = hints.get('instance')
+        trip_id = instance.pk if isinstance(instance, Trip) else getattr(instance, 'trip_id', None)
+        # Otherwise Django keeps to the database the instance came from
+        return db_for_trip(trip_id) if trip_id is not None else None
+
+    db_for_read = _db
+    db_for_write = _db
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # A trip's rows point at copies of the users and trip next to them
+        return True if enabled() else None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Data migrations (RunPython with no model) fix up rows from before them, and
+        # would read default's; a shard starts out with none. Schema changes run everywhere.
+        if db != DEFAULT and model_name is None:
+            return False
+        return None
+
+
+# Reads across trips
+
+def _run(read, alias):
+    try:
+        with using(alias):
+            return read(alias)
+    finally:
+        # The thread goes away with the pool; so should its connections
+        connections.close_all()
+
+
+def fan_out(read, aliases=None):
+    """
+    read(alias) for each database (default every one), all at once in threads,
+    with trip rows sent to that database. Returns the results in order. Inside
+    a transaction the reads run here, one after another, so they see its writes.
+    """
+    aliases = databases() if aliases is None else list(aliases)
+    if len(aliases) == 1 or any(connections[alias].in_atomic_block for alias in aliases):
+        results = []
+        for alias in aliases:
+            with using(alias):
+                results.append(read(alias))
+        return results
+    with ThreadPoolExecutor(len(aliases)) as pool:
+        return list(pool.map(_run, [read] * len(aliases), aliases))
+
+
+def gather(queryset):
+    """queryset's rows from every database, default's first"""
+    return [row for rows in fan_out(lambda alias: list(queryset.all())) for row in rows]
+
+
+def locate(queryset, **lookup):
+    """The row of queryset matching lookup in whichever database has it, or None"""
+    for row in fan_out(lambda alias: queryset.filter(**lookup).first()):
+        if row is not None:
+            return row
+    return None
+
+
+def local_trips(trips, alias):
+    """The trips of a Trip queryset whose rows alias holds, read from alias"""
+    trips = trips.using(alias)
+    if alias == DEFAULT and enabled():
+        # default has every trip; only the unplaced ones keep their rows there
+        trips = trips.filter(shard__isnull=True)
+    return trips
+
+
+# Copies of users, trips and memberships on the shards
+
+def _insert(model, rows, alias, on_conflict):
+    """
+    Insert rows into alias with every value as it is. bulk_create() would set
+    auto_now_add fields, like an expense's date, to the time of the copy.
+    A row whose id is already there replaces it (OnConflict.UPDATE) or is
+    left out (OnConflict.IGNORE).
+    """
+    fields = model._meta.concrete_fields
+    update = on_conflict == OnConflict.UPDATE
+    batch_size = connections[alias].ops.bulk_batch_size(fields, rows)
+    for start in range(0, len(rows), batch_size):
+        model._base_manager.using(alias)._insert(
+            rows[start:start + batch_size], fields=fields, raw=True, using=alias, on_conflict=on_conflict,
+            unique_fields=[model._meta.pk] if update else None,
+            update_fields=[field for field in fields if not field.primary_key] if update else None,
+        )
+
+
+def _copy(queryset, alias):
+    """Write queryset's rows from default into alias as they are, over any copies already there"""
+    rows = list(queryset.using(DEFAULT))
+    if rows:
+        _insert(queryset.model, rows, alias, OnConflict.UPDATE)
+
+
+def copy_users(alias, user_ids):
+    user_ids = [user_id for user_id in set(user_ids) if user_id is not None]
+    for start in range(0, len(user_ids), CHUNK_SIZE):
+        _copy(User.objects.filter(pk__in=user_ids[start:start + CHUNK_SIZE]), alias)
+
+
+def _copy_trip(trip_id, alias):
+    """Copy the trip, its memberships and their users into alias"""
+    memberships = Trip.members.through.objects.filter(trip_id=trip_id)
+    copy_users(alias, [*memberships.values_list('user_id', flat=True),
+                       *Trip.objects.filter(pk=trip_id).values_list('created_by_id', flat=True)])
+    _copy(Trip.objects.filter(pk=trip_id), alias)
+    with transaction.atomic(using=alias):
+        Trip.members.through.objects.using(alias).filter(trip_id=trip_id).exclude(
+            id__in=list(memberships.values_list('id', flat=True))).delete()
+        _copy(memberships, alias)
+
+
+def trip_saved(trip, created):
+    """post_save of Trip: place a new trip on its shard, or bring the copy of a placed one up to date"""
+    if created:
+        alias = settings.TRIP_SHARDS[trip.pk % len(settings.TRIP_SHARDS)]
+        TripShard.objects.create(trip=trip, alias=alias)
+    else:
+        alias = db_for_trip(trip.pk)
+    if alias != DEFAULT:
+        _copy_trip(trip.pk, alias)
+
+
+def members_changed(trip_id):
+    """Bring the trip's shard up to date with its memberships"""
+    alias = db_for_trip(trip_id)
+    if alias != DEFAULT:
+        _copy_trip(trip_id, alias)
+
+
+def user_left_all(user_id):
+    """Drop user_id's memberships from every shard"""
+    for alias in settings.TRIP_SHARDS:
+        Trip.members.through.objects.using(alias).filter(user_id=user_id).delete()
+
+
+def user_saved(user, update_fields):
+    """post_save of User: update the user's copies, on whichever shards have one"""
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    fields = {field.name: getattr(user, field.attname) for field in User._meta.concrete_fields
+              if not field.primary_key}
+    for alias in settings.TRIP_SHARDS:
+        User.objects.using(alias).filter(pk=user.pk).update(**fields)
+
+
+def _trip_rows(model, trip_id):
+    if model is ExpenseSplit:
+        return model.objects.filter(expense__trip_id=trip_id)
+    return model.objects.filter(trip_id=trip_id)
+
+
+def _raw_delete(queryset):
+    return queryset._raw_delete(queryset.db)
+
+
+def purge(trip_id, alias):
+    """Delete trip_id's rows from alias; from a shard, its copies of the trip and memberships too"""
+    with transaction.atomic(using=alias):
+        for model in SHARDED:
+            _raw_delete(_trip_rows(model, trip_id).using(alias))
+        if alias != DEFAULT:
+            _raw_delete(Trip.members.through.objects.using(alias).filter(trip_id=trip_id))
+            _raw_delete(Trip.objects.using(alias).filter(pk=trip_id))
+
+
+def trip_deleted(trip):
+    """pre_delete of Trip: clear its shard once the delete has committed"""
+    alias = db_for_trip(trip.pk)
+    if alias != DEFAULT:
+        transaction.on_commit(lambda: purge(trip.pk, alias), using=DEFAULT)
+
+
+def reserve_ids(using=DEFAULT, **kwargs):
+    """post_migrate: start the ids of a shard's trip rows at the shard's offset"""
+    # Every database but default is a shard, whether or not TRIP_SHARDS lists it yet
+    shards = [alias for alias in settings.DATABASES if alias != DEFAULT]
+    if using not in shards:
+        return
+    start = (shards.index(using) + 1) * ID_SPACING
+    with connections[using].cursor() as cursor:
+        for model in SHARDED:
+            if not isinstance(model._meta.pk, AutoFieldMixin):
+                continue
+            table = model._meta.db_table
+            cursor.execute("DELETE FROM sqlite_sequence WHERE name = %s AND seq < %s", [table, start])
+            cursor.execute("INSERT INTO sqlite_sequence (name, seq) SELECT %s, %s "
+                           "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = %s)",
+                           [table, start, table])
+
+
+# Rebalancing
+
+def move_trip(trip_id, target):
+    """
+    Move trip_id's rows to the shard target, which must come after the trip's
+    database. Writers to the trip wait on its lock meanwhile and then fail with
+    TripMoved. Returns the number of rows moved.
+    """
+    source = db_for_trip(trip_id)
+    order = databases()
+    if order.index(target) <= order.index(source):
+        raise ValueError(f"Trip {trip_id} is on {source}: it can only move to a later shard")
+    moved = 0
+    with transaction.atomic(using=source):
+        # The same lock lock_trip() takes, held until the rows are gone
+        Trip.objects.using(source).filter(pk=trip_id).update(id=F('id'))
+        with transaction.atomic(using=target):
+            user_ids = set()
+            for model in SHARDED:
+                user_fields = [field.attname for field in model._meta.concrete_fields
+                               if field.is_relation and field.related_model is User]
+                rows = _trip_rows(model, trip_id).using(source).order_by('pk').iterator(chunk_size=CHUNK_SIZE)
+                while batch := list(islice(rows, CHUNK_SIZE)):
+                    _insert(model, batch, target, OnConflict.IGNORE)
+                    user_ids.update(getattr(row, field) for row in batch for field in user_fields)
+                    moved += len(batch)
+            # Foreign keys are checked at commit, by when everything they point at is there
+            copy_users(target, user_ids)
+            _copy_trip(trip_id, target)
+        TripShard.objects.update_or_create(trip_id=trip_id, defaults={'alias': target})
+        purge(trip_id, source)
+    return moved
+
+
+def _trip_sizes(alias):
+    """{trip_id: expenses + 1} of the trips living in alias"""
+    sizes = dict.fromkeys(local_trips(Trip.objects.all(), alias).values_list('id', flat=True), 1)
+    for model in (Expense, ArchivedExpense):
+        counts = model.objects.values('trip_id').annotate(Count('id')).values_list('trip_id', 'id__count')
+        for trip_id, count in counts.order_by():
+            if trip_id in sizes:
+                sizes[trip_id] += count
+    return sizes
+
+
+def plan_rebalance():
+    """
+    Moves, as (trip_id, source, target), that spread expenses evenly over the
+    shards: every trip still in default, biggest first onto the emptiest shard,
+    then the biggest trips of over-full shards onto later, emptier ones.
+    """
+    shards = settings.TRIP_SHARDS
+    sizes = dict(zip(databases(), fan_out(_trip_sizes)))
+    load = {alias: sum(sizes[alias].values()) for alias in shards}
+    moves = []
+    for trip_id, size in sorted(sizes[DEFAULT].items(), key=lambda item: (-item[1], item[0])):
+        target = min(shards, key=load.get)
+        moves.append((trip_id, DEFAULT, target))
+        load[target] += size
+    goal = sum(load.values()) / len(shards)
+    for index, alias in enumerate(shards):
+        for trip_id, size in sorted(sizes[alias].items(), key=lambda item: (-item[1], item[0])):
+            if load[alias] <= goal:
+                break
+            later = [shard for shard in shards[index + 1:] if load[shard] + size <= goal]
+            if later:
+                target = min(later, key=load.get)
+                moves.append((trip_id, alias, target))
+                load[alias] -= size
+                load[target] += size
+    return moves
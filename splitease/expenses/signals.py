@@ -0,0 +1,121 @@
+"""
+Keep cached pages honest when trip data changes outside the ledger.
+
+The ledger calls trip_changed() itself for its bulk writes, which skip these
+signals. The receivers here catch everything else: admin edits, memberships
+and whole trips being deleted. Once any of it commits, the trip's reminders are
+queued to be worked out again.
+
+They also write the change log mobile clients sync from (changelog.py). Rows
+deleted along with their trip aren't logged one by one: the trip going is
+enough for its members.
+
+When trips are sharded, new trips are placed here, and the copies of trips,
+memberships and users on the shards follow every change (see sharding.py).
+"""
+from django.contrib.auth.models import User
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import changelog, reminders, sharding
+from .caching import trip_changed, trip_committed
+from .models import Debt, Expense, Trip, TripMember
+
+
+@receiver(post_save, sender=Expense)
+@receiver(post_delete, sender=Expense)
+@receiver(post_save, sender=Debt)
+@receiver(post_delete, sender=Debt)
+@receiver(post_save, sender=TripMember)
+@receiver(post_delete, sender=TripMember)
+def trip_row_changed(sender, instance, **kwargs):
+    trip_changed(instance.trip_id)
+
+
+def _deleted_with_trip(instance, kwargs):
+    origin = kwargs.get('origin')
+    return isinstance(origin, Trip) and origin is not instance
+
+
+@receiver(post_save, sender=Trip)
+@receiver(post_save, sender=Expense)
+@receiver(post_save, sender=TripMember)
+def log_saved(sender, instance, created, using, **kwargs):
+    trip_id = instance.pk if sender is Trip else instance.trip_id
+    changelog.record(trip_id, sender._meta.model_name, instance.pk, 'insert' if created else 'update', using)
+
+
+@receiver(post_delete, sender=Expense)
+@receiver(post_delete, sender=TripMember)
+def log_deleted(sender, instance, using, **kwargs):
+    if not _deleted_with_trip(instance, kwargs):
+        changelog.record(instance.trip_id, sender._meta.model_name, instance.pk, 'delete', using)
+
+
+@receiver(post_save, sender=Debt)
+@receiver(post_delete, sender=Debt)
+def log_debts(sender, instance, using, **kwargs):
+    if not _deleted_with_trip(instance, kwargs):
+        changelog.debts_changed([instance.trip_id], using)
+
+
+@receiver(m2m_changed, sender=Trip.members.through)
+def membership_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    change = 'insert' if action == 'post_add' else 'delete'
+    if reverse:
+        # user.trips.add(...): instance is the user, pk_set holds trip ids
+        trip_ids = pk_set if action != 'pre_clear' else instance.trips.values_list('id', flat=True)
+        for trip_id in trip_ids:
+            trip_changed(trip_id, user_ids=[instance.pk])
+            changelog.members_changed(trip_id, [instance.pk], change)
+    else:
+        user_ids = list(pk_set if action != 'pre_clear' else instance.members.values_list('id', flat=True))
+        trip_changed(instance.pk, user_ids=user_ids)
+        changelog.members_changed(instance.pk, user_ids, change)
+
+
+@receiver(pre_delete, sender=Trip)
+def trip_deleted(sender, instance, **kwargs):
+    # Members are gone once the delete commits, so collect them now
+    user_ids = list(instance.members.values_list('id', flat=True))
+    trip_changed(instance.pk, user_ids=user_ids)
+    changelog.record(instance.pk, 'trip', instance.pk, 'delete', sharding.DEFAULT)
+    changelog.members_changed(instance.pk, user_ids, 'delete')
+
+
+@receiver(post_save, sender=Trip)
+def place_trip(sender, instance, created, **kwargs):
+    if sharding.enabled():
+        sharding.trip_saved(instance, created)
+
+
+@receiver(m2m_changed, sender=Trip.members.through)
+def copy_memberships(sender, instance, action, reverse, pk_set, **kwargs):
+    if not sharding.enabled():
+        return
+    if not reverse and action in ('post_add', 'post_remove', 'post_clear'):
+        sharding.members_changed(instance.pk)
+    elif reverse and action in ('post_add', 'post_remove'):
+        for trip_id in pk_set:
+            sharding.members_changed(trip_id)
+    elif reverse and action == 'post_clear':
+        sharding.user_left_all(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def copy_user(sender, instance, created, update_fields, **kwargs):
+    if sharding.enabled() and not created:
+        sharding.user_saved(instance, update_fields)
+
+
+@receiver(pre_delete, sender=Trip)
+def clear_shard(sender, instance, **kwargs):
+    if sharding.enabled():
+        sharding.trip_deleted(instance)
+
+
+@receiver(trip_committed)
+def queue_reminder_refresh(sender, trip_id, **kwargs):
+    reminders.queue_refresh(trip_id)
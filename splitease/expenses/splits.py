@@ -0,0 +1,135 @@
+"""
+Split engine: divides expenses between members in whole paise.
+
+Amounts become integer paise before anything is divided. Every member's
+exact quota is rounded down, and the paise that rounding leaves over go one
+each to the members with the largest remainders (Hamilton's method). Shares
+therefore always add up to exactly the expense, and no paisa drifts between
+members over hundreds of expenses.
+
+A Split says how to divide one expense:
+  equal       everyone listed pays the same
+  shares      in proportion to a weight per member (2 shares pay twice 1)
+  percentage  in proportion to percentages that add up to 100
+  exact       fixed amounts that add up to the expense
+"""
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+from fractions import Fraction
+from math import floor
+
+from .money import Money
+
+METHODS = [
+    ('equal', 'Equally'),
+    ('shares', 'By shares'),
+    ('percentage', 'By percentage'),
+    ('exact', 'Exact amounts'),
+]
+
+class SplitError(ValueError):
+    """A split that can't be applied to its expense"""
+
+
+# member_ids: who takes part, in order (ties in rounding go to the earlier one)
+# values: {user_id: weight, percentage or amount}; unused for equal splits
+Split = namedtuple('Split', ['method', 'member_ids', 'values'], defaults=['equal', (), None])
+
+
+def to_paise(amount):
+    """Money, or Decimal or text rupees, to integer paise; fractions of a paisa are refused"""
+    try:
+        return int(Money.coerce(amount))
+    except (InvalidOperation, TypeError):
+        raise SplitError(f"{amount!r} is not an amount")
+    except ValueError as error:
+        raise SplitError(str(error))
+
+
+def from_paise(paise):
+    return Money(paise)
+
+
+def allocate(total, weights):
+    """
+    Divide total paise between [(key, weight), ...] by largest remainder.
+    Returns {key: paise}, summing exactly to total.
+    """
+    weights = [(key, Fraction(weight)) for key, weight in weights]
+    if any(weight < 0 for _, weight in weights):
+        raise SplitError("Weights can't be negative")
+    whole = sum(weight for _, weight in weights)
+    if not whole:
+        raise SplitError("Nobody has a share of this expense")
+
+    quotas = [(key, total * weight / whole) for key, weight in weights]
+    allocation = {key: floor(quota) for key, quota in quotas}
+    leftover = total - sum(allocation.values())
+    # Stable sort: equal remainders go to whoever is listed first
+    by_remainder = sorted(range(len(quotas)), key=lambda i: quotas[i][1] - floor(quotas[i][1]), reverse=True)
+    for i in by_remainder[:leftover]:
+        allocation[quotas[i][0]] += 1
+    return allocation
+
+
+def _numbers(split, member_ids):
+    values = split.values or {}
+    try:
+        numbers = {user_id: Decimal(values[user_id]) for user_id in member_ids}
+    except KeyError:
+        raise SplitError(f"Give every member's {split.method}")
+    except (InvalidOperation, TypeError, ValueError):
+        raise SplitError(f"Every {split.method} must be a number")
+    if not all(number.is_finite() for number in numbers.values()):
+        raise SplitError(f"Every {split.method} must be a number")
+    return numbers
+
+
+def allocate_paise(total, split):
+    """{user_id: paise} for one expense of total paise"""
+    member_ids = list(dict.fromkeys(split.member_ids))
+    if not member_ids:
+        raise SplitError("Choose at least one member to split with")
+    if split.method == 'equal':
+        return allocate(total, [(user_id, 1) for user_id in member_ids])
+    values = _numbers(split, member_ids)
+    if split.method == 'shares':
+        return allocate(total, [(user_id, values[user_id]) for user_id in member_ids])
+    if split.method == 'percentage':
+        if sum(values.values()) != 100:
+            raise SplitError("Percentages must add up to 100")
+        return allocate(total, [(user_id, values[user_id]) for user_id in member_ids])
+    if split.method == 'exact':
+        allocation = {user_id: to_paise(values[user_id]) for user_id in member_ids}
+        if any(paise < 0 for paise in allocation.values()):
+            raise SplitError("Amounts can't be negative")
+        if sum(allocation.values()) != total:
+            raise SplitError(f"Exact amounts add up to {from_paise(sum(allocation.values()))}, "
+                             f"not {from_paise(total)}")
+        return allocation
+    raise SplitError(f"Unknown split method {split.method!r}")
+
+
+def compute_shares(amount, split):
+    """What each member owes of amount, as {user_id: Money}"""
+    return {user_id: from_paise(paise)
+            for user_id, paise in allocate_paise(to_paise(amount), split).items()}
+
+
+def compute_many(items):
+    """
+    compute_shares() for many (amount, split) pairs in one pass.
+    Equal splits of the same amount between the same people are worked out once.
+    """
+    seen = {}
+    results = []
+    for amount, split in items:
+        total = to_paise(amount)
+        if split.method == 'equal':
+            key = (total, tuple(split.member_ids))
+            if key not in seen:
+                seen[key] = compute_shares(amount, split)
+            results.append(dict(seen[key]))
+        else:
+            results.append(compute_shares(amount, split))
+    return results
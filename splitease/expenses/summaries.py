@@ -0,0 +1,191 @@
+"""
+Read-side summaries built with a fixed number of queries.
+
+They return plain dicts and lists so the results can go straight into the
+cache and the templates without touching the database again. The async
+versions run the same queries concurrently, for the ASGI views.
+
+When trips are sharded, the home page runs its queries on every database at
+once and merges what they find.
+"""
+import asyncio
+from collections import defaultdict
+from operator import itemgetter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Count, Exists, OuterRef, Subquery, Sum
+
+from . import fx, sharding
+from .models import ArchivedBalance, Expense, MemberBalance, Trip
+from .money import Money
+from .settlement import simplify
+
+
+def _home_queries(user):
+    """The two querysets behind the home page: annotated trips, then every balance in them"""
+    member_count = (Trip.members.through.objects
+                    .filter(trip_id=OuterRef('pk'))
+                    .values('trip_id')
+                    .annotate(total=Count('*'))
+                    .values('total'))
+    my_balance = (MemberBalance.objects
+                  .filter(trip_id=OuterRef('pk'), user=user)
+                  .values('balance'))
+    trips = (
+        Trip.objects.filter(members=user)
+        .annotate(
+            member_count=Subquery(member_count),
+            has_paid=(Exists(Expense.objects.filter(trip_id=OuterRef('pk'), paid_by=user))
+                      | Exists(ArchivedBalance.objects.filter(trip_id=OuterRef('pk'), user=user, paid__gt=0))),
+            my_balance=Subquery(my_balance),
+        )
+        .values('id', 'name', 'created_by_id', 'base_currency', 'member_count', 'has_paid', 'my_balance')
+    )
+    balances = (MemberBalance.objects
+                .filter(trip__members=user)
+                .values_list('trip_id', 'user_id', 'user__username', 'balance'))
+    return trips, balances
+
+
+def _home_currencies(trips):
+    return {trip['base_currency'] for trip in trips} | {settings.HOME_CURRENCY}
+
+
+def _home_payments(user, trips, balances):
+    """The user's payments in each trip's settlement plan, to make and to receive"""
+    currencies = {trip['id']: trip['base_currency'] for trip in trips}
+    by_trip = defaultdict(dict)
+    names = {}
+    for trip_id, user_id, username, balance in balances:
+        by_trip[trip_id][user_id] = balance
+        names[user_id] = username
+    to_pay = []
+    to_receive = []
+    for trip_id in sorted(by_trip.keys() & currencies.keys()):
+        for transfer in simplify(by_trip[trip_id]):
+            if user.id in (transfer.debtor_id, transfer.creditor_id):
+                (to_pay if transfer.debtor_id == user.id else to_receive).append({
+                    'trip_id': trip_id,
+                    'from_user_id': transfer.debtor_id,
+                    'to_user_id': transfer.creditor_id,
+                    'amount': transfer.amount,
+                    'currency': currencies[trip_id],
+                    'from_username': names[transfer.debtor_id],
+                    'to_username': names[transfer.creditor_id],
+                })
+    return to_pay, to_receive
+
+
+def _home_context(user, trips, balances, known):
+    # What to pay and receive comes from the same balances as the totals
+    to_pay, to_receive = _home_payments(user, trips, balances)
+
+    # Trips keep balances in their own currencies: total them in the home currency
+    balances = [(trip['my_balance'], trip['base_currency']) for trip in trips if trip['my_balance']]
+    total_to_pay, pay_left_out = fx.total_in(
+        [(-b, c) for b, c in balances if b < 0], settings.HOME_CURRENCY, known)
+    total_to_receive, receive_left_out = fx.total_in(
+        [(b, c) for b, c in balances if b > 0], settings.HOME_CURRENCY, known)
+    return {
+        'my_trips': trips,
+        'to_pay': to_pay,
+        'to_receive': to_receive,
+        'home_currency': settings.HOME_CURRENCY,
+        'total_to_pay': total_to_pay,
+        'total_to_receive': total_to_receive,
+        # Trips whose currency has no exchange rate yet aren't in the totals
+        'unconverted_currencies': sorted(set(pay_left_out) | set(receive_left_out)),
+        'trip_payer_status': {trip['id']: trip['has_paid'] for trip in trips},
+    }
+
+
+def _sharded_home_rows(user):
+    """The home page's trips and balances, both queries run on every database at once"""
+    def read(alias):
+        trips, balances = _home_queries(user)
+        return list(sharding.local_trips(trips, alias)), list(balances)
+
+    found = sharding.fan_out(read)
+    trips = sorted((trip for trips, _ in found for trip in trips), key=itemgetter('id'))
+    return trips, [balance for _, balances in found for balance in balances]
+
+
+def home_summary(user):
+    """
+    Everything the home page shows for one user: two queries however many trips they have.
+    One annotated query gives each trip's member count, whether the user has paid
+    anything there and their balance in it; the other reads every member's
+    balance in those trips, which give the payments the user has to make and
+    receive in each trip's settlement plan.
+    Trips in other currencies add one exchange rate lookup, unless it's cached.
+    With sharded trips, each database runs the two queries for the trips it holds.
+    """
+    if sharding.enabled():
+        trips, balances = _sharded_home_rows(user)
+    else:
+        trips, balances = (list(qs) for qs in _home_queries(user))
+    return _home_context(user, trips, balances, fx.rates(_home_currencies(trips)))
+
+
+async def ahome_summary(user):
+    """Async version of home_summary(), running its two queries concurrently"""
+    if sharding.enabled():
+        # Off the event loop, to a thread of its own that fans out to the shards
+        trips, balances = await sync_to_async(_sharded_home_rows, thread_sensitive=False)(user)
+    else:
+        trips, balances = await asyncio.gather(*(alist(qs) for qs in _home_queries(user)))
+    return _home_context(user, trips, balances, await fx.arates(_home_currencies(trips)))
+
+
+def _trip_queries(trip):
+    return (
+        trip.members.all(),
+        MemberBalance.objects.filter(trip=trip).values_list('user_id', 'balance'),
+        # Spending per currency paid in, and what it came to in the trip's currency
+        (trip.expense_history().values('currency')
+         .annotate(count=Count('id'), amount=Sum('amount'), base_amount=Sum('base_amount'))
+         .order_by('currency')),
+    )
+
+
+def _trip_context(trip, members, balances, spending):
+    names = {user.id: user.first_name or user.username for user in members}
+    balances = dict(balances)
+    return {
+        'id': trip.id,
+        'name': trip.name,
+        'base_currency': trip.base_currency,
+        'expense_count': sum(row['count'] for row in spending),
+        'total_spent': str(Money(sum(row['base_amount'] for row in spending))),
+        'spent_by_currency': [
+            {'currency': row['currency'], 'amount': str(row['amount']), 'base_amount': str(row['base_amount'])}
+            for row in spending
+        ],
+        'members': [
+            {'id': user_id, 'name': name, 'balance': str(balances.get(user_id, Money(0)))}
+            for user_id, name in names.items()
+        ],
+        'settlement_plan': [
+            {'from': t.debtor_id, 'to': t.creditor_id, 'amount': str(t.amount)}
+            for t in simplify(balances)
+        ],
+    }
+
+
+def trip_summary(trip):
+    """
+    Compact JSON-ready state of one trip: totals, balances and the settlement plan.
+    Three queries: members, balances and the expense totals per currency.
+    """
+    return _trip_context(trip, *(list(qs) for qs in _trip_queries(trip)))
+
+
+async def atrip_summary(trip):
+    """Async version of trip_summary(), running its three queries concurrently"""
+    return _trip_context(trip, *await asyncio.gather(*(alist(qs) for qs in _trip_queries(trip))))
+
+
+async def alist(queryset):
+    """Evaluate a queryset through the async ORM"""
+    return [row async for row in queryset]
@@ -0,0 +1,142 @@
+"""
+Synthetic trips for load testing and benchmarks.
+
+Everything is written with bulk inserts and the balances are worked out in
+Python, so seeding a hundred thousand expenses takes seconds instead of the
+millions of queries it would take to post them one by one. The result is the
+same state the ledger would have produced: expenses, their splits, ledger
+entries, member balances, the settlement plan as debts and spending rollups.
+"""
+import random
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from . import sharding
+from .analytics import rollup_rows
+from .ledger import expense_deltas
+from .models import (
+    Debt, Expense, ExpenseSplit, LedgerEntry, MemberBalance, SpendingRollup, Trip, TripMember,
+)
+from .money import Money
+from .settlement import simplify
+from .splits import Split, compute_many
+
+BATCH_SIZE = 2000
+
+# Rough shape of real trips: mostly food, then getting around, then rooms
+CATEGORY_MIX = [('Food', 45), ('Travel', 25), ('Stay', 20), ('Other', 10)]
+
+DESCRIPTIONS = {
+    'Food': ['Dinner', 'Breakfast', 'Chai', 'Street food', 'Groceries', 'Lunch'],
+    'Travel': ['Taxi', 'Train tickets', 'Fuel', 'Bus', 'Ferry', 'Auto'],
+    'Stay': ['Hotel', 'Homestay', 'Hostel', 'Camp'],
+    'Other': ['Entry tickets', 'Souvenirs', 'Rafting', 'SIM card'],
+}
+
+AMOUNT_RANGE = {
+    'Food': (50, 3000),
+    'Travel': (30, 8000),
+    'Stay': (800, 15000),
+    'Other': (20, 5000),
+}
+
+
+def random_amount(rng, category):
+    low, high = AMOUNT_RANGE[category]
+    return Money(rng.randint(low * 100, high * 100))
+
+
+def seed(users=50, trips=10, members_per_trip=6, expenses_per_trip=100, seed=0, prefix='synth'):
+    """
+    Create synthetic users, trips, members and expenses.
+    Returns the counts of what was created.
+    """
+    rng = random.Random(seed)
+    categories = [c for c, _ in CATEGORY_MIX]
+    weights = [w for _, w in CATEGORY_MIX]
+    members_per_trip = min(members_per_trip, users)
+    today = timezone.now().date()
+
+    with transaction.atomic():
+        people = User.objects.bulk_create(
+            [User(username=f'{prefix}_{seed}_{i}', first_name=f'Traveller {i}', password=make_password(None))
+             for i in range(users)],
+            batch_size=BATCH_SIZE,
+        )
+
+        created_expenses = 0
+        for t in range(trips):
+            group = rng.sample(people, members_per_trip)
+            trip = Trip.objects.create(name=f'{prefix.title()} trip {t}', created_by=group[0],
+                                       description='Generated for load testing')
+            Trip.members.through.objects.bulk_create(
+                [Trip.members.through(trip_id=trip.id, user_id=user.id) for user in group]
+            )
+            # A bulk insert sends no m2m signal, so the trip's shard (if any) is told here
+            sharding.members_changed(trip.id)
+            with sharding.on_trip(trip.id):
+                TripMember.objects.bulk_create([
+                    TripMember(trip=trip, user=user, name=user.first_name,
+                               whatsapp_number=f'+91{seed:02}{t:04}{i:04}')
+                    for i, user in enumerate(group)
+                ])
+
+                expenses = []
+                for _ in range(expenses_per_trip):
+                    category = rng.choices(categories, weights)[0]
+                    amount = random_amount(rng, category)
+                    expenses.append(Expense(
+                        trip=trip,
+                        paid_by=rng.choice(group),
+                        category=category,
+                        description=rng.choice(DESCRIPTIONS[category]),
+                        amount=amount,
+                        base_amount=amount,
+                    ))
+                Expense.objects.bulk_create(expenses, batch_size=BATCH_SIZE)
+
+                # Spread the trip over two weeks (date is auto_now_add, so set it afterwards)
+                start = today - timedelta(days=rng.randint(14, 365))
+                for expense in expenses:
+                    expense.date = start + timedelta(days=rng.randint(0, 13))
+                Expense.objects.bulk_update(expenses, ['date'], batch_size=BATCH_SIZE)
+
+                post_in_bulk(trip, expenses, [user.id for user in group])
+            created_expenses += len(expenses)
+
+    return {'users': len(people), 'trips': trips, 'expenses': created_expenses}
+
+
+def post_in_bulk(trip, expenses, member_ids):
+    """Write the splits, ledger, balances and debts for many new expenses of one trip"""
+    split = Split('equal', member_ids)
+    all_shares = compute_many([(expense.base_amount, split) for expense in expenses])
+
+    splits = []
+    entries = []
+    balances = {}
+    for expense, shares in zip(expenses, all_shares):
+        splits.extend(ExpenseSplit(expense=expense, user_id=user_id, share=share)
+                      for user_id, share in shares.items() if share)
+        for user_id, amount in expense_deltas(expense, shares).items():
+            if not amount:
+                continue
+            entries.append(LedgerEntry(trip=trip, user_id=user_id, expense=expense, amount=amount))
+            balances[user_id] = balances.get(user_id, 0) + amount
+
+    ExpenseSplit.objects.bulk_create(splits, batch_size=BATCH_SIZE)
+    LedgerEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE)
+    MemberBalance.objects.bulk_create(
+        [MemberBalance(trip=trip, user_id=user_id, balance=amount) for user_id, amount in balances.items()],
+        batch_size=BATCH_SIZE,
+    )
+    Debt.objects.bulk_create(
+        [Debt(trip=trip, from_user_id=t.debtor_id, to_user_id=t.creditor_id, amount=t.amount)
+         for t in simplify(balances)],
+        batch_size=BATCH_SIZE,
+    )
+    SpendingRollup.objects.bulk_create(rollup_rows(expenses), batch_size=BATCH_SIZE)
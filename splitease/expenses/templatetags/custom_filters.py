@@ -1,8 +1,17 @@
 from django import template
 
+from expenses.money import DEFAULT_CURRENCY, display
+
 register = template.Library()
 
 @register.filter
 def get_item(dictionary, key):
     """Get an item from a dictionary by key"""
     return dictionary.get(key)
+
+@register.filter
+def money(amount, currency=None):
+    """Show an amount with its currency symbol: {{ debt.amount|money:trip.base_currency }}"""
+    if amount is None or amount == '':
+        return ''
+    return display(amount, currency or DEFAULT_CURRENCY)
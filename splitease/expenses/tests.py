@@ -1,3 +1,1467 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import pstats
+import random
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from decimal import Decimal
+from pathlib import Path
+from unittest import skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.db.models import Q, Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import (
+    analytics, archive, benchmarks, changelog, fx, jobs, loadtest, metrics, pagination, rebuild, reminders, sharding,
+    synthetic,
+)
+from .benchmarks import capture_queries
+from .ledger import apply_deltas, create_expense, post_expense, settle_all
+from .models import (
+    Trip, TripMember, ArchivedBalance, ArchivedExpense, Change, Debt, Expense, ExpenseSplit, FxRate, Job,
+    LedgerEntry, MemberBalance, Payment, Reminder, SpendingRollup, TripShard,
+)
+from .money import Money, MoneyField
+from .settlement import replan, simplify, settlement_plan
+from .splits import Split, SplitError, compute_many, compute_shares
+from .summaries import home_summary
+
+
+class SimplifyTests(TestCase):
+    def test_nets_opposite_debts(self):
+        transfers = simplify({1: Money(-3000), 2: Money(3000)})
+        self.assertEqual([(t.debtor_id, t.creditor_id, t.amount) for t in transfers],
+                         [(1, 2, Money(3000))])
+
+    def test_reads_decimal_balances_as_rupees(self):
+        transfers = simplify({1: Decimal('-30.5'), 2: Decimal('30.5')})
+        self.assertEqual([t.amount for t in transfers], [Money(3050)])
+
+    def test_never_needs_more_than_n_minus_one_transfers(self):
+        balances = {i: Money(-i * 101) for i in range(1, 200)}
+        balances[999] = -sum(balances.values())
+        transfers = simplify(balances)
+        self.assertLessEqual(len(transfers), len(balances) - 1)
+
+        settled = dict.fromkeys(balances, Money(0))
+        for t in transfers:
+            settled[t.debtor_id] += t.amount
+            settled[t.creditor_id] -= t.amount
+        for user_id, amount in balances.items():
+            self.assertEqual(settled[user_id] + amount, 0)
+
+    def test_settled_balances_need_no_transfers(self):
+        self.assertEqual(simplify({1: Money(0), 2: Money(0)}), [])
+
+    def test_refuses_fractions_of_a_paisa(self):
+        with self.assertRaises(ValueError):
+            simplify({1: Decimal('0.001'), 2: Decimal('-0.001')})
+
+
+class SettlementViewTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.a = User.objects.create_user('a')
+        self.b = User.objects.create_user('b')
+        self.c = User.objects.create_user('c')
+        self.trip = Trip.objects.create(name='Goa', created_by=self.a)
+        self.trip.members.add(self.a, self.b, self.c)
+        self.enterContext(sharding.on_trip(self.trip.id))
+        # a owes b, b owes c: one payment from a to c settles everyone
+        apply_deltas(self.trip, {self.a.id: Money(-5000), self.c.id: Money(5000)}, 'expense')
+        Debt.objects.create(trip=self.trip, from_user=self.a, to_user=self.b, amount=Money(5000))
+        Debt.objects.create(trip=self.trip, from_user=self.b, to_user=self.c, amount=Money(5000))
+
+    def test_dashboard_shows_simplified_plan(self):
+        self.client.force_login(self.a)
+        response = self.client.get(reverse('trip_dashboard', args=[self.trip.id]))
+        debts = response.context['simplified_debts']
+        self.assertEqual(len(debts), 1)
+        self.assertEqual((debts[0]['debtor'], debts[0]['creditor']), (self.a, self.c))
+
+    def test_creditor_confirms_planned_payment(self):
+        self.client.force_login(self.c)
+        self.client.post(reverse('settle_debt_simplified', args=[self.trip.id, self.a.id, self.c.id]))
+        self.assertEqual(settlement_plan(self.trip), [])
+        self.assertFalse(Debt.objects.filter(trip=self.trip).exclude(amount=0).exists())
+        self.assertEqual(LedgerEntry.objects.filter(kind='settlement').count(), 2)
+        payment = Payment.objects.get()
+        self.assertEqual((payment.from_user, payment.to_user, payment.amount), (self.a, self.c, 5000))
+        self.assertEqual(set(payment.ledger_entries.values_list('user_id', 'amount')),
+                         {(self.a.id, 5000), (self.c.id, -5000)})
+
+    def test_partial_payment_keeps_the_rest_planned(self):
+        self.client.force_login(self.c)
+        url = reverse('settle_debt_simplified', args=[self.trip.id, self.a.id, self.c.id])
+        self.client.post(url, {'amount': '20.50'})
+        self.assertEqual(settlement_plan(self.trip), [(self.a.id, self.c.id, 2950)])
+        self.assertEqual(Debt.objects.get(trip=self.trip, amount__gt=0).amount, 2950)
+        response = self.client.post(url, {'amount': '30'})
+        self.assertEqual([str(m) for m in get_messages(response.wsgi_request)][-1], 'Only ₹29.50 is owed.')
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertContains(self.client.get(reverse('trip_dashboard', args=[self.trip.id])), 'Latest payments')
+
+    def test_debt_row_is_settled_against_the_plan(self):
+        settle = reverse('settle_debt', args=[Debt.objects.get(from_user=self.a, to_user=self.b).id])
+        # Only the creditor can confirm
+        self.client.force_login(self.a)
+        self.client.post(settle)
+        self.assertFalse(Payment.objects.exists())
+        # a and b have netted out, so the row's amount is no payment in the plan
+        self.client.force_login(self.b)
+        self.client.post(settle)
+        self.assertFalse(Payment.objects.exists())
+        self.assertEqual(settlement_plan(self.trip), [(self.a.id, self.c.id, 5000)])
+
+        replan(self.trip)
+        self.client.force_login(self.c)
+        self.client.post(reverse('settle_debt', args=[Debt.objects.get(trip=self.trip, amount__gt=0).id]))
+        payment = Payment.objects.get()
+        self.assertEqual((payment.from_user, payment.to_user, payment.amount), (self.a, self.c, 5000))
+        self.assertEqual(settlement_plan(self.trip), [])
+
+    def test_settle_everything_in_constant_queries(self):
+        users = [User.objects.create_user(f'big{i}') for i in range(12)]
+        trip = Trip.objects.create(name='Big', created_by=users[0])
+        trip.members.add(*users)
+        create_expense(trip, users[0], Decimal('1200'), 'Villa', 'Stay')
+        create_expense(trip, users[1], Decimal('600'), 'Boat', 'Travel')
+        self.client.force_login(users[0])
+        with sharding.on_trip(trip.id):
+            # Ten transfers, the same statements as one: lock, balances, payments, ledger,
+            # two for balances, two for debts, the change log and the savepoints around them.
+            # Sharded, the trip's placement is checked too, and the change log waits for
+            # the shard's transaction to commit.
+            with capture_queries() as queries:
+                settle_all(trip)
+            self.assertEqual(len(queries), 12)
+            self.assertEqual(settlement_plan(trip), [])
+            self.assertEqual(Payment.objects.filter(trip=trip).count(), 10)
+            self.assertFalse(Debt.objects.filter(trip=trip, amount__gt=0).exists())
+        self.assertEqual(rebuild.rebuild([trip.id], workers=1, verify=True)['mismatches'], [])
+
+    def test_only_the_creator_settles_everything(self):
+        self.client.force_login(self.b)
+        self.client.post(reverse('settle_trip', args=[self.trip.id]))
+        self.assertEqual(Payment.objects.count(), 0)
+        self.client.force_login(self.a)
+        self.client.post(reverse('settle_trip', args=[self.trip.id]))
+        self.assertEqual(settlement_plan(self.trip), [])
+
+
+class LedgerTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.users = [User.objects.create_user(f'u{i}') for i in range(3)]
+        self.trip = Trip.objects.create(name='Manali', created_by=self.users[0])
+        self.trip.members.add(*self.users)
+        self.enterContext(sharding.on_trip(self.trip.id))
+        self.client.force_login(self.users[0])
+
+    def add_expense(self, amount, payer):
+        self.client.post(reverse('add_expense', args=[self.trip.id]), {
+            'description': 'Dinner', 'amount': amount, 'payer': payer.id, 'category': 'Food',
+        })
+        return Expense.objects.latest('id')
+
+    def balances(self):
+        return {b.user_id: b.balance for b in MemberBalance.objects.filter(trip=self.trip)}
+
+    def test_expense_updates_balances_and_debts(self):
+        self.add_expense('90', self.users[0])
+        self.assertEqual(self.balances(), {
+            self.users[0].id: Money(6000), self.users[1].id: Money(-3000), self.users[2].id: Money(-3000),
+        })
+        self.assertEqual(Debt.objects.get(from_user=self.users[1], to_user=self.users[0]).amount, Money(3000))
+        self.assertEqual(LedgerEntry.objects.filter(kind='expense').count(), 3)
+
+    def test_debts_are_the_settlement_plan(self):
+        # Two members paying the same leaves nothing owed between them
+        self.add_expense('90', self.users[0])
+        self.add_expense('90', self.users[1])
+        open_debts = Debt.objects.filter(trip=self.trip, amount__gt=0)
+        self.assertEqual(sorted(open_debts.values_list('from_user_id', 'to_user_id', 'amount')),
+                         sorted(settlement_plan(self.trip)))
+        self.assertFalse(open_debts.filter(from_user=self.users[0], to_user=self.users[1]).exists())
+
+    def test_balances_always_sum_to_zero(self):
+        self.add_expense('100', self.users[1])
+        self.assertEqual(sum(self.balances().values()), 0)
+
+    def test_delete_reverses_expense_exactly(self):
+        self.add_expense('90', self.users[0])
+        before = self.balances()
+        expense = self.add_expense('45.50', self.users[1])
+        self.client.post(reverse('delete_expense', args=[expense.id]))
+        self.assertEqual(self.balances(), before)
+        self.assertEqual(LedgerEntry.objects.filter(kind='reversal').count(), 3)
+
+    def test_posting_query_count_does_not_grow_with_members(self):
+        # Sharded, the change log waits for the shard's transaction to commit
+        posting = 13 if sharding.enabled() else 14
+        expense = Expense.objects.create(trip=self.trip, amount=Money(1000), base_amount=Money(1000),
+                                         paid_by=self.users[0], category='Food', description='Tea')
+        with capture_queries() as few:
+            post_expense(expense, compute_shares(expense.amount, Split('equal', [u.id for u in self.users])))
+        self.assertEqual(len(few), posting)
+
+        more = [User.objects.create_user(f'extra{i}') for i in range(20)]
+        self.trip.members.add(*more)
+        expense = Expense.objects.create(trip=self.trip, amount=Money(1000), base_amount=Money(1000),
+                                         paid_by=self.users[0], category='Food', description='Tea')
+        with capture_queries() as many:
+            post_expense(expense, compute_shares(expense.amount, Split('equal', [u.id for u in self.users + more])))
+        self.assertEqual(len(many), posting)
+
+
+class SplitEngineTests(TestCase):
+    def test_leftover_paise_go_to_largest_remainders(self):
+        shares = compute_shares(Decimal('100'), Split('equal', [1, 2, 3]))
+        self.assertEqual(shares, {1: Money(3334), 2: Money(3333), 3: Money(3333)})
+
+    def test_weighted_and_percentage_splits_are_exact(self):
+        shares = compute_shares(Decimal('100.01'), Split('shares', [1, 2, 3], {1: '2', 2: '1', 3: '1'}))
+        self.assertEqual(shares, {1: Money(5001), 2: Money(2500), 3: Money(2500)})
+        shares = compute_shares(Decimal('999.99'), Split('percentage', [1, 2, 3],
+                                                         {1: '33.33', 2: '33.33', 3: '33.34'}))
+        self.assertEqual(sum(shares.values()), Money(99999))
+
+    def test_invalid_splits_are_refused(self):
+        with self.assertRaises(SplitError):
+            compute_shares(Decimal('100'), Split('percentage', [1, 2], {1: '60', 2: '30'}))
+        with self.assertRaises(SplitError):
+            compute_shares(Decimal('100'), Split('exact', [1, 2], {1: '60', 2: '30'}))
+        with self.assertRaises(SplitError):
+            compute_shares(Decimal('100'), Split('shares', [1, 2], {1: '1', 2: 'lots'}))
+        with self.assertRaises(SplitError):
+            compute_shares(Decimal('10.005'), Split('equal', [1, 2]))
+
+    def test_no_drift_over_many_expenses(self):
+        rng = random.Random(4)
+        items = []
+        for _ in range(2000):
+            members = rng.sample(range(1, 8), rng.randint(1, 7))
+            split = rng.choice([
+                Split('equal', members),
+                Split('shares', members, {m: rng.randint(1, 5) for m in members}),
+            ])
+            items.append((Money(rng.randint(1, 10 ** 6)), split))
+        for (amount, _), shares in zip(items, compute_many(items)):
+            self.assertEqual(sum(shares.values()), amount)
+        self.assertEqual(compute_many(items[:50]), [compute_shares(a, s) for a, s in items[:50]])
+
+
+class MoneyTests(TestCase):
+    databases = '__all__'
+
+    def test_prints_rupees(self):
+        self.assertEqual([str(Money(p)) for p in (0, 5, 123450, -29)], ['0.00', '0.05', '1234.50', '-0.29'])
+        self.assertEqual(f"{Money(-1050):+}", '-10.50')
+
+    def test_ints_are_paise_and_decimals_rupees(self):
+        self.assertEqual(Money.coerce(250), 250)
+        self.assertEqual(Money.coerce(Decimal('2.50')), 250)
+        self.assertEqual(Money.coerce('2.5'), 250)
+        self.assertEqual(Money.coerce(Money(7)).rupees, Decimal('0.07'))
+        with self.assertRaises(ValueError):
+            Money.coerce(Decimal('2.505'))
+
+    def test_field_stores_paise(self):
+        user = User.objects.create_user('payer')
+        trip = Trip.objects.create(name='Paise')
+        Expense.objects.create(trip=trip, amount=Decimal('33.33'), base_amount=Decimal('33.33'),
+                               paid_by=user, category='Food')
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT amount FROM expenses_expense')
+            self.assertEqual(cursor.fetchone(), (3333,))
+        expense = Expense.objects.get()
+        self.assertIsInstance(expense.amount, Money)
+        self.assertEqual(Expense.objects.aggregate(total=Sum('amount'))['total'], Money(3333))
+        self.assertEqual(MoneyField().formfield().clean('12.5'), Decimal('12.5'))
+
+    def test_benchmark_reports_both_paths(self):
+        report = benchmarks.compare_money(rows=200, expenses=20, repeats=1)
+        self.assertEqual([r['operation'] for r in report['results']],
+                         ['python_sum', 'sql_sum', 'sql_read', 'equal_split'])
+        self.assertTrue(all(r['decimal_per_second'] > 0 and r['paise_per_second'] > 0
+                            for r in report['results']))
+
+
+class CustomSplitViewTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.users = [User.objects.create_user(f's{i}') for i in range(4)]
+        self.trip = Trip.objects.create(name='Hampi', created_by=self.users[0])
+        self.trip.members.add(*self.users)
+        self.enterContext(sharding.on_trip(self.trip.id))
+        self.client.force_login(self.users[0])
+
+    def post(self, amount, method, values):
+        return self.client.post(reverse('add_expense', args=[self.trip.id]), {
+            'description': 'Scooters', 'amount': amount, 'payer': self.users[0].id, 'category': 'Travel',
+            'split_method': method,
+            'split_members': [u.id for u in values],
+            **{f'split_value_{u.id}': value for u, value in values.items()},
+        })
+
+    def test_weighted_split_between_some_members(self):
+        a, b, c, _ = self.users
+        self.post('100', 'shares', {a: '1', b: '1', c: '1'})
+        expense = Expense.objects.get()
+        self.assertEqual(expense.split_method, 'shares')
+        self.assertEqual(dict(expense.splits.values_list('user_id', 'share')),
+                         {a.id: Money(3334), b.id: Money(3333), c.id: Money(3333)})
+        balances = dict(MemberBalance.objects.filter(trip=self.trip).values_list('user_id', 'balance'))
+        self.assertEqual(balances, {a.id: Money(6666), b.id: Money(-3333), c.id: Money(-3333)})
+        self.assertEqual(Debt.objects.get(from_user=b).amount, Money(3333))
+
+    def test_exact_split_and_delete_round_trip(self):
+        a, b, _, d = self.users
+        self.post('250.50', 'exact', {a: '50.50', d: '200'})
+        self.assertEqual(MemberBalance.objects.get(trip=self.trip, user=d).balance, Money(-20000))
+        self.client.post(reverse('delete_expense', args=[Expense.objects.get().id]))
+        self.assertFalse(MemberBalance.objects.filter(trip=self.trip).exclude(balance=0).exists())
+
+    def test_bad_split_is_shown_and_nothing_is_saved(self):
+        a, b, _, _ = self.users
+        response = self.post('100', 'percentage', {a: '50', b: '40'})
+        self.assertContains(response, 'Percentages must add up to 100', status_code=400)
+        self.assertFalse(Expense.objects.exists())
+        self.assertFalse(ExpenseSplit.objects.exists())
+
+
+class ConcurrentPostingTests(TransactionTestCase):
+    """Many workers posting to one trip at once must not lose any update"""
+    databases = '__all__'
+
+    workers = 8
+    expenses_per_worker = 10
+
+    def setUp(self):
+        self.users = [User.objects.create_user(f'c{i}') for i in range(4)]
+        self.trip = Trip.objects.create(name='Ladakh', created_by=self.users[0])
+        self.trip.members.add(*self.users)
+        self.enterContext(sharding.on_trip(self.trip.id))
+
+    def post_many(self, payer):
+        try:
+            for _ in range(self.expenses_per_worker):
+                create_expense(self.trip, payer, Decimal('40'), 'Fuel', 'Travel')
+        finally:
+            connections.close_all()
+
+    def test_parallel_posts_keep_exact_totals(self):
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(self.post_many, self.users[i % len(self.users)])
+                       for i in range(self.workers)]
+            for future in futures:
+                future.result()
+
+        posted = self.workers * self.expenses_per_worker
+        self.assertEqual(Expense.objects.filter(trip=self.trip).count(), posted)
+        # Each payer posted 2 workers x 10 expenses; 3 members owe 10.00 of every 40.00
+        for user in self.users:
+            balance = MemberBalance.objects.get(trip=self.trip, user=user).balance
+            self.assertEqual(balance, Money(0))
+        self.assertFalse(Debt.objects.filter(trip=self.trip, amount__gt=0).exists())
+        self.assertEqual(LedgerEntry.objects.filter(trip=self.trip).count(), posted * 4)
+
+
+class DashboardQueryBudgetTests(TestCase):
+    """trip_dashboard must cost the same number of queries however big the trip is"""
+    databases = '__all__'
+
+    budget = 8
+
+    def make_trip(self, members, expenses):
+        users = [User.objects.create_user(f'{members}-{expenses}-{i}', first_name=f'Guest {i}')
+                 for i in range(members)]
+        trip = Trip.objects.create(name=f'Trip {members}', created_by=users[0])
+        trip.members.add(*users)
+        with sharding.on_trip(trip.id):
+            TripMember.objects.bulk_create([
+                TripMember(trip=trip, user=user, name=user.username, whatsapp_number=f'+9100000{i:05}')
+                for i, user in enumerate(users)
+            ])
+        for i in range(expenses):
+            create_expense(trip, users[i % members], Decimal('120'), f'Expense {i}', 'Food')
+        # What the job worker does once the posts commit
+        reminders.refresh(trip.id)
+        return trip, users[0]
+
+    def count_queries(self, trip, user):
+        self.client.force_login(user)
+        url = reverse('trip_dashboard', args=[trip.id])
+        with capture_queries() as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_is_constant_as_trip_grows(self):
+        small = self.count_queries(*self.make_trip(members=3, expenses=5))
+        large = self.count_queries(*self.make_trip(members=30, expenses=50))
+        self.assertEqual(small, large)
+        # Sharded, one more query finds the trip's database
+        self.assertLessEqual(large, self.budget + (1 if sharding.enabled() else 0))
+
+
+class HomeSummaryTests(TransactionTestCase):
+    """Runs in autocommit: with sharding on, the home page reads the shards from threads of its own"""
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.me = User.objects.create_user('me')
+        self.friend = User.objects.create_user('friend')
+        self.client.force_login(self.me)
+
+    def make_trips(self, count):
+        for i in range(count):
+            trip = Trip.objects.create(name=f'Trip {i}', created_by=self.me)
+            trip.members.add(self.me, self.friend)
+            create_expense(trip, self.friend, Decimal('100'), 'Lunch', 'Food')
+
+    def test_query_count_does_not_grow_with_trips(self):
+        self.make_trips(2)
+        with capture_queries() as few:
+            self.client.get(reverse('home'))
+        cache.clear()
+        self.make_trips(20)
+        with capture_queries() as many:
+            response = self.client.get(reverse('home'))
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(response.context['total_to_pay'], Money(110000))
+        self.assertEqual(len(response.context['to_pay']), 22)
+        self.assertEqual({t['member_count'] for t in response.context['my_trips']}, {2})
+
+    def test_pending_payments_match_the_totals(self):
+        trip = Trip.objects.create(name='Even', created_by=self.me)
+        trip.members.add(self.me, self.friend)
+        create_expense(trip, self.me, Decimal('100'), 'Lunch', 'Food')
+        create_expense(trip, self.friend, Decimal('100'), 'Dinner', 'Food')
+        response = self.client.get(reverse('home'))
+        self.assertEqual(response.context['total_to_pay'], Money(0))
+        self.assertEqual(response.context['to_pay'], [])
+        self.assertContains(response, 'All settled up!')
+
+        create_expense(trip, self.friend, Decimal('30'), 'Tea', 'Food')
+        cache.clear()
+        response = self.client.get(reverse('home'))
+        self.assertEqual(response.context['total_to_pay'], Money(1500))
+        self.assertEqual([(d['to_username'], d['amount']) for d in response.context['to_pay']],
+                         [('friend', Money(1500))])
+
+
+class HomeCacheInvalidationTests(TransactionTestCase):
+    """Runs in autocommit so the on_commit invalidation fires like it does in production"""
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.me = User.objects.create_user('me')
+        self.friend = User.objects.create_user('friend')
+        self.client.force_login(self.me)
+
+    def test_cached_until_a_trip_changes(self):
+        trip = Trip.objects.create(name='Trip', created_by=self.me)
+        trip.members.add(self.me, self.friend)
+        create_expense(trip, self.friend, Decimal('100'), 'Lunch', 'Food')
+        self.client.get(reverse('home'))
+        with CaptureQueriesContext(connection) as cached:
+            self.client.get(reverse('home'))
+        self.assertFalse(any('expenses_trip' in q['sql'] for q in cached))
+
+        create_expense(trip, self.me, Decimal('40'), 'Tea', 'Food')
+        response = self.client.get(reverse('home'))
+        self.assertEqual(response.context['total_to_pay'], Money(3000))
+
+    def test_joining_a_trip_invalidates_home(self):
+        self.client.get(reverse('home'))
+        trip = Trip.objects.create(name='Surprise', created_by=self.friend)
+        trip.members.add(self.me)
+        response = self.client.get(reverse('home'))
+        self.assertEqual([t['name'] for t in response.context['my_trips']], ['Surprise'])
+
+    def test_deleting_a_trip_invalidates_home(self):
+        trip = Trip.objects.create(name='Gone', created_by=self.friend)
+        trip.members.add(self.me)
+        self.client.get(reverse('home'))
+        trip.delete()
+        response = self.client.get(reverse('home'))
+        self.assertEqual(response.context['my_trips'], [])
+
+
+class ExpensePaginationTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.me = User.objects.create_user('me')
+        self.friend = User.objects.create_user('friend')
+        self.trip = Trip.objects.create(name='Long trip', created_by=self.me)
+        self.trip.members.add(self.me, self.friend)
+        self.enterContext(sharding.on_trip(self.trip.id))
+        for i in range(60):
+            payer = self.me if i % 3 else self.friend
+            create_expense(self.trip, payer, Decimal('10'), f'Expense {i}',
+                           'Food' if i % 2 else 'Travel')
+        self.client.force_login(self.me)
+        self.url = reverse('trip_expenses_json', args=[self.trip.id])
+
+    def walk(self, **params):
+        seen = []
+        cursor = None
+        while True:
+            query = dict(params, limit=7)
+            if cursor:
+                query['cursor'] = cursor
+            page = self.client.get(self.url, query).json()
+            seen.extend(row['id'] for row in page['results'])
+            cursor = page['next']
+            if not cursor:
+                return seen
+
+    def test_pages_cover_every_expense_once_newest_first(self):
+        ids = self.walk()
+        expected = list(Expense.objects.filter(trip=self.trip).order_by('-date', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_expenses_without_a_date_come_last(self):
+        undated = list(Expense.objects.filter(trip=self.trip).order_by('id').values_list('id', flat=True)[5:25:2])
+        Expense.objects.filter(id__in=undated).update(date=None)
+        ids = self.walk()
+        dated = Expense.objects.filter(trip=self.trip, date__isnull=False).order_by('-date', '-id')
+        self.assertEqual(ids, list(dated.values_list('id', flat=True)) + sorted(undated, reverse=True))
+        page = self.client.get(self.url, {'limit': 60}).json()
+        self.assertEqual({row['date'] for row in page['results'][-len(undated):]}, {None})
+
+    def test_filters_by_category_and_payer(self):
+        ids = self.walk(category='Food', payer=self.friend.id)
+        expected = Expense.objects.filter(trip=self.trip, category='Food', paid_by=self.friend)
+        self.assertEqual(sorted(ids), sorted(expected.values_list('id', flat=True)))
+
+    def test_later_pages_cost_the_same_queries(self):
+        first = self.client.get(self.url, {'limit': 5}).json()
+        with capture_queries() as page_one:
+            self.client.get(self.url, {'limit': 5})
+        with capture_queries() as page_two:
+            self.client.get(self.url, {'limit': 5, 'cursor': first['next']})
+        self.assertEqual(len(page_one), len(page_two))
+
+    def test_rejects_bad_cursor(self):
+        response = self.client.get(self.url, {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_only_members_can_read(self):
+        self.client.force_login(User.objects.create_user('stranger'))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class TripVersionCacheTests(TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.me = User.objects.create_user('me')
+        self.friend = User.objects.create_user('friend')
+        self.trip = Trip.objects.create(name='Polling', created_by=self.me)
+        self.trip.members.add(self.me, self.friend)
+        self.client.force_login(self.me)
+        self.client.cookies['csrftoken'] = 'a' * 32
+        self.url = reverse('trip_dashboard', args=[self.trip.id])
+
+    def test_unchanged_trip_answers_304(self):
+        etag = self.client.get(self.url)['ETag']
+        with capture_queries() as queries:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(any('expenses_' in q['sql'] for q in queries))
+
+    def test_cached_page_is_served_without_trip_queries(self):
+        first = self.client.get(self.url)
+        with capture_queries() as queries:
+            second = self.client.get(self.url)
+        self.assertEqual(first.content, second.content)
+        self.assertFalse(any('expenses_' in q['sql'] for q in queries))
+
+    def test_writes_bump_the_version(self):
+        etag = self.client.get(self.url)['ETag']
+        create_expense(self.trip, self.friend, Decimal('80'), 'Boat', 'Travel')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertContains(response, 'Boat')
+
+    def test_summary_json_is_versioned(self):
+        url = reverse('trip_summary_json', args=[self.trip.id])
+        create_expense(self.trip, self.friend, Decimal('80'), 'Boat', 'Travel')
+        response = self.client.get(url)
+        self.assertEqual(response.json()['total_spent'], '80.00')
+        self.assertEqual(response.json()['settlement_plan'],
+                         [{'from': self.me.id, 'to': self.friend.id, 'amount': '40.00'}])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_summary_json_is_members_only(self):
+        self.client.force_login(User.objects.create_user('stranger'))
+        response = self.client.get(reverse('trip_summary_json', args=[self.trip.id]))
+        self.assertEqual(response.status_code, 404)
+
+
+class AsyncViewTests(TransactionTestCase):
+    """The read-heavy views served through the ASGI handler, with their queries off the event loop"""
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.me = User.objects.create_user('me')
+        self.friend = User.objects.create_user('friend')
+        self.trip = Trip.objects.create(name='Kasol', created_by=self.me)
+        self.trip.members.add(self.me, self.friend)
+        with sharding.on_trip(self.trip.id):
+            TripMember.objects.create(trip=self.trip, user=self.friend, name='friend', whatsapp_number='+91 98765 43210')
+        create_expense(self.trip, self.me, Decimal('300'), 'Cafe', 'Food')
+
+    async def test_pages_render_under_asgi(self):
+        await self.async_client.aforce_login(self.me)
+        home = await self.async_client.get(reverse('home'))
+        self.assertContains(home, 'Kasol')
+        dashboard = await self.async_client.get(reverse('trip_dashboard', args=[self.trip.id]))
+        self.assertContains(dashboard, 'Cafe')
+        self.assertTrue(dashboard.context['simplified_debts'][0]['whatsapp_url'].startswith('https://wa.me/919876543210?text='))
+        summary = await self.async_client.get(reverse('trip_summary_json', args=[self.trip.id]))
+        self.assertEqual(summary.json()['settlement_plan'],
+                         [{'from': self.friend.id, 'to': self.me.id, 'amount': '150.00'}])
+        self.assertRegex(summary['Server-Timing'], r'db;dur=[\d.]+;desc="[1-9]\d* queries"')
+
+    async def test_anonymous_users_are_sent_to_login(self):
+        response = await self.async_client.get(reverse('home'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_handler_comparison(self):
+        results = benchmarks.compare_handlers_on(self.trip, self.me, concurrency=(1, 4), requests_per_client=3)
+        self.assertEqual([r['clients'] for r in results], [1, 4])
+        for result in results:
+            for handler in ('wsgi', 'asgi'):
+                self.assertEqual(result[handler]['requests'], result['clients'] * 3)
+                self.assertGreater(result[handler]['requests_per_second'], 0)
+
+
+class CurrencyTests(TransactionTestCase):
+    """Runs in autocommit: with sharding on, the home page reads the shards from threads of its own"""
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        fx.rate_cache.clear()
+        self.me = User.objects.create_user('me')
+        self.friend = User.objects.create_user('friend')
+        self.trip = Trip.objects.create(name='Bangkok', created_by=self.me)
+        self.trip.members.add(self.me, self.friend)
+        self.enterContext(sharding.on_trip(self.trip.id))
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write('date,currency,rate\n2020-01-01,USD,80\n2020-01-01,THB,2.4\n2020-06-01,USD,83.5\n')
+        call_command('load_fx_rates', f.name, stdout=io.StringIO())
+
+    def test_latest_rate_on_or_before_the_day(self):
+        with self.assertNumQueries(1):
+            rates = fx.rates({'USD', 'THB', 'INR', 'EUR'}, date(2020, 3, 1))
+        self.assertEqual(rates, {'USD': Decimal('80'), 'THB': Decimal('2.4'), 'INR': Decimal('1')})
+        with self.assertNumQueries(0):
+            self.assertEqual(fx.rates({'USD'}, date(2020, 3, 1)), {'USD': Decimal('80')})
+        self.assertEqual(fx.rates({'USD'}, date(2021, 1, 1)), {'USD': Decimal('83.5')})
+
+    def test_cache_evicts_least_recently_used(self):
+        rates = fx.RateCache(2)
+        rates.put(('USD', 1), 1)
+        rates.put(('EUR', 1), 2)
+        rates.get(('USD', 1))
+        rates.put(('GBP', 1), 3)
+        self.assertIsNone(rates.get(('EUR', 1)))
+        self.assertEqual(len(rates), 2)
+
+    def test_expense_in_another_currency_is_split_in_the_trip_currency(self):
+        expense = create_expense(self.trip, self.me, Decimal('10'), 'Boat', 'Travel', currency='USD')
+        self.assertEqual((expense.amount, expense.currency, expense.base_amount), (Money(1000), 'USD', Money(83500)))
+        self.assertEqual(MemberBalance.objects.get(trip=self.trip, user=self.friend).balance, Money(-41750))
+        self.assertEqual(str(expense), 'Boat ($10.00)')
+
+        exact = create_expense(self.trip, self.me, Decimal('3'), 'Snacks', 'Food', currency='USD',
+                               split=Split('exact', [self.me.id, self.friend.id], {self.me.id: '1', self.friend.id: '2'}))
+        self.assertEqual(dict(exact.splits.values_list('user_id', 'share')),
+                         {self.me.id: Money(8350), self.friend.id: Money(16700)})
+        with self.assertRaises(fx.MissingRate):
+            create_expense(self.trip, self.me, Decimal('3'), 'Gelato', 'Food', currency='EUR')
+
+    def test_summaries_total_every_currency(self):
+        create_expense(self.trip, self.me, Decimal('100'), 'Hotel', 'Stay')
+        create_expense(self.trip, self.me, Decimal('10'), 'Boat', 'Travel', currency='USD')
+        self.client.force_login(self.me)
+        summary = self.client.get(reverse('trip_summary_json', args=[self.trip.id])).json()
+        self.assertEqual(summary['total_spent'], '935.00')
+        self.assertEqual(summary['spent_by_currency'], [
+            {'currency': 'INR', 'amount': '100.00', 'base_amount': '100.00'},
+            {'currency': 'USD', 'amount': '10.00', 'base_amount': '835.00'},
+        ])
+
+        dollars = Trip.objects.create(name='New York', created_by=self.me, base_currency='USD')
+        dollars.members.add(self.me, self.friend)
+        euros = Trip.objects.create(name='Paris', created_by=self.me, base_currency='EUR')
+        euros.members.add(self.me, self.friend)
+        create_expense(dollars, self.friend, Decimal('20'), 'Pizza', 'Food')
+        Trip.objects.filter(pk=euros.pk).update(base_currency='INR')
+        create_expense(euros, self.friend, Decimal('20'), 'Crepes', 'Food')
+        Trip.objects.filter(pk=euros.pk).update(base_currency='EUR')
+        response = self.client.get(reverse('home'))
+        # Owes $10 in New York (835.00 at today's rate); the Paris trip has no rate to convert with
+        self.assertEqual(response.context['total_to_pay'], Money(83500))
+        self.assertEqual(response.context['total_to_receive'], Money(46750))
+        self.assertEqual(response.context['unconverted_currencies'], ['EUR'])
+        self.assertContains(response, '$10.00')
+
+    def test_add_expense_without_a_rate_is_rejected(self):
+        self.client.force_login(self.me)
+        response = self.client.post(reverse('add_expense', args=[self.trip.id]), {
+            'description': 'Gelato', 'amount': '4', 'currency': 'EUR', 'payer': self.me.id, 'category': 'Food',
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Expense.objects.exists())
+
+
+class SyncTests(TransactionTestCase):
+    """Runs in autocommit: with sharding on, changes to a shard's rows are logged once they commit"""
+    databases = '__all__'
+
+    def setUp(self):
+        self.me = User.objects.create_user('me')
+        self.friend = User.objects.create_user('friend', first_name='Asha')
+        self.trip = Trip.objects.create(name='Hampi', created_by=self.me)
+        self.trip.members.add(self.me, self.friend)
+        self.enterContext(sharding.on_trip(self.trip.id))
+        self.lunch = create_expense(self.trip, self.me, Decimal('60'), 'Lunch', 'Food')
+        self.client.force_login(self.me)
+
+    def sync(self, **params):
+        response = self.client.get(reverse('sync'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_snapshot_then_only_what_changed(self):
+        snapshot = self.sync()
+        self.assertEqual([t['name'] for t in snapshot['trips']], ['Hampi'])
+        self.assertEqual(sorted(m['name'] for m in snapshot['members']), ['Asha', 'me'])
+        self.assertEqual([e['amount'] for e in snapshot['expenses']], ['60.00'])
+        self.assertEqual(snapshot['debts'], [{'trip': self.trip.id, 'items': [
+            {'from': self.friend.id, 'to': self.me.id, 'amount': '30.00'}]}])
+        self.assertEqual(self.sync(since=snapshot['cursor']), {'cursor': snapshot['cursor'], 'more': False})
+
+        tea = create_expense(self.trip, self.friend, Decimal('20'), 'Tea', 'Food')
+        self.client.post(reverse('delete_expense', args=[self.lunch.id]))
+        delta = self.sync(since=snapshot['cursor'])
+        self.assertEqual([e['id'] for e in delta['expenses']], [tea.id])
+        self.assertEqual(delta['deleted_expenses'], [self.lunch.id])
+        self.assertEqual(delta['debts'][0]['items'], [{'from': self.me.id, 'to': self.friend.id, 'amount': '10.00'}])
+        self.assertNotIn('trips', delta)
+
+    def test_cursor_pages_through_changes(self):
+        cursor = self.sync()['cursor']
+        for i in range(5):
+            create_expense(self.trip, self.me, Decimal('10'), f'Snack {i}', 'Food')
+        seen = []
+        while True:
+            page = self.sync(since=cursor, limit=3)
+            seen += [e['description'] for e in page.get('expenses', [])]
+            cursor = page['cursor']
+            if not page['more']:
+                break
+        self.assertEqual(sorted(set(seen)), [f'Snack {i}' for i in range(5)])
+
+    def test_leaving_or_deleting_a_trip_is_synced(self):
+        other = Trip.objects.create(name='Gokarna', created_by=self.friend)
+        other.members.add(self.friend)
+        cursor = self.sync()['cursor']
+        other.members.add(self.me)
+        joined = self.sync(since=cursor)
+        self.assertEqual([t['name'] for t in joined['trips']], ['Gokarna'])
+        self.assertEqual(len(joined['members']), 2)
+
+        other_id = other.id
+        self.trip.members.remove(self.me)
+        other.delete()
+        gone = changelog.sync(self.me, since=joined['cursor'])
+        self.assertEqual(gone['deleted_trips'], sorted([self.trip.id, other_id]))
+        self.assertNotIn('expenses', gone)
+
+    def test_bad_cursor(self):
+        self.assertEqual(self.client.get(reverse('sync'), {'since': 'abc'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('sync'), {'limit': '0'}).status_code, 400)
+
+
+class SearchTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.me = User.objects.create_user('me')
+        self.friend = User.objects.create_user('friend', first_name='Asha')
+        self.trip = Trip.objects.create(name='Pondicherry', created_by=self.me)
+        self.trip.members.add(self.me, self.friend)
+        self.enterContext(sharding.on_trip(self.trip.id))
+        create_expense(self.trip, self.me, Decimal('50'), 'Café breakfast', 'Food')
+        create_expense(self.trip, self.friend, Decimal('900'), 'Scooter rental', 'Travel')
+        create_expense(self.trip, self.friend, Decimal('40'), 'Coffee and scooter fuel', 'Travel')
+        stranger = User.objects.create_user('stranger')
+        elsewhere = Trip.objects.create(name='Elsewhere', created_by=stranger)
+        elsewhere.members.add(stranger)
+        create_expense(elsewhere, stranger, Decimal('10'), 'Scooter parking', 'Travel')
+        self.client.force_login(self.me)
+
+    def found(self, query, **params):
+        response = self.client.get(reverse('search_expenses'), {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_ranked_and_limited_to_my_trips(self):
+        results = self.found('scoot')['results']
+        self.assertEqual([r['description'] for r in results], ['Scooter rental', 'Coffee and scooter fuel'])
+        self.assertEqual({r['trip_name'] for r in results}, {'Pondicherry'})
+        self.assertEqual([r['description'] for r in self.found('cafe')['results']], ['Café breakfast'])
+        self.assertEqual(len(self.found('asha travel')['results']), 2)
+        self.assertEqual(self.found('" OR *')['results'], [])
+
+    def test_index_follows_writes(self):
+        expense = Expense.objects.get(description='Scooter rental')
+        expense.description = 'Bike rental'
+        expense.save()
+        self.friend.first_name = 'Meera'
+        self.friend.save()
+        self.assertEqual([r['paid_by_name'] for r in self.found('bike meera')['results']], ['Meera'])
+        self.client.post(reverse('delete_expense', args=[expense.id]))
+        self.assertEqual(self.found('bike')['results'], [])
+
+    def test_archived_expenses_stay_searchable(self):
+        archive.archive_trip(self.trip)
+        self.assertFalse(Expense.objects.filter(trip=self.trip).exists())
+        results = self.found('scoot')['results']
+        self.assertEqual([r['description'] for r in results], ['Scooter rental', 'Coffee and scooter fuel'])
+        self.friend.first_name = 'Meera'
+        self.friend.save()
+        self.assertEqual(len(self.found('meera travel')['results']), 2)
+        out = io.StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Indexed 4 expenses', out.getvalue())
+        self.assertEqual(len(self.found('travel')['results']), 2)
+
+    def test_pages_and_rebuild(self):
+        first = self.found('travel', limit=1)
+        self.assertEqual((len(first['results']), first['next']), (1, 2))
+        last = self.found('travel', limit=1, page=2)
+        self.assertIsNone(last['next'])
+        self.assertNotEqual(first['results'][0]['id'], last['results'][0]['id'])
+
+        for alias in sharding.databases():
+            with connections[alias].cursor() as cursor:
+                cursor.execute("DELETE FROM expenses_search")
+        self.assertEqual(self.found('travel')['results'], [])
+        out = io.StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Indexed 4 expenses', out.getvalue())
+        self.assertEqual(len(self.found('travel')['results']), 2)
+
+
+class AnalyticsTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        fx.rate_cache.clear()
+        self.me = User.objects.create_user('me')
+        self.friend = User.objects.create_user('friend', first_name='Asha')
+        self.trip = Trip.objects.create(name='Coorg', created_by=self.me)
+        self.trip.members.add(self.me, self.friend)
+        self.enterContext(sharding.on_trip(self.trip.id))
+        create_expense(self.trip, self.me, Decimal('300'), 'Homestay', 'Stay')
+        create_expense(self.trip, self.me, Decimal('40'), 'Coffee', 'Food')
+        create_expense(self.trip, self.friend, Decimal('60'), 'Lunch', 'Food')
+        snack = create_expense(self.trip, self.friend, Decimal('15'), 'Snacks', 'Food')
+        self.client.force_login(self.me)
+        self.client.post(reverse('delete_expense', args=[snack.id]))
+
+    def rollups(self):
+        return sorted(SpendingRollup.objects.values_list('trip_id', 'category', 'date', 'paid_by_id', 'total', 'count'))
+
+    def test_rollups_follow_posts_and_deletes(self):
+        breakdown = analytics.trip_breakdown(self.trip)
+        self.assertEqual((breakdown['total'], breakdown['count']), ('400.00', 3))
+        self.assertEqual([(r['category'], r['total'], r['count']) for r in breakdown['by_category']],
+                         [('Food', '100.00', 2), ('Stay', '300.00', 1)])
+        self.assertEqual([(r['name'], r['total']) for r in breakdown['by_member']],
+                         [('me', '340.00'), ('Asha', '60.00')])
+
+        incremental = self.rollups()
+        self.assertEqual(analytics.rebuild(), len(incremental))
+        self.assertEqual(self.rollups(), incremental)
+
+    def test_endpoints_read_only_the_rollups(self):
+        with capture_queries() as queries:
+            response = self.client.get(reverse('trip_analytics_json', args=[self.trip.id]))
+        self.assertEqual(response.json()['total'], '400.00')
+        self.assertFalse([q['sql'] for q in queries if 'expenses_expense' in q['sql']])
+        self.assertContains(self.client.get(reverse('trip_analytics', args=[self.trip.id])), '₹400.00')
+
+        FxRate.objects.create(currency='USD', date=date(2020, 1, 1), rate=Decimal('80'))
+        dollars = Trip.objects.create(name='Boston', created_by=self.me, base_currency='USD')
+        dollars.members.add(self.me)
+        create_expense(dollars, self.me, Decimal('5'), 'Coffee', 'Food')
+        mine = self.client.get(reverse('my_analytics_json')).json()
+        self.assertEqual(mine['total'], '800.00')
+        self.assertEqual([(r['category'], r['total']) for r in mine['by_category']],
+                         [('Food', '500.00'), ('Stay', '300.00')])
+        self.assertEqual(self.client.get(reverse('trip_analytics_json', args=[dollars.id])).json()['total'], '5.00')
+
+    def test_rebuild_command(self):
+        SpendingRollup.objects.all().delete()
+        call_command('rebuild_rollups', '--trip', self.trip.id, stdout=io.StringIO())
+        self.assertEqual(analytics.trip_breakdown(self.trip)['total'], '400.00')
+
+
+class RebuildBalanceTests(TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.users = [User.objects.create_user(f'r{i}') for i in range(3)]
+        self.trip = Trip.objects.create(name='Spiti', created_by=self.users[0])
+        self.trip.members.add(*self.users)
+        self.enterContext(sharding.on_trip(self.trip.id))
+        create_expense(self.trip, self.users[0], Decimal('90'), 'Fuel', 'Travel')
+        create_expense(self.trip, self.users[1], Decimal('30'), 'Tea', 'Food')
+
+    def drift(self):
+        # How balances went wrong before deletes were reversed
+        Expense.objects.filter(description='Tea').delete()
+        MemberBalance.objects.filter(trip=self.trip, user=self.users[2]).update(balance=0)
+
+    def assertConsistent(self):
+        balances = dict(MemberBalance.objects.filter(trip=self.trip).values_list('user_id', 'balance'))
+        self.assertEqual(balances, {self.users[0].id: 6000, self.users[1].id: -3000, self.users[2].id: -3000})
+        ledger = dict(LedgerEntry.objects.filter(trip=self.trip).values('user_id')
+                      .annotate(total=Sum('amount')).values_list('user_id', 'total'))
+        self.assertEqual(ledger, balances)
+        net = {user_id: 0 for user_id in balances}
+        for debt in Debt.objects.filter(trip=self.trip, amount__gt=0):
+            net[debt.to_user_id] += debt.amount
+            net[debt.from_user_id] -= debt.amount
+        self.assertEqual(net, balances)
+
+    def test_verify_reports_without_writing(self):
+        self.drift()
+        before = list(MemberBalance.objects.values_list('user_id', 'balance'))
+        report = rebuild.rebuild(workers=1, verify=True)
+        self.assertEqual((report['trips'], report['expenses']), (1, 1))
+        self.assertIn(rebuild.Mismatch(self.trip.id, self.users[2].id, 'balance', Money(0), Money(-3000)),
+                      report['mismatches'])
+        self.assertEqual(report['written'], [])
+        self.assertEqual(list(MemberBalance.objects.values_list('user_id', 'balance')), before)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_balances', '--verify', '--workers', 1, stdout=io.StringIO())
+
+    def test_rebuild_in_worker_processes(self):
+        self.drift()
+        out = io.StringIO()
+        call_command('rebuild_balances', '--workers', 2, '--chunk-size', 1, stdout=out)
+        self.assertIn('corrected 1 trips', out.getvalue())
+        self.assertConsistent()
+        self.assertEqual(rebuild.rebuild(workers=1, verify=True)['mismatches'], [])
+
+    def test_trip_that_moves_mid_rebuild_is_left_alone(self):
+        self.drift()
+        alias = sharding.db_for_trip(self.trip.id)
+        states = rebuild.recompute([self.trip.id], alias)
+        create_expense(self.trip, self.users[2], Decimal('3'), 'Water', 'Food')
+        self.assertEqual(rebuild.write(states, alias), ([], [self.trip.id]))
+        self.assertTrue(rebuild.rebuild(workers=1, verify=True)['mismatches'])
+
+
+class ReminderJobTests(TransactionTestCase):
+    """Runs in autocommit so trip changes queue their jobs, and worker threads can see the rows"""
+    databases = '__all__'
+
+    def setUp(self):
+        self.me = User.objects.create_user('me', email='me@example.com')
+        self.friend = User.objects.create_user('friend', first_name='Ravi', email='ravi@example.com')
+        self.guest = User.objects.create_user('guest')
+        self.trip = Trip.objects.create(name='Hampi', created_by=self.me)
+        self.trip.members.add(self.me, self.friend, self.guest)
+        with sharding.on_trip(self.trip.id):
+            TripMember.objects.create(trip=self.trip, user=self.friend, name='Ravi', whatsapp_number='+91 98450 00000')
+        create_expense(self.trip, self.me, Decimal('300'), 'Bikes', 'Travel')
+        create_expense(self.trip, self.me, Decimal('60'), 'Coconuts', 'Food')
+
+    def test_trip_changes_refresh_reminders_in_the_background(self):
+        self.assertEqual(Job.objects.filter(key=f'refresh-reminders:{self.trip.id}').count(), 1)
+        self.assertEqual(jobs.work(threads=2, once=True), (1, 0))
+        reminder = Reminder.objects.get(debtor=self.friend)
+        self.assertEqual(reminder.amount, 12000)
+        self.assertIn('Ravi', reminder.message)
+        self.assertTrue(reminder.whatsapp_url.startswith('https://wa.me/919845000000?text=Hey%20Ravi'))
+        self.assertEqual(Reminder.objects.get(debtor=self.guest).whatsapp_url, '')
+        self.assertFalse(Job.objects.exists())
+
+    @override_settings(REMINDER_SENDER='expenses.notify.EmailSender')
+    def test_due_reminders_are_emailed_once_per_interval(self):
+        jobs.work(once=True)
+        call_command('send_reminders', stdout=io.StringIO())
+        self.assertEqual(jobs.work(threads=2, once=True), (1, 0))
+        # The guest has no email address, so only Ravi hears about it
+        self.assertEqual([m.to for m in mail.outbox], [['ravi@example.com']])
+        html = mail.outbox[0].alternatives[0][0]
+        self.assertIn('₹120.00', html)
+        self.assertIn(f'http://localhost:8000/trip/{self.trip.id}/', html)
+
+        reminders.schedule()
+        jobs.work(once=True)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_file_sender_writes_the_outbox(self):
+        reminders.refresh(self.trip.id)
+        with tempfile.TemporaryDirectory() as outbox, self.settings(REMINDER_OUTBOX=outbox):
+            call_command('send_reminders', '--now', stdout=io.StringIO())
+            files = list(Path(outbox).iterdir())
+            self.assertEqual(len(files), 1)
+            self.assertIn('Ravi', files[0].read_text())
+
+    def test_failing_jobs_are_retried_then_kept(self):
+        Job.objects.all().delete()
+        jobs.enqueue('refresh_reminders', trip_id='not a trip')
+        self.assertEqual(jobs.work(once=True), (1, 1))
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts), ('pending', 1))
+        self.assertIn('not a trip', job.last_error)
+
+        Job.objects.update(attempts=jobs.MAX_ATTEMPTS - 1, run_after=job.created_at)
+        jobs.work(once=True)
+        self.assertEqual(Job.objects.get().status, 'failed')
+
+
+class ExportTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.me = User.objects.create_user('me')
+        self.friend = User.objects.create_user('friend')
+        self.trip = Trip.objects.create(name='Export', created_by=self.me)
+        self.trip.members.add(self.me, self.friend)
+        create_expense(self.trip, self.me, Decimal('100'), 'Hotel, two nights', 'Stay')
+        create_expense(self.trip, self.friend, Decimal('30'), 'Chai', 'Food')
+        self.client.force_login(self.me)
+
+    def test_csv_streams_expenses(self):
+        response = self.client.get(reverse('export_trip_csv', args=[self.trip.id]))
+        self.assertTrue(response.streaming)
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0], ['id', 'date', 'description', 'category', 'amount', 'currency',
+                                   'base_amount', 'paid_by'])
+        self.assertEqual([row[2] for row in rows[1:]], ['Hotel, two nights', 'Chai'])
+        self.assertEqual([row[4:7] for row in rows[1:]], [['100.00', 'INR', '100.00'], ['30.00', 'INR', '30.00']])
+
+    def test_ndjson_has_every_section(self):
+        response = self.client.get(reverse('export_trip_ndjson', args=[self.trip.id]))
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([line['type'] for line in lines],
+                         ['expense', 'expense', 'balance', 'balance', 'settlement'])
+        self.assertEqual(lines[-1]['amount'], '35.00')
+
+    def test_management_command(self):
+        out = io.StringIO()
+        call_command('export_trip', self.trip.id, '--format', 'csv', '--section', 'balances', stdout=out)
+        self.assertEqual(out.getvalue().splitlines()[0], 'user_id,username,balance')
+
+
+class ArchiveTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.me = User.objects.create_user('me')
+        self.friend = User.objects.create_user('friend')
+        self.trip = Trip.objects.create(name='Kasol', created_by=self.me)
+        self.trip.members.add(self.me, self.friend)
+        self.enterContext(sharding.on_trip(self.trip.id))
+        create_expense(self.trip, self.me, Decimal('100'), 'Cottage', 'Stay')
+        create_expense(self.trip, self.friend, Decimal('100'), 'Bus', 'Travel')  # Settles the pair to zero
+        self.dinner = create_expense(self.trip, self.friend, Decimal('30'), 'Dinner', 'Food')
+        self.client.force_login(self.me)
+
+    def balances(self):
+        return dict(MemberBalance.objects.filter(trip=self.trip).values_list('user_id', 'balance'))
+
+    def test_archive_moves_expenses_and_keeps_them_readable(self):
+        before = self.balances()
+        self.client.post(reverse('archive_trip', args=[self.trip.id]))
+        self.trip.refresh_from_db()
+        self.assertIsNotNone(self.trip.archived_at)
+        self.assertFalse(Expense.objects.filter(trip=self.trip).exists())
+        self.assertFalse(ExpenseSplit.objects.filter(expense__trip=self.trip).exists())
+        self.assertFalse(Debt.objects.filter(trip=self.trip, amount=0).exists())
+        self.assertEqual(set(LedgerEntry.objects.filter(trip=self.trip).values_list('kind', flat=True)), {'archive'})
+        self.assertEqual(self.balances(), before)
+        self.assertEqual(ArchivedExpense.objects.get(id=self.dinner.id).shares,
+                         {str(self.me.id): 1500, str(self.friend.id): 1500})
+        self.assertEqual(ArchivedBalance.objects.get(trip=self.trip, user=self.friend).paid, Money(13000))
+
+        page = self.client.get(reverse('trip_expenses_json', args=[self.trip.id])).json()
+        self.assertEqual([e['description'] for e in page['results']], ['Dinner', 'Bus', 'Cottage'])
+        self.assertContains(self.client.get(reverse('trip_dashboard', args=[self.trip.id])), 'Archived')
+        lines = [json.loads(line) for line in b''.join(
+            self.client.get(reverse('export_trip_ndjson', args=[self.trip.id])).streaming_content).splitlines()]
+        self.assertEqual([line['type'] for line in lines].count('final_balance'), 2)
+        self.assertEqual(analytics.trip_breakdown(self.trip)['total'], '230.00')
+        self.assertEqual(changelog.sync(self.me)['expenses'][0]['description'], 'Cottage')
+
+    def test_archived_trip_takes_payments_but_no_expenses(self):
+        archive.archive_trip(self.trip)
+        response = self.client.post(reverse('add_expense', args=[self.trip.id]), {
+            'description': 'Late snack', 'amount': '10', 'payer': self.me.id, 'category': 'Food',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Expense.objects.filter(trip=self.trip).exists())
+        self.assertEqual(settle_all(self.trip)[0].amount, Money(1500))
+        self.assertEqual(settlement_plan(self.trip), [])
+        self.assertEqual(rebuild.rebuild(workers=1, verify=True)['trips'], 0)
+
+    def test_command_archives_idle_trips_and_compacts(self):
+        live = Trip.objects.create(name='Still going', created_by=self.me)
+        live.members.add(self.me, self.friend)
+        create_expense(live, self.me, Decimal('10'), 'Tea', 'Food')
+        settle_all(live)
+        settle_all(self.trip)
+        # Saved, so the trip's copy on its shard is dated back too
+        self.trip.created_at = self.trip.created_at.replace(year=2020)
+        self.trip.save(update_fields=['created_at'])
+        Expense.objects.filter(trip=self.trip).update(date=date(2020, 1, 1))
+        Payment.objects.filter(trip=self.trip).update(created_at=self.trip.created_at.replace(year=2020))
+
+        out = io.StringIO()
+        call_command('archive_trips', '--idle-days', '30', '--compact', stdout=out)
+        self.assertIn('Archived 1 trips (3 expenses) and deleted 1 zeroed debts', out.getvalue())
+        self.assertEqual(list(Trip.objects.filter(archived_at__isnull=False)), [self.trip])
+        self.assertFalse(sharding.gather(Debt.objects.filter(amount=0)))
+
+
+class CreateTripTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.me = User.objects.create_user('me')
+        self.registered = User.objects.create_user('Asha')
+        self.client.force_login(self.me)
+
+    def post_trip(self, names):
+        return self.client.post(reverse('create_trip'), {
+            'name': 'Group trip',
+            'member_names[]': names,
+            'member_whatsapp[]': [f'+9198{i:08}' for i in range(len(names))],
+        })
+
+    def test_links_registered_users_and_creates_placeholders(self):
+        self.post_trip(['asha', 'Ravi Kumar', 'Ravi Kumar'])
+        trip = Trip.objects.get(name='Group trip')
+        self.assertIn(self.registered, trip.members.all())
+        placeholders = User.objects.filter(first_name='Ravi Kumar')
+        self.assertEqual(placeholders.count(), 2)
+        self.assertFalse(any(user.has_usable_password() for user in placeholders))
+        self.assertEqual(trip.members.count(), 4)
+        with sharding.on_trip(trip.id):
+            self.assertEqual(TripMember.objects.filter(trip=trip).count(), 4)
+
+    def test_query_count_does_not_grow_with_group_size(self):
+        with capture_queries() as small:
+            self.post_trip(['a1', 'a2'])
+        with capture_queries() as large:
+            self.post_trip([f'b{i}' for i in range(30)])
+        self.assertEqual(len(small), len(large))
+
+
+class SyntheticDataTests(TestCase):
+    databases = '__all__'
+
+    def test_seed_data_is_consistent(self):
+        call_command('seed_data', '--users', 12, '--trips', 3, '--members', 4, '--expenses', 25,
+                     stdout=io.StringIO())
+        self.assertEqual(len(sharding.gather(Expense.objects.all())), 75)
+        for trip in Trip.objects.all():
+            with sharding.on_trip(trip.id):
+                balances = list(MemberBalance.objects.filter(trip=trip))
+                ledger = dict(LedgerEntry.objects.filter(trip=trip).values('user_id')
+                              .annotate(total=Sum('amount')).values_list('user_id', 'total'))
+            self.assertEqual(sum(b.balance for b in balances), 0)
+            self.assertEqual(ledger, {b.user_id: b.balance for b in balances})
+        rollups = SpendingRollup.objects.values_list('trip_id', 'category', 'date', 'paid_by_id', 'total', 'count')
+        incremental = sorted(sharding.gather(rollups))
+        analytics.rebuild()
+        self.assertEqual(sorted(sharding.gather(rollups)), incremental)
+
+    def test_benchmark_reports_every_view(self):
+        report = benchmarks.run_scale('tiny', (6, 2, 3, 10), iterations=2)
+        self.assertEqual(set(report['views']), {
+            'home', 'trip_dashboard', 'add_expense', 'create_trip', 'settle_debt_simplified',
+        })
+        for stats in report['views'].values():
+            self.assertLessEqual(stats['p50_ms'], stats['p95_ms'])
+            self.assertGreater(stats['queries'], 0)
+
+
+@skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN is SQLite's")
+class QueryPlanTests(TestCase):
+    """Hot lookups must be answered from an index, never by scanning a whole table"""
+    databases = '__all__'
+
+    @classmethod
+    def setUpTestData(cls):
+        synthetic.seed(users=30, trips=6, members_per_trip=6, expenses_per_trip=150, prefix='plan')
+        # Settle one trip so zeroed debts sit next to open ones, as in a live database
+        trip = Trip.objects.first()
+        Debt.objects.filter(trip=trip).update(amount=0)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        cls.trip = Trip.objects.order_by('id').last()
+        cls.user = cls.trip.members.first()
+
+    def full_scans(self, sql, params=()):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            details = [row[-1] for row in cursor.fetchall()]
+        return [d for d in details if re.fullmatch(r'SCAN \S+', d)]
+
+    def expense_index_searches(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall() if ' INDEX expense_' in row[-1]]
+
+    def assertUsesIndexes(self, querysets):
+        for queryset in querysets:
+            sql, params = queryset.query.sql_with_params()
+            with self.subTest(sql=sql):
+                self.assertEqual(self.full_scans(sql, params), [])
+
+    def test_hot_lookups(self):
+        trip, user = self.trip, self.user
+        self.assertUsesIndexes([
+            Debt.objects.filter(trip=trip, amount__gt=0),
+            Debt.objects.filter(Q(from_user=user) | Q(to_user=user)).filter(amount__gt=0),
+            Expense.objects.filter(trip=trip, paid_by=user),
+            TripMember.objects.filter(trip=trip, user=user),
+            TripMember.objects.filter(trip=trip, name=user.first_name),
+            MemberBalance.objects.filter(trip=trip, user=user),
+        ])
+
+    def test_expense_pages_seek_to_their_cursor(self):
+        # Page 500 must not read the rows of pages 1 to 499 on its way: every walk
+        # through the trip's expenses starts at the cursor, or among the undated ones
+        dated = pagination.encode_cursor(Expense(id=10 ** 6, date=date(2026, 1, 1)))
+        undated = pagination.encode_cursor(Expense(id=10 ** 6, date=None))
+        for cursor, bound in ((dated, 'date<?'), (undated, 'date=? AND id<?')):
+            for category in (None, 'Food'):
+                with self.subTest(cursor=cursor, category=category):
+                    searches = self.expense_index_searches(
+                        pagination._page_queryset(self.trip, cursor, category, None, pagination.PAGE_SIZE))
+                    self.assertIn(f' AND {bound})', ' '.join(searches))
+                    for search in searches:
+                        self.assertRegex(search, r' AND date[<=]\?( AND id<\?)?\)$')
+
+    def test_views(self):
+        self.client.force_login(self.user)
+        urls = [
+            reverse('home'),
+            reverse('trip_dashboard', args=[self.trip.id]),
+            reverse('trip_summary_json', args=[self.trip.id]),
+            reverse('trip_expenses_json', args=[self.trip.id]) + f'?payer={self.user.id}',
+            reverse('trip_expenses_json', args=[self.trip.id]) + '?category=Food',
+        ]
+        for url in urls:
+            cache.clear()
+            with CaptureQueriesContext(connection) as captured:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            for query in captured.captured_queries:
+                if query['sql'].startswith('SELECT'):
+                    with self.subTest(url=url, sql=query['sql']):
+                        self.assertEqual(self.full_scans(query['sql']), [])
+
+
+@skipUnless(connection.vendor == 'sqlite', "Compares SQLite profiles")
+class SQLiteProfileTests(TransactionTestCase):
+    databases = '__all__'
+
+    def tearDown(self):
+        loadtest.set_journal_mode(loadtest.PROFILES['default'])
+
+    def test_production_options_apply_on_connect(self):
+        wrapper = connection.copy()
+        wrapper.settings_dict['OPTIONS'] = loadtest.PROFILES['production']
+        try:
+            with wrapper.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                self.assertEqual(cursor.fetchone()[0], 'wal')
+                cursor.execute('PRAGMA synchronous')
+                self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            self.assertEqual(wrapper.transaction_mode, 'IMMEDIATE')
+        finally:
+            wrapper.close()
+
+    def test_concurrent_writers_do_not_fail(self):
+        synthetic.seed(users=8, trips=2, members_per_trip=4, expenses_per_trip=10, prefix='load')
+        result = loadtest.run_workers(4, loadtest.PROFILES['production'], duration=0.5, write_ratio=0.5)
+        self.assertEqual(result['errors'], 0)
+        self.assertGreater(result['writes_per_second'], 0)
+        self.assertGreater(result['reads_per_second'], 0)
+        for trip in Trip.objects.all():
+            self.assertEqual(sum(b.balance for b in MemberBalance.objects.filter(trip=trip)), 0)
+
+
+class ProfilingMiddlewareTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        metrics.reset()
+        self.me = User.objects.create_user('me')
+        self.client.force_login(self.me)
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('home'))
+        timing = response['Server-Timing']
+        self.assertIn('total;dur=', timing)
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertIn('tpl;dur=', timing)
+
+    def test_metrics_endpoint_reports_histograms(self):
+        self.client.get(reverse('home'))
+        self.client.get(reverse('home'))
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('# TYPE splitease_request_duration_seconds histogram', body)
+        self.assertIn('splitease_request_duration_seconds_count{view="home"} 2', body)
+        self.assertIn('splitease_db_queries_bucket{view="home",le="+Inf"} 2', body)
+
+    def test_metrics_hidden_from_other_hosts(self):
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='203.0.113.9')
+        self.assertEqual(response.status_code, 404)
+
+    def test_sampled_slow_requests_are_dumped(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with self.settings(PROFILING_SAMPLE_RATE=1, PROFILING_SLOW_MS=0, PROFILING_DUMP_DIR=directory):
+                self.client.get(reverse('home'))
+            dumps = list(Path(directory).glob('*-home-*.prof'))
+            self.assertEqual(len(dumps), 1)
+            self.assertTrue(pstats.Stats(str(dumps[0])).total_calls)
+
+
+@skipUnless(hasattr(settings, 'TEST_TRIP_SHARDS'), "Needs splitease.test_settings")
+@override_settings(TRIP_SHARDS=getattr(settings, 'TEST_TRIP_SHARDS', []))
+class ShardingTests(TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.me = User.objects.create_user('me')
+        self.friend = User.objects.create_user('friend', first_name='Friend')
+
+    def trip_on(self, alias):
+        """A new trip of me and friend, placed on alias"""
+        while True:
+            trip = Trip.objects.create(name='Goa', created_by=self.me)
+            trip.members.add(self.me, self.friend)
+            if sharding.db_for_trip(trip.id) == alias:
+                return trip
+            trip.delete()
+
+    def test_trip_rows_live_on_the_trips_shard(self):
+        first, second = settings.TRIP_SHARDS[:2]
+        trip = self.trip_on(second)
+        expense = create_expense(trip, self.me, Decimal('300'), 'Shack', 'Stay')
+        self.assertEqual(TripShard.objects.get(trip=trip).alias, second)
+        self.assertEqual(Expense.objects.using(second).filter(trip=trip).count(), 1)
+        self.assertFalse(Expense.objects.using(first).exists())
+        self.assertFalse(Debt.objects.using('default').exists())
+        # Ids made on a shard stay clear of every other database's
+        self.assertGreaterEqual(expense.id, 2 * sharding.ID_SPACING)
+        with sharding.on_trip(trip.id):
+            self.assertEqual(Debt.objects.get(trip=trip).amount, Money(15000))
+        # The shard's copy of a user follows renames
+        self.friend.first_name = 'Renamed'
+        self.friend.save()
+        self.assertEqual(User.objects.using(second).get(pk=self.friend.pk).first_name, 'Renamed')
+
+    def test_home_reads_every_shard(self):
+        first, second = settings.TRIP_SHARDS[:2]
+        create_expense(self.trip_on(first), self.me, Decimal('100'), 'Lunch', 'Food')
+        create_expense(self.trip_on(second), self.friend, Decimal('40'), 'Taxi', 'Travel')
+        summary = home_summary(self.me)
+        self.assertEqual(len(summary['my_trips']), 2)
+        self.assertEqual(summary['total_to_receive'], Money(5000))
+        self.assertEqual(summary['total_to_pay'], Money(2000))
+        self.assertEqual(len(summary['to_pay']) + len(summary['to_receive']), 2)
+        self.client.force_login(self.me)
+        self.assertEqual(self.client.get(reverse('home')).status_code, 200)
+
+    def test_benchmarks_see_every_shard(self):
+        first, second = settings.TRIP_SHARDS[:2]
+        create_expense(self.trip_on(first), self.me, Decimal('100'), 'Lunch', 'Food')
+        busy = self.trip_on(second)
+        for description in ('Taxi', 'Ferry'):
+            create_expense(busy, self.friend, Decimal('40'), description, 'Travel')
+        self.assertEqual(benchmarks.biggest_trip(), busy)
+        # fan_out() reads the shards from its own threads
+        with capture_queries() as queries:
+            home_summary(self.me)
+        self.assertEqual({query['alias'] for query in queries}, set(sharding.databases()))
+
+    def test_move_trip_to_a_later_shard(self):
+        first, second = settings.TRIP_SHARDS[:2]
+        trip = self.trip_on(first)
+        lunch = create_expense(trip, self.me, Decimal('100'), 'Lunch', 'Food')
+        Expense.objects.using(first).filter(pk=lunch.pk).update(date=date(2020, 1, 1))
+        settle_all(trip)
+        self.assertGreater(sharding.move_trip(trip.id, second), 0)
+        self.assertEqual(sharding.db_for_trip(trip.id), second)
+        # Rows move as they are, dates included
+        self.assertEqual(Expense.objects.using(second).get(pk=lunch.pk).date, date(2020, 1, 1))
+        self.assertEqual(Trip.objects.using(second).get(pk=trip.pk).created_at, trip.created_at)
+        self.assertFalse(Expense.objects.using(first).exists())
+        self.assertFalse(Trip.objects.using(first).exists())
+        self.assertEqual(Payment.objects.using(second).filter(trip=trip).count(), 1)
+        # The moved trip takes new expenses, and its history adds up
+        create_expense(trip, self.friend, Decimal('60'), 'Bus', 'Travel')
+        self.assertEqual(rebuild.rebuild([trip.id], workers=1, verify=True)['mismatches'], [])
+        with self.assertRaises(ValueError):
+            sharding.move_trip(trip.id, first)
+
+    def test_changes_are_logged_once_the_shard_commits(self):
+        trip = self.trip_on(settings.TRIP_SHARDS[1])
+        logged = set(Change.objects.values_list('id', flat=True))
+        with self.assertRaises(ValueError), sharding.atomic(trip):
+            create_expense(trip, self.me, Decimal('100'), 'Lunch', 'Food')
+            raise ValueError("rolled back")
+        self.assertEqual(set(Change.objects.values_list('id', flat=True)), logged)
+        create_expense(trip, self.me, Decimal('100'), 'Lunch', 'Food')
+        self.assertEqual(set(Change.objects.exclude(id__in=logged).values_list('model', flat=True)),
+                         {'expense', 'debts'})
+
+    def test_rebalance_command_and_trip_delete(self):
+        trip = self.trip_on(settings.TRIP_SHARDS[0])
+        out = io.StringIO()
+        call_command('rebalance_shards', '--dry-run', stdout=out)
+        self.assertIn('Would move', out.getvalue())
+        alias = sharding.db_for_trip(trip.id)
+        create_expense(trip, self.me, Decimal('100'), 'Lunch', 'Food')
+        trip.delete()
+        self.assertFalse(Expense.objects.using(alias).exists())
+        self.assertFalse(Trip.objects.using(alias).exists())
@@ -0,0 +1,84 @@
+"""
+Creating a trip together with all of its members.
+
+Members are resolved with one case-insensitive lookup, unknown people become
+placeholder accounts in one bulk insert, and everything happens in a single
+transaction, so creating a 30-person trip costs the same handful of queries
+as a 2-person one.
+"""
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.functions import Lower
+
+from . import sharding
+from .models import Trip, TripMember
+from .money import DEFAULT_CURRENCY
+
+
+def placeholder_username(name, trip_id):
+    return name.lower().replace(' ', '_') + '_' + str(trip_id)
+
+
+def create_trip_with_members(creator, name, description, members, base_currency=DEFAULT_CURRENCY):
+    """
+    Create a trip for creator plus [(name, whatsapp_number), ...] members,
+    keeping its balances in base_currency.
+
+    Names that match a registered username (ignoring case) link to that account.
+    Everyone else gets a placeholder account with an unusable password: no
+    PBKDF2 hashing happens here, and the account can be claimed later by
+    giving it a real password (password reset or the admin).
+    """
+    members = [(n.strip(), w.strip()) for n, w in members if n.strip() and w.strip()]
+
+    with transaction.atomic():
+        trip = Trip.objects.create(name=name, description=description, created_by=creator,
+                                   base_currency=base_currency)
+
+        # One query finds every registered user, and any placeholder names already taken
+        wanted = {n.lower() for n, _ in members} | {placeholder_username(n, trip.id) for n, _ in members}
+        existing = {
+            user.lower_username: user
+            for user in User.objects.annotate(lower_username=Lower('username'))
+                                    .filter(lower_username__in=wanted)
+        }
+
+        placeholders = []
+        rows = []
+        for member_name, whatsapp in members:
+            user = existing.get(member_name.lower())
+            if user is not None:
+                rows.append((user, whatsapp, user.username))
+                continue
+            username = placeholder_username(member_name, trip.id)
+            suffix = 2
+            while username.lower() in existing:
+                # Same name twice in one trip, or the name is already someone's username
+                username = f"{placeholder_username(member_name, trip.id)}_{suffix}"
+                suffix += 1
+            user = User(username=username, first_name=member_name, password=make_password(None))
+            existing[username.lower()] = user
+            placeholders.append(user)
+            rows.append((user, whatsapp, member_name))
+
+        User.objects.bulk_create(placeholders)
+        if placeholders and placeholders[0].pk is None:
+            # Backends that can't return ids from a bulk insert: read them back
+            ids = dict(User.objects.filter(username__in=[u.username for u in placeholders])
+                       .values_list('username', 'id'))
+            for user in placeholders:
+                user.pk = ids[user.username]
+
+        trip.members.add(creator, *[user for user, _, _ in rows])
+        # The creator's own row keeps their username as the contact, as before.
+        # A number listed twice keeps its first member only.
+        # The rows go to the trip's shard, where its members were just copied.
+        with sharding.on_trip(trip.id):
+            TripMember.objects.bulk_create(
+                [TripMember(trip=trip, user=creator, whatsapp_number=creator.username, name=creator.username)]
+                + [TripMember(trip=trip, user=user, whatsapp_number=whatsapp, name=display)
+                   for user, whatsapp, display in rows],
+                ignore_conflicts=True,
+            )
+    return trip
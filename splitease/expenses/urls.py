@@ -17,11 +17,30 @@ urlpatterns = [
     path('create/', views.create_trip, name='create_trip'),
     path('trip/<int:trip_id>/', views.trip_dashboard, name='trip_dashboard'),
     path('trip/delete/<int:trip_id>/', views.delete_trip, name='delete_trip'),
+    path('trip/<int:trip_id>/expenses/', views.trip_expenses_json, name='trip_expenses_json'),
+    path('trip/<int:trip_id>/summary/', views.trip_summary_json, name='trip_summary_json'),
+    path('trip/<int:trip_id>/export.csv', views.export_trip_csv, name='export_trip_csv'),
+    path('trip/<int:trip_id>/export.ndjson', views.export_trip_ndjson, name='export_trip_ndjson'),
 
     # 4. Expense & Settlement Logic
     path('trip/<int:trip_id>/add/', views.add_expense, name='add_expense'),
     path('settle/<int:debt_id>/', views.settle_debt, name='settle_debt'),
     path('trip/<int:trip_id>/settle/<int:debtor_id>/<int:creditor_id>/', views.settle_debt_simplified, name='settle_debt_simplified'),
+    path('trip/<int:trip_id>/settle-all/', views.settle_trip, name='settle_trip'),
+    path('trip/<int:trip_id>/archive/', views.archive_trip, name='archive_trip'),
 
     path('expense/delete/<int:expense_id>/', views.delete_expense, name='delete_expense'),
+
+    # 5. Spending analytics
+    path('analytics/', views.my_analytics, name='my_analytics'),
+    path('analytics.json', views.my_analytics_json, name='my_analytics_json'),
+    path('trip/<int:trip_id>/analytics/', views.trip_analytics, name='trip_analytics'),
+    path('trip/<int:trip_id>/analytics.json', views.trip_analytics_json, name='trip_analytics_json'),
+
+    # 6. Mobile sync and search
+    path('sync/', views.sync, name='sync'),
+    path('search/', views.search_expenses, name='search_expenses'),
+
+    # 7. Monitoring
+    path('metrics', views.metrics_view, name='metrics'),
 ]
\ No newline at end of file
@@ -1,9 +1,31 @@
-from django.shortcuts import render, get_object_or_404, redirect
-from .models import Trip, Expense, Debt, TripMember
+import asyncio
+from functools import wraps
+
+from django.shortcuts import render, get_object_or_404, aget_object_or_404, redirect
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import condition
+from .models import Trip, Expense, Debt, Payment, Reminder, TripMember
+from .caching import (
+    HOME_TIMEOUT, TRIP_PAGE_TIMEOUT, dashboard_key, home_key, trip_summary_key,
+    atrip_version, trip_version, viewer_token,
+)
+from .ledger import (
+    PaymentError, TripArchived, create_expense, reverse_expense, settle_all, settle_transfer,
+)
+from .settlement import asettlement_plan
+from .summaries import ahome_summary, alist, atrip_summary
+from .pagination import MAX_PAGE_SIZE, PAGE_SIZE, aexpense_page, expense_page
+from .exports import SECTIONS, stream_csv, stream_ndjson
+from .trips import create_trip_with_members
+from .splits import METHODS as SPLIT_METHODS, Split, SplitError
+from .fx import MissingRate
+from .money import CURRENCIES, DEFAULT_CURRENCY, Money, display
+from . import analytics, archive, changelog, metrics, reminders, search, sharding
+from django.conf import settings
 from django.contrib.auth.models import User
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
 from django.contrib.auth.decorators import login_required
-from django.db.models import Sum
+from django.core.cache import cache
 from django.contrib import messages
 from django.contrib.auth.forms import UserCreationForm
 # 1. CREATE TRIP VIEW
@@ -29,158 +51,166 @@ def create_trip(request):
         member_names = request.POST.getlist('member_names[]')
         member_whatsapp = request.POST.getlist('member_whatsapp[]')
 
-        # Create the Trip object in the database
-        new_trip = Trip.objects.create(name=name, description=description, created_by=request.user)
-
-        # Add current user as a member
-        new_trip.members.add(request.user)
-
-        # Add creator as TripMember with their whatsapp
-        TripMember.objects.create(
-            trip=new_trip,
-            user=request.user,
-            whatsapp_number=request.user.username,
-            name=request.user.username
+        # Create the trip, the creator's membership and every member in one transaction.
+        # Registered users are found in one lookup; everyone else becomes a placeholder
+        # account created in bulk, without hashing a throwaway password for each of them.
+        base_currency = request.POST.get('base_currency') or DEFAULT_CURRENCY
+        if base_currency not in dict(CURRENCIES):
+            base_currency = DEFAULT_CURRENCY
+        new_trip = create_trip_with_members(
+            request.user, name, description, zip(member_names, member_whatsapp), base_currency
         )
 
-        # Process each member
-        for member_name, member_whatsapp_num in zip(member_names, member_whatsapp):
-            member_name = member_name.strip()
-            member_whatsapp_num = member_whatsapp_num.strip()
-
-            if member_name and member_whatsapp_num:
-                # Try to find existing user by username (case-insensitive)
-                try:
-                    user = User.objects.get(username__iexact=member_name)
-                    # Add to trip members
-                    new_trip.members.add(user)
-                    # Create TripMember with user
-                    TripMember.objects.create(
-                        trip=new_trip,
-                        user=user,
-                        whatsapp_number=member_whatsapp_num,
-                        name=user.username
-                    )
-                except User.DoesNotExist:
-                    # For non-registered members, create a temporary user account
-                    # Generate a unique username
-                    temp_username = member_name.lower().replace(' ', '_') + '_' + str(new_trip.id)
-                    # Create user with random password
-                    temp_user = User.objects.create_user(
-                        username=temp_username,
-                        password='temp123456',
-                        first_name=member_name
-                    )
-                    # Add to trip members
-                    new_trip.members.add(temp_user)
-                    # Create TripMember with temporary user
-                    TripMember.objects.create(
-                        trip=new_trip,
-                        user=temp_user,
-                        whatsapp_number=member_whatsapp_num,
-                        name=member_name
-                    )
-
         messages.success(request, f"Trip '{name}' created successfully!")
         # Redirect to the dashboard of the newly created trip
         return redirect('trip_dashboard', trip_id=new_trip.id)
 
     # If it's a GET request, show the form
     available_users = User.objects.exclude(id=request.user.id)
-    return render(request, 'expenses/trip_detail.html', {'available_users': available_users})
+    return render(request, 'expenses/trip_detail.html', {
+        'available_users': available_users, 'currencies': CURRENCIES, 'default_currency': DEFAULT_CURRENCY,
+    })
 
 
 # 2. ADD EXPENSE VIEW
 # This handles the math of splitting the bill and updating the 'Debt' table.
+# The split engine (splits.py) works in whole paise, so shares always add up to the bill.
+@sharding.trip_view
 def add_expense(request, trip_id):
     # Fetch the specific trip or show a 404 error if not found
     trip = get_object_or_404(Trip, id=trip_id)
+    if trip.archived_at:
+        messages.error(request, f"{trip.name} is archived, so no more expenses can be added.")
+        return redirect('trip_dashboard', trip_id=trip.id)
     
     if request.method == "POST":
         # 1. Extract data from the POST request
         description = request.POST.get('description')
         amount = Decimal(request.POST.get('amount'))
+        currency = request.POST.get('currency') or trip.base_currency
+        if currency not in dict(CURRENCIES):
+            currency = trip.base_currency
         payer_id = request.POST.get('payer')
         payer = get_object_or_404(User, id=payer_id)
 
-        # 2. Save the Expense record for history/tracking
-        Expense.objects.create(
-            trip=trip,
-            description=description,
-            amount=amount,
-            paid_by=payer,
-            category=request.POST.get('category')
-        )
-
-        # 3. Calculation Logic: Calculate the individual share
-        members = trip.members.all()
-        num_members = members.count()
-        
-        if num_members > 0:
-            share = amount / num_members
-
-            # 4. Update "Who owes Whom"
-            # We loop through everyone. If they aren't the payer, they owe the payer money.
-            for member in members:
-                if member != payer:
-                    # get_or_create finds the specific debt link between these two people
-                    debt, created = Debt.objects.get_or_create(
-                        trip=trip,
-                        from_user=member,  # The Debtor
-                        to_user=payer      # The Creditor
-                    )
-                    # Add the new share to their existing debt
-                    debt.amount += share
-                    debt.save()
+        # 2. Who shares it, and how: equally, by shares, by percentage or in exact
+        # amounts, between the members ticked on the form (everyone if nobody is)
+        method = request.POST.get('split_method', 'equal')
+        member_ids = [int(user_id) for user_id in request.POST.getlist('split_members') if user_id.isdigit()]
+        values = None
+        if method != 'equal':
+            values = {user_id: request.POST.get(f'split_value_{user_id}') for user_id in member_ids}
+
+        # 3. Save the Expense and post everyone's share in one transaction.
+        # Balances are incremented in the database, in bulk, and "who owes whom" is
+        # re-planned from them under the trip's lock, so members adding expenses at
+        # the same time can't lose each other's updates.
+        try:
+            create_expense(trip, payer, amount, description, request.POST.get('category'),
+                           Split(method, member_ids, values), currency)
+        except (SplitError, MissingRate, TripArchived) as error:
+            return render(request, 'expenses/add_expense.html', {
+                'trip': trip, 'split_methods': SPLIT_METHODS, 'currencies': CURRENCIES, 'error': str(error),
+            }, status=400)
 
         # Redirect to the dashboard to see the updated calculations
         return redirect('trip_dashboard', trip_id=trip.id)
 
     # Show the expense form
-    return render(request, 'expenses/add_expense.html', {'trip': trip})
+    return render(request, 'expenses/add_expense.html', {
+        'trip': trip, 'split_methods': SPLIT_METHODS, 'currencies': CURRENCIES,
+    })
 
 
 # 3. TRIP DASHBOARD VIEW
 # This view pulls all the data together to show the final "Who owes Whom" list.
-def trip_dashboard(request, trip_id):
-    # Get the trip details
-    trip = get_object_or_404(Trip, id=trip_id)
-
-    # Get all non-zero debts for this trip
-    debts = Debt.objects.filter(trip=trip).exclude(amount=0)
+# Pages are cached per trip version and viewer, and a client polling with the
+# ETag of the current version just gets a 304 without touching the database.
+# The read-heavy pages are async: under ASGI one worker serves many polling
+# clients while their queries are in flight.
+# Views of one trip run under sharding.trip_view, which sends the trip's
+# queries to its shard when trips are sharded.
+def with_user(view):
+    """
+    Load request.user through the async ORM up front, so the synchronous parts
+    (ETag checks, templates) never hit the database from the event loop.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        request.user = await request.auser()
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+def trip_etag(request, trip_id):
+    viewer = viewer_token(request)
+    if viewer is None:
+        return None
+    return f"{trip_id}-{trip_version(trip_id)}-{viewer}"
+
+@with_user
+@condition(etag_func=trip_etag)
+async def trip_dashboard(request, trip_id):
+    viewer = viewer_token(request)
+    key = dashboard_key(trip_id, await atrip_version(trip_id), viewer) if viewer else None
+    if key:
+        html = await cache.aget(key)
+        if html is not None:
+            return HttpResponse(html)
+
+    # Only a page that isn't cached needs to know the trip's shard
+    response = await render_trip_dashboard(request, trip_id=trip_id)
+    if key:
+        await cache.aset(key, response.content, TRIP_PAGE_TIMEOUT)
+    return response
+
+RECENT_PAYMENTS = 10
+
+@sharding.trip_view
+async def render_trip_dashboard(request, trip_id):
+    # Get the trip details (with its creator, which the template checks)
+    trip = await aget_object_or_404(Trip.objects.select_related('created_by'), id=trip_id)
+
+    # The settlement plan (from everyone's net balance), the members, the reminders
+    # worked out for the plan in the background, the first page of the expense
+    # history (with payers) and the latest payments don't depend on each other, so
+    # fetch them all at once; the rest of the history loads on scroll
+    transfers, members, stored_reminders, (expenses, next_cursor), payments = await asyncio.gather(
+        asettlement_plan(trip),
+        alist(trip.members.all()),
+        alist(Reminder.objects.filter(trip=trip)),
+        aexpense_page(trip),
+        alist(Payment.objects.filter(trip=trip).select_related('from_user', 'to_user')
+              .order_by('-created_at')[:RECENT_PAYMENTS]),
+    )
+
+    # Look members up in memory from here on
+    users = {user.id: user for user in members}
+    total_members = len(members)
+    missing = ({t.debtor_id for t in transfers} | {t.creditor_id for t in transfers}) - users.keys()
+    if missing:
+        # Balances can outlive a membership; fetch those people too
+        users.update(await User.objects.ain_bulk(missing))
+
+    # Reminder text and WhatsApp links come precomputed; only payments the
+    # background refresh hasn't caught up with yet are worked out here
+    stored = {(r.debtor_id, r.creditor_id, r.amount): r for r in stored_reminders}
+    stale = [t for t in transfers if (t.debtor_id, t.creditor_id, t.amount) not in stored]
+    if stale:
+        trip_members = await alist(TripMember.objects.filter(trip=trip))
+        for r in reminders.build(trip, stale, users, trip_members):
+            stored[(r.debtor_id, r.creditor_id, r.amount)] = r
 
-    # Prepare debt data with WhatsApp links
     simplified_debts = []
-    for debt in debts:
-        # Get the debtor's TripMember info - try by user first, then by name
-        whatsapp_number = None
-        try:
-            # Try to find by user
-            trip_member = TripMember.objects.get(trip=trip, user=debt.from_user)
-            whatsapp_number = trip_member.whatsapp_number
-        except TripMember.DoesNotExist:
-            try:
-                # Try to find by name
-                trip_member = TripMember.objects.get(trip=trip, name=debt.from_user.username)
-                whatsapp_number = trip_member.whatsapp_number
-            except TripMember.DoesNotExist:
-                whatsapp_number = None
-
-        # Get display names (first_name for temp users, username for regular)
-        debtor_name = debt.from_user.first_name if debt.from_user.first_name else debt.from_user.username
-        creditor_name = debt.to_user.first_name if debt.to_user.first_name else debt.to_user.username
-        
-        # Generate WhatsApp message
-        message = f"Hey {debtor_name}, just a friendly nudge from SplitEase! 🌍 Regarding our trip {trip.name}, {creditor_name} covered an expense and your share comes to ₹{debt.amount}. Check the home dashboard of SplitEase for the full breakdown whenever you're free. Thanks! 🤝"
-
+    for transfer in transfers:
+        reminder = stored[(transfer.debtor_id, transfer.creditor_id, transfer.amount)]
         simplified_debts.append({
-            'debtor': debt.from_user,
-            'creditor': debt.to_user,
-            'debtor_id': debt.from_user.id,
-            'creditor_id': debt.to_user.id,
-            'amount': debt.amount,
-            'whatsapp_number': whatsapp_number,
-            'message': message,
+            'debtor': users[transfer.debtor_id],
+            'creditor': users[transfer.creditor_id],
+            'debtor_id': transfer.debtor_id,
+            'creditor_id': transfer.creditor_id,
+            'amount': transfer.amount,
+            'whatsapp_url': reminder.whatsapp_url,
+            'message': reminder.message,
         })
 
     # Calculate remaining people to pay
@@ -188,25 +218,184 @@ def trip_dashboard(request, trip_id):
 
     context = {
         'trip': trip,
+        'expenses': expenses,
+        'next_cursor': next_cursor,
+        'members': members,
+        'categories': Expense.CATEGORIES,
         'simplified_debts': simplified_debts,
+        'payments': payments,
         'remaining_to_pay': remaining_to_pay,
-        'total_members': trip.members.count(),
+        'total_members': total_members,
     }
     return render(request, 'expenses/dashboard.html', context)
 
+@with_user
+@login_required
+@condition(etag_func=trip_etag)
+@sharding.trip_view
+async def trip_summary_json(request, trip_id):
+    """Polling-friendly JSON summary of a trip, cached until the trip changes"""
+    key = trip_summary_key(trip_id, await atrip_version(trip_id))
+    summary = await cache.aget(key)
+    if summary is None:
+        trip = await aget_object_or_404(Trip, id=trip_id)
+        summary = await atrip_summary(trip)
+        await cache.aset(key, summary, TRIP_PAGE_TIMEOUT)
+    if not any(member['id'] == request.user.id for member in summary['members']):
+        raise Http404("Not a member of this trip")
+    return JsonResponse(summary)
+
+def expense_json(expense):
+    payer = expense.paid_by
+    return {
+        'id': expense.id,
+        'description': expense.description,
+        'amount': str(expense.amount),
+        'currency': expense.currency,
+        'display_amount': display(expense.amount, expense.currency),
+        'category': expense.category,
+        'date': expense.date.isoformat() if expense.date else None,
+        'paid_by': payer.id,
+        'paid_by_name': payer.first_name or payer.username,
+    }
+
+@login_required
+@sharding.trip_view
+def trip_expenses_json(request, trip_id):
+    """
+    Expense history for infinite scroll: /trip/<id>/expenses/?cursor=...&category=...&payer=...
+    Only members of the trip can read it.
+    """
+    trip = get_object_or_404(Trip, id=trip_id, members=request.user)
+    try:
+        limit = min(int(request.GET.get('limit', PAGE_SIZE)), MAX_PAGE_SIZE)
+        expenses, next_cursor = expense_page(
+            trip,
+            cursor=request.GET.get('cursor'),
+            category=request.GET.get('category'),
+            payer_id=request.GET.get('payer'),
+            limit=max(limit, 1),
+        )
+    except ValueError:
+        # Covers a bad limit or payer as well as an InvalidCursor
+        return JsonResponse({'error': 'Invalid cursor or filter.'}, status=400)
+
+    return JsonResponse({
+        'results': [expense_json(expense) for expense in expenses],
+        'next': next_cursor,
+    })
+
+@login_required
+def export_trip_csv(request, trip_id):
+    """Download one section of a trip (?section=expenses|balances|settlements|payments) as CSV"""
+    trip = get_object_or_404(Trip, id=trip_id, members=request.user)
+    section = request.GET.get('section', 'expenses')
+    if section not in SECTIONS:
+        raise Http404("Unknown export section")
+    response = StreamingHttpResponse(stream_csv(trip, section), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="trip-{trip.id}-{section}.csv"'
+    return response
+
+@login_required
+def export_trip_ndjson(request, trip_id):
+    """Download the whole trip as newline-delimited JSON"""
+    trip = get_object_or_404(Trip, id=trip_id, members=request.user)
+    response = StreamingHttpResponse(stream_ndjson(trip), content_type='application/x-ndjson')
+    response['Content-Disposition'] = f'attachment; filename="trip-{trip.id}.ndjson"'
+    return response
+
+# 6. SPENDING ANALYTICS
+# Breakdowns per category, day and payer, read from the rollup table only
+@login_required
+@sharding.trip_view
+def trip_analytics(request, trip_id):
+    trip = get_object_or_404(Trip, id=trip_id, members=request.user)
+    return render(request, 'expenses/analytics.html', {'trip': trip, 'analytics': analytics.trip_breakdown(trip)})
+
+@login_required
+@sharding.trip_view
+def trip_analytics_json(request, trip_id):
+    trip = get_object_or_404(Trip, id=trip_id, members=request.user)
+    return JsonResponse(analytics.trip_breakdown(trip))
+
+@login_required
+def my_analytics(request):
+    """Spending across all of the user's trips, in the home currency"""
+    return render(request, 'expenses/analytics.html', {'analytics': analytics.user_breakdown(request.user)})
+
+@login_required
+def my_analytics_json(request):
+    return JsonResponse(analytics.user_breakdown(request.user))
+
+# 7. DELTA SYNC
+# Mobile clients keep a cursor and fetch only what changed since (see changelog.py)
+@login_required
+def sync(request):
+    """/sync/?since=<cursor>&limit=...; no cursor gets a full snapshot of the user's trips"""
+    try:
+        since = request.GET.get('since')
+        since = int(since) if since else None
+        limit = min(int(request.GET.get('limit', changelog.SYNC_LIMIT)), changelog.MAX_SYNC_LIMIT)
+        if limit < 1 or (since is not None and since < 0):
+            raise ValueError
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cursor or limit.'}, status=400)
+    return JsonResponse(changelog.sync(request.user, since=since, limit=limit))
+
+# 8. EXPENSE SEARCH
+# Ranked full-text search over every trip the user is in (see search.py)
+@login_required
+def search_expenses(request):
+    """/search/?q=...&page=...; best matches first"""
+    try:
+        page = int(request.GET.get('page', 1))
+        limit = min(int(request.GET.get('limit', search.PAGE_SIZE)), search.MAX_PAGE_SIZE)
+        if page < 1 or limit < 1:
+            raise ValueError
+    except ValueError:
+        return JsonResponse({'error': 'Invalid page or limit.'}, status=400)
+    expenses, has_next = search.search(request.user, request.GET.get('q', ''), page=page, limit=limit)
+    return JsonResponse({
+        'results': [{**expense_json(expense), 'trip': expense.trip_id, 'trip_name': expense.trip.name}
+                    for expense in expenses],
+        'next': page + 1 if has_next else None,
+    })
+
+def metrics_view(request):
+    """Prometheus scrape endpoint for the request histograms"""
+    if not (request.user.is_staff or request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS):
+        raise Http404
+    return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4')
+
 @login_required
 def settle_debt(request, debt_id):
-    # Find the specific debt relationship
-    debt = get_object_or_404(Debt, id=debt_id)
-    
-    # Logic: Mark as paid by setting amount to 0
+    """
+    Settle the planned payment a Debt row stands for, all of it.
+    Only the creditor can confirm settlement, as in settle_debt_simplified.
+    """
+    # Find the specific debt relationship, on whichever shard its trip is
+    debt = sharding.locate(Debt.objects.select_related('from_user'), id=debt_id)
+    if debt is None:
+        raise Http404("No such debt")
+    trip = debt.trip
+
+    # Security: Only the creditor can mark debt as settled
+    if request.user.id != debt.to_user_id:
+        messages.error(request, "Only the person who is owed money can confirm settlement.")
+        return redirect('trip_dashboard', trip_id=trip.id)
+
     if request.method == "POST":
-        debt.amount = 0
-        debt.save()
-        
-    return redirect('trip_dashboard', trip_id=debt.trip.id)
+        # Paid against the trip's current plan, so a pair that has netted out records nothing
+        settled = settle_transfer(trip, debt.from_user_id, debt.to_user_id)
+        if settled is None:
+            messages.info(request, f"Nothing left for {debt.from_user.username} to pay you on this trip.")
+        else:
+            messages.success(request, f"Payment of {display(settled, trip.base_currency)} from {debt.from_user.username} confirmed!")
+
+    return redirect('trip_dashboard', trip_id=trip.id)
 
 @login_required
+@sharding.trip_view
 def settle_debt_simplified(request, trip_id, debtor_id, creditor_id):
     """
     Simplified settlement for net debt calculation.
@@ -222,53 +411,74 @@ def settle_debt_simplified(request, trip_id, debtor_id, creditor_id):
         return redirect('trip_dashboard', trip_id=trip.id)
     
     if request.method == "POST":
-        # Find and settle all debts from debtor to creditor
-        debts = Debt.objects.filter(trip=trip, from_user=debtor, to_user=creditor)
-        for debt in debts:
-            debt.amount = 0
-            debt.save()
-        
-        messages.success(request, f"Payment from {debtor.username} confirmed as settled!")
+        # Pay the planned transfer, in full or just the amount entered; the rest stays planned
+        amount = request.POST.get('amount', '').strip()
+        try:
+            settled = settle_transfer(trip, debtor.id, creditor.id, Money.from_rupees(amount) if amount else None)
+        except PaymentError as error:
+            messages.error(request, str(error))
+            return redirect('trip_dashboard', trip_id=trip.id)
+        except (InvalidOperation, ValueError):
+            messages.error(request, "Enter the amount paid, like 250 or 99.50.")
+            return redirect('trip_dashboard', trip_id=trip.id)
+        if settled is None:
+            messages.info(request, f"Nothing left for {debtor.username} to pay you on this trip.")
+        else:
+            messages.success(request, f"Payment of {display(settled, trip.base_currency)} from {debtor.username} confirmed!")
     
     return redirect('trip_dashboard', trip_id=trip.id)
 
 @login_required
-def home(request):
-    # 1. Get all trips the user belongs to
-    my_trips = request.user.trips.all()
-
-    # 2. Get specific debts
-    to_pay_list = Debt.objects.filter(from_user=request.user).exclude(amount=0)
-    to_receive_list = Debt.objects.filter(to_user=request.user).exclude(amount=0)
-
-    # 3. Calculate Totals for the Dashboard
-    total_to_pay = to_pay_list.aggregate(Sum('amount'))['amount__sum'] or 0
-    total_to_receive = to_receive_list.aggregate(Sum('amount'))['amount__sum'] or 0
+@sharding.trip_view
+def settle_trip(request, trip_id):
+    """Record every payment in the settlement plan at once. Only the trip's creator can."""
+    trip = get_object_or_404(Trip, id=trip_id, members=request.user)
+    if trip.created_by not in (None, request.user):
+        messages.error(request, "Only the person who created the trip can settle everything at once.")
+    elif request.method == "POST":
+        paid = settle_all(trip)
+        if paid:
+            messages.success(request, f"Recorded {len(paid)} payments. Everyone is settled up!")
+        else:
+            messages.info(request, "Everyone is already settled up.")
+    return redirect('trip_dashboard', trip_id=trip.id)
 
-    # 4. Check which trips the user has paid expenses for
-    trip_payer_status = {}
-    for trip in my_trips:
-        has_paid = Expense.objects.filter(trip=trip, paid_by=request.user).exists()
-        trip_payer_status[trip.id] = has_paid
+@login_required
+def archive_trip(request, trip_id):
+    """Move a finished trip's expenses to the archive. Only the trip's creator can."""
+    trip = get_object_or_404(Trip, id=trip_id, members=request.user)
+    if trip.created_by not in (None, request.user):
+        messages.error(request, "Only the person who created the trip can archive it.")
+    elif request.method == "POST":
+        try:
+            moved = archive.archive_trip(trip)
+        except TripArchived:
+            messages.info(request, f"{trip.name} is already archived.")
+        else:
+            messages.success(request, f"Archived {trip.name} and its {moved} expenses.")
+    return redirect('trip_dashboard', trip_id=trip.id)
 
-    context = {
-        'my_trips': my_trips,
-        'to_pay': to_pay_list,
-        'to_receive': to_receive_list,
-        'total_to_pay': total_to_pay,
-        'total_to_receive': total_to_receive,
-        'trip_payer_status': trip_payer_status,
-    }
+@with_user
+@login_required
+async def home(request):
+    # Trips, member counts, payer flags, balances and payments to make come from one
+    # summary that is cached per user and dropped whenever one of their trips changes
+    key = home_key(request.user.id)
+    context = await cache.aget(key)
+    if context is None:
+        context = await ahome_summary(request.user)
+        await cache.aset(key, context, HOME_TIMEOUT)
     return render(request, 'expenses/home.html', context)
 
 def delete_expense(request, expense_id):
-    expense = get_object_or_404(Expense, id=expense_id)
+    expense = sharding.locate(Expense.objects.all(), id=expense_id)
+    if expense is None:
+        raise Http404("No such expense")
     trip_id = expense.trip.id # Save ID to redirect back
     
     if request.method == "POST":
-        # Professional logic: Adjust the debts before deleting the expense
-        # For simplicity in this hackathon stage, we just remove the record
-        expense.delete()
+        # Reverse the expense's ledger entries so balances and debts go back exactly
+        reverse_expense(expense)
         return redirect('trip_dashboard', trip_id=trip_id)
     
     return redirect('trip_dashboard', trip_id=trip_id)
@@ -6,7 +6,9 @@ import sys
 
 def main():
     """Run administrative tasks."""
-    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'splitease.settings')
+    # The test suite runs against its own settings (splitease.test_settings)
+    settings = 'splitease.test_settings' if sys.argv[1:2] == ['test'] else 'splitease.settings'
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings)
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc:
@@ -42,6 +42,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover the rest of the stack
+    'expenses.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -53,6 +55,15 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'splitease.urls'
 
+# Request profiling (expenses.middleware.ProfilingMiddleware)
+# Fraction of requests to run under cProfile; 0 turns sampling off
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', '0'))
+# Sampled requests slower than this (in milliseconds) get their stats dumped
+PROFILING_SLOW_MS = 500
+PROFILING_DUMP_DIR = BASE_DIR / 'profiles'
+# Who may read /metrics besides staff users
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -78,9 +89,82 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # File-backed test database so threaded tests share real SQLite locking
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
+# SQLite tuned for several worker processes. WAL lets readers carry on while
+# one writer commits, and BEGIN IMMEDIATE takes the write lock when a
+# transaction starts, so concurrent writers queue on the busy timeout instead
+# of failing with "database is locked" when a read lock can't be upgraded.
+SQLITE_PRODUCTION_OPTIONS = {
+    'init_command': (
+        'PRAGMA journal_mode=WAL;'
+        'PRAGMA synchronous=NORMAL;'      # WAL is still crash-safe; skips an fsync per commit
+        'PRAGMA cache_size=-32000;'       # 32 MB page cache per connection
+        'PRAGMA mmap_size=268435456;'     # read through a 256 MB memory map
+        'PRAGMA temp_store=MEMORY;'
+        'PRAGMA busy_timeout=20000;'
+    ),
+    'transaction_mode': 'IMMEDIATE',
+    'timeout': 20,
+}
+
+# SPLITEASE_DB_PROFILE=production switches it on, with connections kept open
+# between requests (SPLITEASE_CONN_MAX_AGE seconds, default 10 minutes)
+if os.environ.get('SPLITEASE_DB_PROFILE') == 'production':
+    DATABASES['default']['OPTIONS'] = SQLITE_PRODUCTION_OPTIONS
+    DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('SPLITEASE_CONN_MAX_AGE', '600'))
+    DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
+# Trip sharding (expenses.sharding). With SPLITEASE_SHARDS=N each trip's
+# expenses, debts, members and ledger live in one of N more SQLite files, so
+# writes to trips on different shards don't wait on each other. Users, trips
+# and everything else stay in default. Off (0) by default; after turning it on,
+# run `migrate --database shardN` for each shard and then `rebalance_shards`.
+TRIP_SHARDS = [f'shard{number}' for number in range(1, int(os.environ.get('SPLITEASE_SHARDS', '0')) + 1)]
+for alias in TRIP_SHARDS:
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'NAME': BASE_DIR / f'{alias}.sqlite3',
+        'TEST': {'NAME': BASE_DIR / f'test_{alias}.sqlite3'},
+    }
+DATABASE_ROUTERS = ['expenses.sharding.TripShardRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+# File-based so every worker process sees the same trip versions and invalidations
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'django_cache',
+    }
+}
+
+# Exchange rates (expenses.fx)
+# CSV of date,currency,rate (what one unit is worth in rupees) read by load_fx_rates
+FX_RATES_FILE = BASE_DIR / 'fx_rates.csv'
+# How many (currency, day) rates each process keeps in its LRU cache
+FX_CACHE_SIZE = 4096
+# Currency of the home page totals, which can span trips in several currencies
+HOME_CURRENCY = os.environ.get('SPLITEASE_HOME_CURRENCY', 'INR')
+
+# Debt reminders (expenses.reminders), sent by the manage.py run_jobs worker
+# Where they go: notify.EmailSender through EMAIL_BACKEND, or notify.FileSender,
+# which writes each one to REMINDER_OUTBOX
+REMINDER_SENDER = os.environ.get('SPLITEASE_REMINDER_SENDER', 'expenses.notify.FileSender')
+REMINDER_OUTBOX = BASE_DIR / 'outbox'
+# How long to wait before reminding someone of the same payment again
+REMINDER_INTERVAL_HOURS = 6
+# Base of the links in reminder emails
+SITE_URL = os.environ.get('SPLITEASE_SITE_URL', 'http://localhost:8000')
+DEFAULT_FROM_EMAIL = os.environ.get('SPLITEASE_FROM_EMAIL', 'SplitEase <reminders@splitease.local>')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -0,0 +1,24 @@
+"""
+Settings for running the test suite: manage.py test picks them up unless
+DJANGO_SETTINGS_MODULE says otherwise.
+"""
+
+from .settings import *  # noqa: F401,F403
+
+# Tests keep their cache in memory rather than in the dev server's django_cache
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Shard databases for ShardingTests, which turn sharding on for themselves with
+# override_settings(TRIP_SHARDS=TEST_TRIP_SHARDS). The rest of the suite runs
+# sharded only under SPLITEASE_SHARDS.
+TEST_TRIP_SHARDS = [f'shard{number}' for number in range(1, max(len(TRIP_SHARDS), 2) + 1)]
+for alias in TEST_TRIP_SHARDS:
+    DATABASES.setdefault(alias, {
+        **DATABASES['default'],
+        'NAME': BASE_DIR / f'{alias}.sqlite3',
+        'TEST': {'NAME': BASE_DIR / f'test_{alias}.sqlite3'},
+    })